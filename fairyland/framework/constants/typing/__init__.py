@@ -17,4 +17,4 @@ from psycopg2.extensions import cursor
 TypeLogLevel = Literal["TRACE", "DEBUG", "INFO", "SUCCESS", "WARNING", "ERROR", "CRITICAL"]
 
 TypeSQLConnection = Union[Connection, connection]
-TypeSQLCursor = Union[Cursor, Connection]
+TypeSQLCursor = Union[Cursor, cursor]
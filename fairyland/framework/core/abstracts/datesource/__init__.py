@@ -8,3 +8,14 @@
 """
 
 from ._basic import DataSource
+from ._pool import ConnectionPool
+from ._cache import QueryCache
+from ._metrics import QueryMetrics
+from ._async import AsyncDataSource
+from ._async import AsyncConnectionPool
+from ._formats import Columns
+from ._formats import Record
+from ._pagination import Page
+from ._export import read_columnar
+from ._buffer import WriteBuffer
+from ._admission import AdmissionController
@@ -0,0 +1,231 @@
+# coding: utf8
+"""
+@software: PyCharm
+@author: Lionel Johnson
+@contact: https://fairy.host
+@organization: https://github.com/FairylandFuture
+@since: 03 05, 2024
+"""
+
+from typing import Any, Deque, Dict, Iterator, List, Optional, Sequence
+from collections import deque
+import contextlib
+import threading
+import time
+
+from fairyland.framework.modules.journals import journal
+from fairyland.framework.modules.exceptions import DataSourceError
+
+from ._metrics import _StatementStats
+from ._metrics import _bucket
+
+
+class _Waiter:
+
+    __slots__ = ("priority", "event", "granted", "cancelled")
+
+    def __init__(self, priority: str) -> None:
+        self.priority = priority
+        self.event = threading.Event()
+        self.granted = False
+        self.cancelled = False
+
+
+class AdmissionController:
+    """Bounds the statements running concurrently against a database, waiters are admitted FIFO per priority class."""
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        max_wait: Optional[float] = None,
+        max_queue: Optional[int] = None,
+        priorities: Sequence[str] = ("interactive", "batch"),
+        limits: Optional[Dict[str, int]] = None,
+    ) -> None:
+        """
+        Initialize the controller, one instance can be shared by several data sources of the same server.
+
+        :param max_concurrency: Callers admitted at the same time.
+        :type max_concurrency: int
+        :param max_wait: Seconds a caller waits for admission before DataSourceError is raised, None waits indefinitely.
+        :type max_wait: Optional[float]
+        :param max_queue: Waiting callers at most, further callers fail at once.
+        :type max_queue: Optional[int]
+        :param priorities: Priority classes, highest first, the first one is the default.
+        :type priorities: Sequence[str]
+        :param limits: Concurrency cap per priority class, keeps slots free for higher classes.
+        :type limits: Optional[Dict[str, int]]
+        """
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be a positive integer.")
+        if not priorities:
+            raise ValueError("At least one priority class is required.")
+        unknown = set(limits or ()) - set(priorities)
+        if unknown:
+            raise ValueError(f"Limits for unknown priority classes: {sorted(unknown)}")
+        self.__max_concurrency = max_concurrency
+        self.__max_wait = max_wait
+        self.__max_queue = max_queue
+        self.__priorities = tuple(priorities)
+        self.__limits = {priority: (limits or {}).get(priority, max_concurrency) for priority in self.__priorities}
+        self.__lock = threading.Lock()
+        self.__local = threading.local()
+        self.__queues: Dict[str, Deque[_Waiter]] = {priority: deque() for priority in self.__priorities}
+        self.__active: Dict[str, int] = dict.fromkeys(self.__priorities, 0)
+        self.__running = 0
+        self.__waiting = 0
+        self.__waits: Dict[str, _StatementStats] = {priority: _StatementStats() for priority in self.__priorities}
+
+    @property
+    def max_concurrency(self) -> int:
+        return self.__max_concurrency
+
+    def __dispatch(self) -> None:
+        # Hand free slots to the oldest waiter of the highest class that is below its limit.
+        while self.__running < self.__max_concurrency:
+            for priority in self.__priorities:
+                queue = self.__queues[priority]
+                while queue and queue[0].cancelled:
+                    queue.popleft()
+                if queue and self.__active[priority] < self.__limits[priority]:
+                    waiter = queue.popleft()
+                    waiter.granted = True
+                    self.__waiting -= 1
+                    self.__running += 1
+                    self.__active[priority] += 1
+                    waiter.event.set()
+                    break
+            else:
+                return
+
+    def acquire(self, priority: Optional[str] = None, timeout: Optional[float] = None) -> None:
+        """
+        Wait for a slot, calls nested in a thread that already holds one pass through.
+
+        :param priority: Priority class, defaults to the class set with priority() or the first class.
+        :type priority: Optional[str]
+        :param timeout: Seconds to wait, defaults to max_wait.
+        :type timeout: Optional[float]
+        :return: None
+        :rtype: None
+        """
+        held: List[str] = getattr(self.__local, "held", None) or []
+        if held:
+            held.append(held[-1])
+            return
+        priority = priority or getattr(self.__local, "priority", None) or self.__priorities[0]
+        if priority not in self.__queues:
+            raise ValueError(f"Unknown priority class: {priority}")
+        timeout = self.__max_wait if timeout is None else timeout
+
+        start_time = time.monotonic()
+        waiter = _Waiter(priority)
+        with self.__lock:
+            if self.__max_queue is not None and self.__waiting >= self.__max_queue and self.__running >= self.__max_concurrency:
+                self.__waits[priority].errors += 1
+                raise DataSourceError(f"Admission queue is full ({self.__waiting} waiting).")
+            self.__queues[priority].append(waiter)
+            self.__waiting += 1
+            self.__dispatch()
+        if not waiter.granted and not waiter.event.wait(timeout):
+            with self.__lock:
+                if not waiter.granted:
+                    waiter.cancelled = True
+                    self.__waiting -= 1
+                    self.__waits[priority].errors += 1
+                    # A cancelled head can unblock a lower class.
+                    self.__dispatch()
+                    journal.warning(f"No database admission within {timeout}s for {priority} work.")
+                    raise DataSourceError(f"No database admission within {timeout}s, {self.__running} running, {self.__waiting} waiting.")
+
+        seconds = time.monotonic() - start_time
+        with self.__lock:
+            stats = self.__waits[priority]
+            stats.calls += 1
+            stats.seconds += seconds
+            stats.max_seconds = max(stats.max_seconds, seconds)
+            bucket = _bucket(seconds)
+            stats.buckets[bucket] = stats.buckets.get(bucket, 0) + 1
+        self.__local.held = [priority]
+
+    def release(self) -> None:
+        """
+        Give back the slot taken by acquire.
+
+        :return: None
+        :rtype: None
+        """
+        held: List[str] = getattr(self.__local, "held", None) or []
+        if not held:
+            raise RuntimeError("release() without acquire().")
+        priority = held.pop()
+        if held:
+            return
+        with self.__lock:
+            self.__running -= 1
+            self.__active[priority] -= 1
+            self.__dispatch()
+
+    @contextlib.contextmanager
+    def admitted(self, priority: Optional[str] = None, timeout: Optional[float] = None) -> Iterator[None]:
+        """
+        Hold a slot for the block, e.g. around several statements that should not queue individually.
+
+        :param priority: Priority class.
+        :type priority: Optional[str]
+        :param timeout: Seconds to wait, defaults to max_wait.
+        :type timeout: Optional[float]
+        :return: Context manager.
+        :rtype: Iterator[None]
+        """
+        self.acquire(priority, timeout)
+        try:
+            yield
+        finally:
+            self.release()
+
+    @contextlib.contextmanager
+    def priority(self, priority: str) -> Iterator[None]:
+        """
+        Run the statements of the block, in this thread, in a priority class.
+
+        :param priority: Priority class.
+        :type priority: str
+        :return: Context manager.
+        :rtype: Iterator[None]
+        """
+        if priority not in self.__queues:
+            raise ValueError(f"Unknown priority class: {priority}")
+        previous = getattr(self.__local, "priority", None)
+        self.__local.priority = priority
+        try:
+            yield
+        finally:
+            self.__local.priority = previous
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Running and waiting callers and queue time per priority class.
+
+        :return: Admission statistics, wait times in seconds.
+        :rtype: dict
+        """
+        with self.__lock:
+            return {
+                "max_concurrency": self.__max_concurrency,
+                "running": self.__running,
+                "waiting": self.__waiting,
+                "classes": {
+                    priority: {
+                        "running": self.__active[priority],
+                        "waiting": sum(not waiter.cancelled for waiter in self.__queues[priority]),
+                        "admitted": stats.calls,
+                        "rejected": stats.errors,
+                        "wait_mean": stats.seconds / stats.calls if stats.calls else 0.0,
+                        "wait_p50": stats.percentile(0.50),
+                        "wait_p99": stats.percentile(0.99),
+                        "wait_max": stats.max_seconds,
+                    }
+                    for priority, stats in self.__waits.items()
+                },
+            }
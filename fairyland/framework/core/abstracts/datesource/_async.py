@@ -0,0 +1,490 @@
+# coding: utf8
+"""
+@software: PyCharm
+@author: Lionel Johnson
+@contact: https://fairy.host
+@organization: https://github.com/FairylandFuture
+@since: 03 04, 2024
+"""
+
+from abc import abstractmethod
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple, Union
+import asyncio
+import contextvars
+import inspect
+import time
+
+from fairyland.framework.modules.journals import journal
+from fairyland.framework.modules.exceptions import DataSourceError
+
+from ._pool import _PooledConnection
+from ._pool import _PoolState
+
+
+async def _resolve(value: Any) -> Any:
+    """Await the value when the driver returned an awaitable, async drivers differ on which calls are coroutines."""
+    if inspect.isawaitable(value):
+        return await value
+    return value
+
+
+class AsyncConnectionPool:
+    """Connection pool for asyncio drivers, bound to the event loop it is first used on."""
+
+    def __init__(
+        self,
+        factory: Callable[[], Awaitable[Any]],
+        closer: Callable[[Any], Awaitable[None]],
+        min_size: int = 1,
+        max_size: int = 10,
+        timeout: float = 30.0,
+        max_idle: Optional[float] = 600.0,
+        max_lifetime: Optional[float] = 3600.0,
+        ping: Optional[Callable[[Any], Awaitable[bool]]] = None,
+    ) -> None:
+        """
+        Initialize the pool, connections are opened by open() or on the first acquire.
+
+        :param factory: Coroutine function that opens a new connection.
+        :type factory: Callable[[], Awaitable[Any]]
+        :param closer: Coroutine function that closes a connection.
+        :type closer: Callable[[Any], Awaitable[None]]
+        :param min_size: Connections kept open even when idle.
+        :type min_size: int
+        :param max_size: Upper bound of connections opened at the same time.
+        :type max_size: int
+        :param timeout: Seconds to wait for a free connection on checkout.
+        :type timeout: float
+        :param max_idle: Seconds after which surplus idle connections are closed, None disables it.
+        :type max_idle: Optional[float]
+        :param max_lifetime: Seconds after which a connection is recycled, None disables it.
+        :type max_lifetime: Optional[float]
+        :param ping: Health check run on checkout, returns False for a dead connection.
+        :type ping: Optional[Callable[[Any], Awaitable[bool]]]
+        """
+        self.__state = _PoolState(min_size, max_size, max_idle, max_lifetime)
+        self.__factory = factory
+        self.__closer = closer
+        self.__timeout = timeout
+        self.__ping = ping
+        self.__condition: Optional[asyncio.Condition] = None
+
+    @property
+    def __lock(self) -> asyncio.Condition:
+        # Created lazily so the pool can be built outside of a running loop.
+        if self.__condition is None:
+            self.__condition = asyncio.Condition()
+        return self.__condition
+
+    async def open(self) -> None:
+        """
+        Open the minimum number of connections.
+
+        :return: None
+        :rtype: None
+        """
+        await self.fill(self.__state.min_size)
+
+    async def fill(self, count: int) -> int:
+        """
+        Open idle connections until the pool holds at least count connections.
+
+        :param count: Target number of open connections.
+        :type count: int
+        :return: Number of connections opened.
+        :rtype: int
+        """
+        opened = 0
+        while True:
+            async with self.__lock:
+                if not self.__state.reserve(count):
+                    return opened
+            record = await self.__create()
+            async with self.__lock:
+                self.__state.idle.append(record)
+                self.__lock.notify()
+            opened += 1
+
+    async def __create(self) -> _PooledConnection:
+        try:
+            connection = await self.__factory()
+        except BaseException:
+            async with self.__lock:
+                self.__state.unreserve()
+                self.__lock.notify()
+            raise
+        self.__state.count("created")
+        return _PooledConnection(connection)
+
+    async def __close_quietly(self, record: _PooledConnection) -> None:
+        try:
+            await self.__closer(record.connection)
+        except Exception as error:
+            journal.warning(f"Failed to close pooled connection: {error}")
+
+    async def __discard(self, record: _PooledConnection) -> None:
+        async with self.__lock:
+            self.__state.discarded()
+            self.__lock.notify()
+        await self.__close_quietly(record)
+
+    async def __wait(self, deadline: float, timeout: float) -> Optional[_PooledConnection]:
+        """Pop an idle record or reserve a slot for a new connection, None means a slot was reserved."""
+        evicted: List[_PooledConnection] = []
+        try:
+            async with self.__lock:
+                while True:
+                    record, reserved = self.__state.take(evicted)
+                    if record is not None or reserved:
+                        return record
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.__state.count("timeouts")
+                        raise DataSourceError(f"Timed out after {timeout}s waiting for a pooled connection.")
+                    self.__state.count("waits")
+                    try:
+                        await asyncio.wait_for(self.__lock.wait(), remaining)
+                    except asyncio.TimeoutError:
+                        pass
+        finally:
+            for stale in evicted:
+                await self.__close_quietly(stale)
+
+    async def acquire(self, timeout: Optional[float] = None) -> Any:
+        """
+        Borrow a connection, opening a new one while below max size.
+
+        :param timeout: Seconds to wait, defaults to the pool timeout.
+        :type timeout: Optional[float]
+        :return: Driver connection.
+        :rtype: Any
+        """
+        timeout = self.__timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+
+        while True:
+            record = await self.__wait(deadline, timeout)
+            if record is None:
+                record = await self.__create()
+            elif self.__ping:
+                try:
+                    alive = await self.__ping(record.connection)
+                except BaseException:
+                    # Cancelled mid health check, the connection state is unknown.
+                    await asyncio.shield(asyncio.ensure_future(self.__discard(record)))
+                    raise
+                self.__state.count("pings")
+                if not alive:
+                    self.__state.count("ping_failures")
+                    journal.warning("Pooled connection failed the health check, discarding it.")
+                    await self.__discard(record)
+                    continue
+
+            self.__state.checked_out(record)
+            return record.connection
+
+    async def release(self, connection: Any, discard: bool = False) -> None:
+        """
+        Return a borrowed connection to the pool.
+
+        :param connection: Connection obtained from acquire.
+        :type connection: Any
+        :param discard: Close the connection instead of reusing it.
+        :type discard: bool
+        :return: None
+        :rtype: None
+        """
+        record = self.__state.checked_in(connection)
+        if record is None:
+            return
+
+        now = time.monotonic()
+        if discard or self.__state.closed or self.__state.expired(record, now):
+            await self.__discard(record)
+            return
+
+        async with self.__lock:
+            self.__state.returned(record, now)
+            self.__lock.notify()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Snapshot of the pool counters.
+
+        :return: Pool statistics.
+        :rtype: dict
+        """
+        return self.__state.stats()
+
+    async def close(self) -> None:
+        """
+        Close idle connections, borrowed ones are closed when they come back.
+
+        :return: None
+        :rtype: None
+        """
+        async with self.__lock:
+            idle = self.__state.close()
+            self.__lock.notify_all()
+        for record in idle:
+            await self.__discard(record)
+
+
+class AsyncDataSource:
+    """asyncio counterpart of DataSource, connections always come from an AsyncConnectionPool."""
+
+    # Closing an unfinished server-side stream drains the remaining rows, the connection is dropped instead.
+    server_side_streams: bool = False
+
+    def __init__(
+        self,
+        pool_min_size: int = 1,
+        pool_max_size: int = 10,
+        pool_timeout: float = 30.0,
+        pool_max_idle: Optional[float] = 600.0,
+        pool_max_lifetime: Optional[float] = 3600.0,
+        pool_ping: bool = True,
+    ) -> None:
+        """
+        Initialize the data source, connections are opened by open() or on first use.
+
+        :param pool_min_size: Connections the pool keeps open.
+        :type pool_min_size: int
+        :param pool_max_size: Maximum connections the pool opens.
+        :type pool_max_size: int
+        :param pool_timeout: Seconds to wait for a free pooled connection.
+        :type pool_timeout: float
+        :param pool_max_idle: Seconds before surplus idle connections are closed.
+        :type pool_max_idle: Optional[float]
+        :param pool_max_lifetime: Seconds before a pooled connection is recycled.
+        :type pool_max_lifetime: Optional[float]
+        :param pool_ping: Run a health check when a pooled connection is checked out.
+        :type pool_ping: bool
+        """
+        self.__cursor = contextvars.ContextVar(f"fairyland_async_cursor_{id(self)}", default=None)
+        self.__pool = AsyncConnectionPool(
+            factory=self.connect,
+            closer=self.close_connection,
+            min_size=pool_min_size,
+            max_size=pool_max_size,
+            timeout=pool_timeout,
+            max_idle=pool_max_idle,
+            max_lifetime=pool_max_lifetime,
+            ping=self.ping if pool_ping else None,
+        )
+
+    @property
+    def cursor(self) -> Any:
+        # Bound to the running task, concurrent operate calls never share a cursor.
+        return self.__cursor.get()
+
+    @cursor.setter
+    def cursor(self, value: Any) -> None:
+        self.__cursor.set(value)
+
+    @abstractmethod
+    async def connect(self) -> Any:
+
+        raise NotImplementedError
+
+    @abstractmethod
+    async def execute(self, query, params) -> None:
+
+        raise NotImplementedError
+
+    async def open_cursor(self, connection: Any) -> Any:
+        """
+        Create a cursor on a connection.
+
+        :param connection: Driver connection.
+        :type connection: Any
+        :return: Driver cursor.
+        :rtype: Any
+        """
+        return await _resolve(connection.cursor())
+
+    async def stream_cursor(self, connection: Any, fetch_size: int) -> Any:
+        """
+        Create the cursor used by iterate, backends override it with an unbuffered / server-side cursor.
+
+        :param connection: Driver connection.
+        :type connection: Any
+        :param fetch_size: Rows fetched per round trip.
+        :type fetch_size: int
+        :return: Driver cursor.
+        :rtype: Any
+        """
+        return await self.open_cursor(connection)
+
+    async def close_cursor(self, cursor: Any) -> None:
+        await _resolve(cursor.close())
+
+    async def close_connection(self, connection: Any) -> None:
+        await _resolve(connection.close())
+
+    async def ping(self, connection: Any) -> bool:
+        """
+        Check that a connection is still usable.
+
+        :param connection: Driver connection.
+        :type connection: Any
+        :return: True if the connection answered.
+        :rtype: bool
+        """
+        try:
+            cursor = await self.open_cursor(connection)
+            try:
+                await _resolve(cursor.execute("SELECT 1"))
+                await _resolve(cursor.fetchall())
+            finally:
+                await self.close_cursor(cursor)
+        except Exception:
+            return False
+        return True
+
+    async def __abort(self, connection: Any, cursor: Any, discard: bool) -> None:
+        """Roll back and hand the connection back, run shielded so a cancelled task still cleans up."""
+        try:
+            await _resolve(connection.rollback())
+        except Exception as rollback_error:
+            journal.error(f"Rollback failed, discarding the connection: {rollback_error}")
+            discard = True
+        await self.__finish(connection, cursor, discard)
+
+    async def __finish(self, connection: Any, cursor: Any, discard: bool) -> None:
+        if cursor is not None and not discard:
+            try:
+                await self.close_cursor(cursor)
+            except Exception:
+                discard = True
+        await self.__pool.release(connection, discard=discard)
+
+    @staticmethod
+    async def __cleanup(coroutine: Awaitable[None]) -> None:
+        # If the caller is cancelled again the cleanup keeps running in the background.
+        await asyncio.shield(asyncio.ensure_future(coroutine))
+
+    async def __operate(self, sqls: Union[str, Iterable], params: Optional[Iterable] = None) -> Tuple:
+        connection = await self.__pool.acquire()
+        cursor = None
+        try:
+            cursor = await self.open_cursor(connection)
+            self.cursor = cursor
+            if isinstance(sqls, str):
+                journal.trace(f"SQL >> {sqls} | Params: {params}")
+                await self.execute(query=sqls, params=params)
+                results = await _resolve(cursor.fetchall())
+            elif isinstance(sqls, (list, tuple)):
+                tmp_list = []
+                for sql, param in zip(sqls, params):
+                    journal.trace(f"SQL >> {sql} | Params: {param}")
+                    await self.execute(query=sql, params=param)
+                    tmp_list.append(await _resolve(cursor.fetchall()))
+                results = tuple(tmp_list)
+            else:
+                raise TypeError("Wrong SQL statements type.")
+            await _resolve(connection.commit())
+        except BaseException as error:
+            # BaseException so that task cancellation also rolls back.
+            self.cursor = None
+            journal.warning("Failed to execute the rollback after an error occurred.")
+            journal.error(f"Error occurred during SQL operation: {error!r}")
+            await self.__cleanup(self.__abort(connection, cursor, discard=False))
+            raise
+        self.cursor = None
+        await self.__cleanup(self.__finish(connection, cursor, discard=False))
+        return results
+
+    async def operate(self, query: Union[str, Iterable], params: Optional[Iterable] = None) -> Tuple:
+
+        return await self.__operate(query, params)
+
+    async def __iterate(self, query: str, params: Optional[Iterable], fetch_size: int, batches: bool) -> AsyncIterator:
+        connection = await self.__pool.acquire()
+        cursor = None
+        exhausted = False
+        try:
+            cursor = await self.stream_cursor(connection, fetch_size)
+            self.cursor = cursor
+            journal.trace(f"SQL >> {query} | Params: {params}")
+            await self.execute(query=query, params=params)
+            self.cursor = None
+            while True:
+                rows = await _resolve(cursor.fetchmany(fetch_size))
+                if not rows:
+                    break
+                if batches:
+                    yield rows
+                else:
+                    for row in rows:
+                        yield row
+            exhausted = True
+            await _resolve(connection.commit())
+        except GeneratorExit:
+            # Closed early by the consumer, the transaction of the stream is rolled back before the connection is reused.
+            self.cursor = None
+            if self.server_side_streams:
+                await self.__cleanup(self.__finish(connection, None, discard=True))
+            else:
+                await self.__cleanup(self.__abort(connection, cursor, discard=False))
+            raise
+        except BaseException as error:
+            self.cursor = None
+            journal.error(f"Error occurred during SQL streaming: {error!r}")
+            discard = self.server_side_streams and not exhausted
+            await self.__cleanup(self.__abort(connection, None if discard else cursor, discard=discard))
+            raise
+        self.cursor = None
+        await self.__cleanup(self.__finish(connection, cursor, discard=False))
+
+    def iterate(self, query: str, params: Optional[Iterable] = None, fetch_size: int = 1000, batches: bool = False) -> AsyncIterator:
+        """
+        Stream the rows of a query without materialising the result set.
+
+        Close the generator with aclose() when leaving it early so the connection is returned.
+
+        :param query: SQL statement.
+        :type query: str
+        :param params: SQL parameters.
+        :type params: Optional[Iterable]
+        :param fetch_size: Rows fetched per round trip.
+        :type fetch_size: int
+        :param batches: Yield lists of up to fetch_size rows instead of single rows.
+        :type batches: bool
+        :return: Async generator of rows or row batches.
+        :rtype: AsyncIterator
+        """
+        if not isinstance(query, str):
+            raise TypeError("Wrong SQL statements type.")
+        if fetch_size < 1:
+            raise ValueError("fetch_size must be a positive integer.")
+        return self.__iterate(query, params, fetch_size, batches)
+
+    async def open(self) -> "AsyncDataSource":
+        """
+        Open the minimum number of pooled connections.
+
+        :return: The data source itself.
+        :rtype: AsyncDataSource
+        """
+        await self.__pool.open()
+        return self
+
+    def pool_stats(self) -> Dict[str, Any]:
+        """
+        Counters of the connection pool.
+
+        :return: Pool statistics.
+        :rtype: dict
+        """
+        return self.__pool.stats()
+
+    async def close(self) -> None:
+
+        await self.__pool.close()
+
+    async def __aenter__(self) -> "AsyncDataSource":
+        return await self.open()
+
+    async def __aexit__(self, exc_type, exc_value, traceback) -> None:
+        await self.close()
@@ -1,5 +1,5 @@
 # coding: utf8
-""" 
+"""
 @software: PyCharm
 @author: Lionel Johnson
 @contact: https://fairy.host
@@ -8,44 +8,514 @@
 """
 
 from abc import abstractmethod
-from typing import Iterable, Optional, Tuple, Union, List, Set, Dict, Any
+from typing import Iterable, Iterator, Optional, Tuple, Union, List, Set, Dict, Any, BinaryIO, Callable
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from datetime import datetime
+import contextlib
+import copy
+import gzip
+import os
+import queue
+import random
+import threading
+import time
 
 from fairyland.framework.constants.typing import TypeSQLConnection
 from fairyland.framework.constants.typing import TypeSQLCursor
 from fairyland.framework.modules.journals import journal
+from fairyland.framework.modules.exceptions import DataSourceError
+from fairyland.framework.modules.exceptions import SQLTimeoutError
+
+from ._pool import ConnectionPool
+from ._sql import batched_rows
+from ._sql import is_read_statement
+from ._sql import read_tables
+from ._sql import write_tables
+from ._cache import QueryCache
+from ._metrics import QueryMetrics
+from ._metrics import payload_size
+from ._formats import RESULT_FORMATS
+from ._formats import Columns
+from ._formats import ColumnsBuilder
+from ._formats import column_names
+from ._formats import row_factory
+from ._admission import AdmissionController
+from ._buffer import WriteBuffer
+from ._timeouts import Alarm
+from ._timeouts import watchdog
+from ._export import EXPORT_FORMATS
+from ._export import encoder
+from ._export import format_of
+from ._pagination import Page
+from ._pagination import decode_token
+from ._pagination import encode_token
+from ._pagination import key_positions
+from ._pagination import keyset_statement
+
+
+class _Transaction:
+    """Connection and savepoint depth of the transaction open on the current thread."""
+
+    __slots__ = ("connection", "depth", "tables")
+
+    def __init__(self, connection: TypeSQLConnection) -> None:
+        self.connection = connection
+        self.depth = 0
+        # Tables written inside the transaction, None once an unknown table was written.
+        self.tables: Optional[Set[str]] = set()
+
+
+def _copy_result(results: Any, result_format: Union[str, type], many: bool) -> Any:
+    """Copy of a cached result, callers can change their rows without changing the cached ones."""
+    if many:
+        return tuple(_copy_result(item, result_format, False) for item in results)
+    if isinstance(results, Columns):
+        return Columns(results.names, [column[:] for column in results.data], [mask[:] if mask is not None else None for mask in results.nulls], results.rows)
+    if result_format in ("tuples", "namedtuple"):
+        # The rows are immutable, only the list most drivers return from fetchall is copied.
+        return list(results) if isinstance(results, list) else results
+    return tuple(map(copy.copy, results))
+
+
+_DISCONNECT_MESSAGES = (
+    "gone away",
+    "lost connection",
+    "server closed the connection",
+    "connection already closed",
+    "connection reset",
+    "broken pipe",
+    "terminating connection",
+)
 
 
 class DataSource:
 
-    def __init__(self) -> None:
+    # Closing an unfinished server-side stream drains the remaining rows, the connection is dropped instead.
+    server_side_streams: bool = False
+    # Parameter marker of the driver.
+    placeholder: str = "%s"
+    # Statement size used when the backend cannot report its own limit.
+    default_statement_size: int = 1024 * 1024
+    # Rows per fetchmany when building a columns result.
+    columns_fetch_size: int = 1000
+    # Seconds past a statement timeout before the client cancels, lets a server-side limit fire first.
+    cancel_grace: float = 0.0
+    # A cancel can hit the next statement of the connection, so a cancelled connection is closed.
+    discard_after_cancel: bool = True
+
+    def __init__(
+        self,
+        pooling: bool = False,
+        pool_min_size: int = 1,
+        pool_max_size: int = 10,
+        pool_timeout: float = 30.0,
+        pool_max_idle: Optional[float] = 600.0,
+        pool_max_lifetime: Optional[float] = 3600.0,
+        pool_ping: bool = True,
+        ping_idle: float = 0.0,
+        query_cache: Optional[QueryCache] = None,
+        cache_reads: bool = True,
+        autocommit: bool = False,
+        reuse_cursor: bool = False,
+        metrics: Optional[QueryMetrics] = None,
+        retry_reads: bool = True,
+        reconnect_attempts: int = 3,
+        reconnect_backoff: float = 0.05,
+        reconnect_max_backoff: float = 2.0,
+        lazy: bool = False,
+        admission: Optional[AdmissionController] = None,
+        statement_timeout: Optional[float] = None,
+    ) -> None:
+        """
+        Initialize the data source.
+
+        :param pooling: Borrow connections from a thread-safe pool instead of holding a single one.
+        :type pooling: bool
+        :param pool_min_size: Connections the pool keeps open.
+        :type pool_min_size: int
+        :param pool_max_size: Maximum connections the pool opens.
+        :type pool_max_size: int
+        :param pool_timeout: Seconds to wait for a free pooled connection.
+        :type pool_timeout: float
+        :param pool_max_idle: Seconds before surplus idle connections are closed.
+        :type pool_max_idle: Optional[float]
+        :param pool_max_lifetime: Seconds before a pooled connection is recycled.
+        :type pool_max_lifetime: Optional[float]
+        :param pool_ping: Run a health check when a pooled connection is checked out.
+        :type pool_ping: bool
+        :param ping_idle: Only check connections idle for at least this many seconds, the single connection is only checked when it is positive.
+        :type ping_idle: float
+        :param query_cache: Result cache for read statements, writes through this data source invalidate it, mutable rows are copied per call.
+        :type query_cache: Optional[QueryCache]
+        :param cache_reads: Cache reads unless a call opts out, False makes caching opt-in per call.
+        :type cache_reads: bool
+        :param autocommit: Keep connections in autocommit mode, reads then skip the COMMIT round trip and writes open an explicit transaction.
+        :type autocommit: bool
+        :param reuse_cursor: Keep one cursor per connection across calls, it is only recreated after an error.
+        :type reuse_cursor: bool
+        :param metrics: Collector of per-statement latency, rows, bytes and slow queries.
+        :type metrics: Optional[QueryMetrics]
+        :param retry_reads: Run a read once more on a new connection when the connection was lost, outside transaction().
+        :type retry_reads: bool
+        :param reconnect_attempts: Extra attempts when opening a connection fails.
+        :type reconnect_attempts: int
+        :param reconnect_backoff: First delay between attempts, doubled after every failure shared by all threads.
+        :type reconnect_backoff: float
+        :param reconnect_max_backoff: Upper bound of the delay, each delay is drawn at random below it to spread out reconnect storms.
+        :type reconnect_max_backoff: float
+        :param lazy: Open connections on first use instead of in the constructor, see warm_up.
+        :type lazy: bool
+        :param admission: Concurrency limit every connection checkout waits for, a transaction holds its slot until it ends.
+        :type admission: Optional[AdmissionController]
+        :param statement_timeout: Default seconds an operate call may run before it is cancelled and rolled back.
+        :type statement_timeout: Optional[float]
+        """
+        self.__local = threading.local()
+        self.__lock = threading.RLock()
+        self.__connection: Optional[TypeSQLConnection] = None
+        self.__pool: Optional[ConnectionPool] = None
+        self.__query_cache = query_cache
+        self.__cache_reads = cache_reads
+        self.__autocommit = autocommit
+        self.__reuse_cursor = reuse_cursor
+        self.__metrics = metrics
+        self.__admission = admission
+        self.__statement_timeout = statement_timeout
+        self.__ping_idle = ping_idle if pool_ping else 0.0
+        self.__retry_reads = retry_reads
+        self.__reconnect_attempts = reconnect_attempts
+        self.__reconnect_backoff = reconnect_backoff
+        self.__reconnect_max_backoff = reconnect_max_backoff
+        # Consecutive failed connection attempts of all threads, drives the backoff.
+        self.__connect_failures = 0
+        self.__connection_used = 0.0
+        # id(connection) -> (connection, cursor), entries are dropped when the connection is closed.
+        self.__cursors: Dict[int, Tuple[TypeSQLConnection, TypeSQLCursor]] = {}
+        self.__cursors_lock = threading.Lock()
+        self.__lifecycle = {
+            "connections_opened": 0,
+            "connections_closed": 0,
+            "connections_lost": 0,
+            "connect_failures": 0,
+            "cursors_opened": 0,
+            "cursors_reused": 0,
+            "cursors_closed": 0,
+            "read_retries": 0,
+            "statements_cancelled": 0,
+        }
+        self.__executor: Optional[ThreadPoolExecutor] = None
+        self.__buffers: List[WriteBuffer] = []
 
-        self.__init_connect()
+        if pooling:
+            self.__pool = ConnectionPool(
+                factory=self.__connect,
+                min_size=pool_min_size,
+                max_size=pool_max_size,
+                timeout=pool_timeout,
+                max_idle=pool_max_idle,
+                max_lifetime=pool_max_lifetime,
+                ping=self.ping if pool_ping else None,
+                ping_idle=ping_idle,
+                closer=self.__close_raw,
+                lazy=lazy,
+            )
+        elif not lazy:
+            self.__init_connect()
 
         return
 
+    @property
+    def cursor(self) -> Optional[TypeSQLCursor]:
+        return getattr(self.__local, "cursor", None)
+
+    @cursor.setter
+    def cursor(self, value: Optional[TypeSQLCursor]) -> None:
+        self.__local.cursor = value
+
+    @property
+    def pooling(self) -> bool:
+        return self.__pool is not None
+
+    @property
+    def query_cache(self) -> Optional[QueryCache]:
+        return self.__query_cache
+
+    @property
+    def metrics(self) -> Optional[QueryMetrics]:
+        return self.__metrics
+
+    @property
+    def admission(self) -> Optional[AdmissionController]:
+        return self.__admission
+
     @abstractmethod
     def connect(self):
 
         raise NotImplemented
 
-    def __connect(self) -> TypeSQLCursor:
+    def __connect(self) -> TypeSQLConnection:
+
+        attempt = 0
+        while True:
+            try:
+                connection = self.connect()
+                break
+            except Exception as error:
+                attempt += 1
+                with self.__cursors_lock:
+                    self.__connect_failures += 1
+                    self.__lifecycle["connect_failures"] += 1
+                    failures = self.__connect_failures
+                if attempt > self.__reconnect_attempts:
+                    raise
+                # Full jitter keeps threads and processes from reconnecting in lockstep after a failover.
+                # The exponent is capped, a long outage would otherwise overflow the float conversion.
+                delay = random.uniform(0, min(self.__reconnect_backoff * 2 ** min(failures - 1, 32), self.__reconnect_max_backoff))
+                journal.warning(f"Failed to connect ({error}), retrying in {delay:.3f}s.")
+                time.sleep(delay)
+        with self.__cursors_lock:
+            self.__connect_failures = 0
+        if self.__autocommit:
+            self.set_autocommit(connection, True)
+        self.__count("connections_opened")
+        journal.debug("Database connection opened.")
+        return connection
+
+    def __count(self, name: str) -> None:
+        with self.__cursors_lock:
+            self.__lifecycle[name] += 1
+
+    def __close_raw(self, connection: TypeSQLConnection) -> None:
+        with self.__cursors_lock:
+            self.__cursors.pop(id(connection), None)
+        try:
+            connection.close()
+        finally:
+            self.__count("connections_closed")
+            journal.debug("Database connection closed.")
 
-        return self.connect()
+    def __open_cursor(self, connection: TypeSQLConnection) -> TypeSQLCursor:
+        if self.__reuse_cursor:
+            with self.__cursors_lock:
+                entry = self.__cursors.get(id(connection))
+            if entry is not None and entry[0] is connection:
+                self.__count("cursors_reused")
+                return entry[1]
+        cursor = connection.cursor()
+        self.__count("cursors_opened")
+        if self.__reuse_cursor:
+            with self.__cursors_lock:
+                self.__cursors[id(connection)] = (connection, cursor)
+        return cursor
 
     def __init_connect(self) -> None:
 
         self.__connection: TypeSQLConnection = self.__connect()
-        self.cursor: TypeSQLCursor = self.__connection.cursor()
+        self.cursor: TypeSQLCursor = self.__open_cursor(self.__connection)
 
         return
 
-    def __close_cursor(self) -> None:
+    def is_disconnect(self, error: Exception, connection: TypeSQLConnection) -> bool:
+        """
+        Whether an error means the connection is gone, override with the driver error codes.
+
+        :param error: Error raised by the driver.
+        :type error: Exception
+        :param connection: Connection the error was raised on, None when it is not known, e.g. for a failed connect.
+        :type connection: Optional[TypeSQLConnection]
+        :return: True when the connection cannot be used anymore.
+        :rtype: bool
+        """
+        if isinstance(error, ConnectionError):
+            return True
+        message = str(error).lower()
+        return any(pattern in message for pattern in _DISCONNECT_MESSAGES)
+
+    def is_timeout(self, error: Exception) -> bool:
+        """
+        Whether an error reports a statement cancelled by a timeout, override with the driver error codes.
+
+        :param error: Error raised by the driver.
+        :type error: Exception
+        :return: True for timeouts and cancelled statements.
+        :rtype: bool
+        """
+        return False
+
+    def limit_statement(self, connection: TypeSQLConnection, query: str, seconds: float) -> str:
+        """
+        Apply a server-side execution time limit to a statement, by default there is none.
+
+        :param connection: Connection the statement runs on.
+        :type connection: TypeSQLConnection
+        :param query: SQL statement.
+        :type query: str
+        :param seconds: Time limit.
+        :type seconds: float
+        :return: Statement to execute.
+        :rtype: str
+        """
+        return query
+
+    def cancel(self, connection: TypeSQLConnection) -> None:
+        """
+        Cancel the statement running on a connection, called from the watchdog thread.
+
+        Without an override a timed-out call raises SQLTimeoutError and rolls back once its statement returns.
+
+        :param connection: Connection of the running statement.
+        :type connection: TypeSQLConnection
+        :return: None
+        :rtype: None
+        """
+        raise NotImplementedError(f"{self.__class__.__name__} cannot cancel running statements.")
+
+    def __cancel(self, connection: TypeSQLConnection, timeout: float) -> None:
+        journal.warning(f"Statement exceeded its {timeout}s timeout, cancelling it.")
+        # Raising leaves the alarm unfired, e.g. for backends without cancel(), so the connection is kept.
+        self.cancel(connection)
+        self.__count("statements_cancelled")
+
+    def ping(self, connection: TypeSQLConnection) -> bool:
+        """
+        Check that a connection is still usable.
+
+        :param connection: Database connection.
+        :type connection: TypeSQLConnection
+        :return: True if the connection answered.
+        :rtype: bool
+        """
+        try:
+            cursor = connection.cursor()
+            try:
+                cursor.execute("SELECT 1")
+                cursor.fetchall()
+            finally:
+                cursor.close()
+        except Exception:
+            return False
+        return True
+
+    def stream_cursor(self, connection: TypeSQLConnection, fetch_size: int) -> TypeSQLCursor:
+        """
+        Create the cursor used by iterate, backends override it with an unbuffered / server-side cursor.
+
+        :param connection: Database connection.
+        :type connection: TypeSQLConnection
+        :param fetch_size: Rows fetched per round trip.
+        :type fetch_size: int
+        :return: Database cursor.
+        :rtype: TypeSQLCursor
+        """
+        return connection.cursor()
+
+    def set_autocommit(self, connection: TypeSQLConnection, autocommit: bool) -> None:
+        """
+        Switch the autocommit mode of a connection.
+
+        :param connection: Database connection.
+        :type connection: TypeSQLConnection
+        :param autocommit: Autocommit mode.
+        :type autocommit: bool
+        :return: None
+        :rtype: None
+        """
+        attribute = getattr(connection, "autocommit", None)
+        if callable(attribute):
+            attribute(autocommit)
+        else:
+            connection.autocommit = autocommit
+
+    def begin(self, connection: TypeSQLConnection) -> None:
+        """
+        Open an explicit transaction on a connection in autocommit mode.
+
+        :param connection: Database connection.
+        :type connection: TypeSQLConnection
+        :return: None
+        :rtype: None
+        """
+        self.__execute_control(connection, "BEGIN")
+
+    @staticmethod
+    def __execute_control(connection: TypeSQLConnection, statement: str) -> None:
+        journal.trace(f"SQL >> {statement}")
+        cursor = connection.cursor()
+        try:
+            cursor.execute(statement)
+        finally:
+            cursor.close()
+
+    def quote_identifier(self, name: str) -> str:
+        """
+        Quote a table or column name, dotted names are quoted part by part.
 
-        if self.cursor:
-            self.cursor.close()
+        :param name: Identifier.
+        :type name: str
+        :return: Quoted identifier.
+        :rtype: str
+        """
+        return ".".join('"' + part.replace('"', '""') + '"' for part in name.split("."))
+
+    def upsert_clause(self, key_columns: List[str], update_columns: List[str]) -> str:
+        """
+        Conflict clause appended to a multi-row INSERT by bulk_upsert, ON CONFLICT of PostgreSQL and SQLite.
+
+        :param key_columns: Columns of the primary key or unique index the rows collide on.
+        :type key_columns: List[str]
+        :param update_columns: Columns overwritten with the inserted values, none keeps existing rows unchanged.
+        :type update_columns: List[str]
+        :return: SQL clause.
+        :rtype: str
+        """
+        target = ", ".join(self.quote_identifier(column) for column in key_columns)
+        if not update_columns:
+            return f" ON CONFLICT ({target}) DO NOTHING"
+        assignments = ", ".join(f"{self.quote_identifier(column)} = EXCLUDED.{self.quote_identifier(column)}" for column in update_columns)
+        return f" ON CONFLICT ({target}) DO UPDATE SET {assignments}"
+
+    def max_statement_size(self, connection: TypeSQLConnection) -> int:
+        """
+        Largest statement the server accepts in bytes.
+
+        :param connection: Database connection.
+        :type connection: TypeSQLConnection
+        :return: Statement size limit.
+        :rtype: int
+        """
+        return self.default_statement_size
+
+    def column_typecode(self, type_code: Any) -> Optional[str]:
+        """
+        Map a cursor.description type code to an array typecode, "q" for integers and "d" for floats.
+
+        :param type_code: Driver type code.
+        :type type_code: Any
+        :return: array typecode, None lets the columns result infer it from the values.
+        :rtype: Optional[str]
+        """
+        return None
+
+    def __close_cursor(self, connection: Optional[TypeSQLConnection] = None, broken: bool = False) -> None:
+
+        cursor = self.cursor
+        if cursor:
             self.cursor = None
-            journal.warning("Database has disconnected the cursor.")
+            if self.__reuse_cursor and connection is not None:
+                with self.__cursors_lock:
+                    entry = self.__cursors.get(id(connection))
+                    if entry is not None and entry[1] is cursor:
+                        if not broken:
+                            # Kept open for the next call on this connection.
+                            return
+                        del self.__cursors[id(connection)]
+            try:
+                cursor.close()
+            except Exception as error:
+                if not broken:
+                    raise
+                journal.warning(f"Failed to close the cursor of a broken connection: {error}")
+            self.__count("cursors_closed")
 
         return
 
@@ -54,56 +524,1083 @@ class DataSource:
         self.__close_cursor()
 
         if self.__connection:
-            self.__connection.close()
+            self.__close_raw(self.__connection)
             self.__connection = None
 
+        if self.__pool:
+            self.__pool.close()
+
         return
 
     def __reconnect(self):
         if not self.__connection:
             self.__connection = self.__connect()
-            journal.warning("Database has been reconnected.")
 
         if not self.cursor:
-            self.cursor = self.__connection.cursor()
-            journal.warning("Database cursor has been reconnected.")
-        else:
-            journal.warning("The database and cursor are already connected.")
+            self.cursor = self.__open_cursor(self.__connection)
+
+    def __transaction(self) -> Optional[_Transaction]:
+        return getattr(self.__local, "transaction", None)
+
+    def __acquire(self) -> TypeSQLConnection:
+        transaction = self.__transaction()
+        if transaction:
+            if not self.cursor:
+                self.cursor = self.__open_cursor(transaction.connection)
+            return transaction.connection
+        return self.__checkout()
+
+    def __release(self, connection: TypeSQLConnection, discard: bool = False) -> None:
+        transaction = self.__transaction()
+        if transaction and transaction.connection is connection:
+            # Released when the transaction ends.
+            return
+        self.__checkin(connection, discard=discard)
+
+    def __managed(self, read_only: bool = False) -> bool:
+        """Whether the current call commits by itself, False inside transaction() and for autocommit reads."""
+        if self.__transaction():
+            return False
+        return not (self.__autocommit and read_only)
+
+    def __lost(self, connection: TypeSQLConnection, error: BaseException) -> bool:
+        if not isinstance(error, Exception) or not self.is_disconnect(error, connection):
+            return False
+        self.__count("connections_lost")
+        journal.warning(f"Database connection lost, discarding it: {error}")
+        return True
+
+    def __rollback(self, connection: TypeSQLConnection, error: Optional[BaseException] = None) -> bool:
+        """Roll back, returns True when the connection has to be discarded."""
+        if error is not None:
+            if self.__lost(connection, error):
+                return True
+            journal.warning("Failed to execute the rollback after an error occurred.")
+        try:
+            connection.rollback()
+        except Exception as rollback_error:
+            journal.error(f"Rollback failed, discarding the connection: {rollback_error}")
+            return True
+        return False
+
+    def __checkout(self) -> TypeSQLConnection:
+        if self.__admission is None:
+            return self.__checkout_connection()
+        self.__admission.acquire()
+        try:
+            return self.__checkout_connection()
+        except BaseException:
+            self.__admission.release()
+            raise
+
+    def __checkout_connection(self) -> TypeSQLConnection:
+        if self.__pool:
+            connection = self.__pool.acquire()
+            self.cursor = self.__open_cursor(connection)
+            return connection
+
+        self.__lock.acquire()
+        try:
+            connection = self.__connection
+            if connection and self.__ping_idle > 0 and time.monotonic() - self.__connection_used >= self.__ping_idle and not self.ping(connection):
+                journal.warning("Database connection failed the health check, reconnecting.")
+                self.__count("connections_lost")
+                self.__close_cursor(connection, broken=True)
+                self.__connection = None
+                try:
+                    self.__close_raw(connection)
+                except Exception as error:
+                    journal.warning(f"Failed to close the broken connection: {error}")
+            self.__reconnect()
+        except Exception:
+            self.__lock.release()
+            raise
+        return self.__connection
+
+    def __checkin(self, connection: TypeSQLConnection, discard: bool = False) -> None:
+        if self.__admission is None:
+            self.__checkin_connection(connection, discard)
+            return
+        try:
+            self.__checkin_connection(connection, discard)
+        finally:
+            self.__admission.release()
+
+    def __checkin_connection(self, connection: TypeSQLConnection, discard: bool) -> None:
+        if self.__pool:
+            self.__pool.release(connection, discard=discard)
+            return
+
+        if discard and self.__connection is connection:
+            try:
+                self.__close_raw(connection)
+            except Exception as error:
+                journal.warning(f"Failed to close the broken connection: {error}")
+            self.__connection = None
+        self.__connection_used = time.monotonic()
+        self.__lock.release()
 
     @abstractmethod
     def execute(self, query, params) -> None:
         raise NotImplemented
 
-    def __operate(self, sqls: Union[str, Iterable], params: Optional[Iterable] = None) -> Tuple:
+    def __invalidate_tables(self, tables: Optional[Set[str]]) -> None:
+        if self.__query_cache is None:
+            return
+        transaction = self.__transaction()
+        if transaction and transaction.tables is not None:
+            # Invalidated again on commit, readers may cache the old rows until then.
+            transaction.tables = transaction.tables | tables if tables else None
+        self.__query_cache.invalidate(tables)
+
+    def __invalidate(self, statements: Iterable[str]) -> None:
+        if self.__query_cache is None:
+            return
+        for statement in statements:
+            if is_read_statement(statement):
+                continue
+            # A write whose target cannot be parsed drops the whole cache.
+            self.__invalidate_tables(write_tables(statement) or None)
+
+    def __fetch(self, cursor: TypeSQLCursor, result_format: Union[str, type], sizes: Optional[List[int]] = None) -> Any:
+        # Read back by paginate to locate the key columns.
+        self.__local.description = cursor.description
+        if result_format == "tuples" or cursor.description is None:
+            return cursor.fetchall()
+        names = column_names(cursor.description)
+        if result_format == "columns":
+            builder = ColumnsBuilder(names, [self.column_typecode(column[1]) for column in cursor.description])
+            while True:
+                rows = cursor.fetchmany(self.columns_fetch_size)
+                if not rows:
+                    break
+                builder.append(rows)
+            return builder.build()
+        rows = cursor.fetchall()
+        if sizes is not None:
+            # Records and user classes are not iterable, the size is taken from the driver rows.
+            sizes.append(payload_size(rows))
+        return tuple(map(row_factory(names, result_format), rows))
+
+    def __run(self, query: str, params: Optional[Iterable], result_format: Union[str, type], limit: Optional[Tuple[TypeSQLConnection, float]] = None) -> Any:
+        journal.trace(f"SQL >> {query} | Params: {params}")
+        statement = self.limit_statement(limit[0], query, limit[1]) if limit else query
+        if self.__metrics is None:
+            self.execute(query=statement, params=params)
+            return self.__fetch(self.cursor, result_format)
+
+        start_time = time.perf_counter()
+        sizes: List[int] = []
         try:
-            self.__reconnect()
+            self.execute(query=statement, params=params)
+            results = self.__fetch(self.cursor, result_format, sizes)
+        except Exception:
+            self.__metrics.record(query, params, time.perf_counter() - start_time, error=True)
+            raise
+        seconds = time.perf_counter() - start_time
+        if self.cursor.description is None:
+            self.__metrics.record(query, params, seconds, rows=max(self.cursor.rowcount, 0))
+        else:
+            self.__metrics.record(query, params, seconds, rows=len(results), size=sizes[0] if sizes else payload_size(results))
+        return results
+
+    def __operate(
+        self,
+        sqls: Union[str, Iterable],
+        params: Optional[Iterable] = None,
+        cache: Optional[bool] = None,
+        result_format: Union[str, type] = "tuples",
+        retry: bool = True,
+        timeout: Optional[float] = None,
+    ) -> Tuple:
+        statements = [sqls] if isinstance(sqls, str) else list(sqls) if isinstance(sqls, (list, tuple)) else []
+        read_only = bool(statements) and all(is_read_statement(sql) for sql in statements)
+        cache_key = None
+        if self.__query_cache is not None and (self.__cache_reads if cache is None else cache) and read_only and not self.__transaction():
+            cache_key = (QueryCache.key(sqls, params), result_format)
+            hit, results = self.__query_cache.get(cache_key)
+            if hit:
+                journal.trace(f"SQL cache hit >> {sqls} | Params: {params}")
+                return _copy_result(results, result_format, not isinstance(sqls, str))
+            tables = set().union(*(read_tables(sql) for sql in statements))
+            # Taken before the read, a write invalidating these tables meanwhile keeps the result out of the cache.
+            generation = self.__query_cache.generation(tables)
+
+        timeout = self.__statement_timeout if timeout is None else timeout
+        connection = self.__acquire()
+        managed = self.__managed(read_only)
+        discard = False
+        failed = False
+        lost = None
+        limit = (connection, timeout) if timeout else None
+        alarm: Optional[Alarm] = None
+        cancelled = False
+        expired = False
+        try:
+            if managed and self.__autocommit:
+                self.begin(connection)
+            if limit:
+                alarm = watchdog.arm(timeout + self.cancel_grace, lambda: self.__cancel(connection, timeout))
             if isinstance(sqls, str):
-                journal.trace(f"SQL >> {sqls} | Params: {params}")
-                self.execute(query=sqls, params=params)
-                results = self.cursor.fetchall()
+                results = self.__run(sqls, params, result_format, limit)
             elif isinstance(sqls, (list, tuple)):
-                tmp_list = []
-                for sql, param in zip(sqls, params):
-                    journal.trace(f"SQL >> {sql} | Params: {param}")
-                    self.execute(query=sql, params=param)
-                    tmp_list.append(self.cursor.fetchall())
-                results = tuple(tmp_list)
+                results = tuple(self.__run(sql, param, result_format, limit) for sql, param in zip(sqls, params))
             else:
                 raise TypeError("Wrong SQL statements type.")
-            self.__connection.commit()
+            if alarm is not None:
+                expired = time.monotonic() >= alarm.deadline
+                alarm, cancelled = None, watchdog.disarm(alarm)
+                if cancelled or expired:
+                    # Also when the backend could not cancel it, a statement past its deadline returns no rows.
+                    raise SQLTimeoutError("the result arrived after the deadline")
+            if managed:
+                connection.commit()
         except Exception as error:
-            journal.warning("Failed to execute the rollback after an error occurred.")
-            self.__connection.rollback()
-            journal.error(f"Error occurred during SQL operation: {error}")
+            failed = True
+            if alarm is not None:
+                expired = time.monotonic() >= alarm.deadline
+                alarm, cancelled = None, watchdog.disarm(alarm)
+            discard = self.__rollback(connection, error) if managed else self.__lost(connection, error)
+            if cancelled or expired or (limit and self.is_timeout(error)):
+                discard = discard or (cancelled and self.discard_after_cancel)
+                journal.error(f"SQL operation exceeded its {timeout}s timeout: {error}")
+                raise SQLTimeoutError(f"Statement exceeded its {timeout}s timeout: {error}") from error
+            if not (discard and retry and read_only and self.__retry_reads and not self.__transaction() and self.is_disconnect(error, connection)):
+                journal.error(f"Error occurred during SQL operation: {error}")
+                raise
+            lost = error
+        finally:
+            if alarm is not None:
+                watchdog.disarm(alarm)
+            try:
+                self.__close_cursor(connection, broken=failed or discard)
+            finally:
+                self.__release(connection, discard=discard)
+
+        if lost is not None:
+            # Reads are idempotent, run them once more on a new connection.
+            self.__count("read_retries")
+            journal.warning(f"Retrying the read on a new connection after: {lost}")
+            return self.__operate(sqls, params, cache, result_format, retry=False, timeout=timeout)
+
+        if cache_key is not None:
+            if self.__query_cache.put(cache_key, results, tables, generation):
+                results = _copy_result(results, result_format, not isinstance(sqls, str))
+        else:
+            self.__invalidate(statements)
+        return results
+
+    def operate(
+        self, query: Union[str, Iterable], params: Optional[Iterable] = None, cache: Optional[bool] = None, result_format: str = "tuples", timeout: Optional[float] = None
+    ) -> Any:
+        """
+        Execute one statement or a list of statements in one transaction.
+
+        A statement running past the timeout is cancelled, rolled back and raises SQLTimeoutError.
+
+        :param query: SQL statement or list of statements.
+        :type query: Union[str, Iterable]
+        :param params: SQL parameters, one entry per statement for a list.
+        :type params: Optional[Iterable]
+        :param cache: Serve read statements from the query cache, None follows cache_reads.
+        :type cache: Optional[bool]
+        :param result_format: "tuples", "dicts", "namedtuple", "records" (generated __slots__ records) or "columns" (a Columns object).
+        :type result_format: str
+        :param timeout: Seconds the call may run, None uses statement_timeout and 0 disables it.
+        :type timeout: Optional[float]
+        :return: Result of each statement, or a tuple of them for a list.
+        :rtype: Any
+        """
+        if result_format not in RESULT_FORMATS:
+            raise ValueError(f"Unsupported result format: {result_format}")
+        return self.__operate(query, params, cache, result_format, timeout=timeout)
+
+    def operate_as(
+        self, record_type: Optional[type], query: Union[str, Iterable], params: Optional[Iterable] = None, cache: Optional[bool] = None, timeout: Optional[float] = None
+    ) -> Any:
+        """
+        Execute like operate and build one record_type object per row.
+
+        The row constructor is compiled once per class and column set and reused by later calls.
+
+        :param record_type: Dataclass, namedtuple, __slots__ class without __init__ or class taking the columns as keyword arguments.
+                            None generates a __slots__ record class per column set.
+        :type record_type: Optional[type]
+        :param query: SQL statement or list of statements.
+        :type query: Union[str, Iterable]
+        :param params: SQL parameters, one entry per statement for a list.
+        :type params: Optional[Iterable]
+        :param cache: Serve read statements from the query cache, None follows cache_reads.
+        :type cache: Optional[bool]
+        :param timeout: Seconds the call may run, None uses statement_timeout and 0 disables it.
+        :type timeout: Optional[float]
+        :return: Records of each statement, or a tuple of them for a list.
+        :rtype: Any
+        """
+        if record_type is not None and not isinstance(record_type, type):
+            raise TypeError("record_type must be a class.")
+        return self.__operate(query, params, cache, "records" if record_type is None else record_type, timeout=timeout)
+
+    def __warm_up(self, count: Optional[int]) -> int:
+        if self.__pool:
+            return self.__pool.fill(count if count is not None else self.__pool.min_size)
+        with self.__lock:
+            if self.__connection:
+                return 0
+            self.__connection = self.__connect()
+            self.__connection_used = time.monotonic()
+            return 1
+
+    def warm_up(self, count: Optional[int] = None, background: bool = True) -> Union[threading.Thread, int]:
+        """
+        Open connections ahead of the first call, typically after constructing with lazy=True.
+
+        :param count: Pooled connections to have open, defaults to the pool minimum, ignored without pooling.
+        :type count: Optional[int]
+        :param background: Open them on a daemon thread, failures are logged and left to the first call.
+        :type background: bool
+        :return: The started thread, or the number of opened connections when run in the foreground.
+        :rtype: Union[threading.Thread, int]
+        """
+
+        def run() -> None:
+            try:
+                journal.debug(f"Warm-up opened {self.__warm_up(count)} database connection(s).")
+            except Exception as error:
+                journal.warning(f"Connection warm-up failed: {error}")
+
+        if not background:
+            return self.__warm_up(count)
+        thread = threading.Thread(target=run, name="fairyland-warm-up", daemon=True)
+        thread.start()
+        return thread
+
+    def __page(self, statement: str, params: tuple, result_format: str) -> Tuple[Any, Any]:
+        rows = self.__operate(statement, params, False, result_format)
+        return rows, self.__local.description
+
+    def __paginate(
+        self, source: str, key_columns: List[str], page_size: int, params: tuple, resume: Optional[str], descending: bool, prefetch: bool, result_format: str
+    ) -> Iterator[Page]:
+        first = keyset_statement(source, key_columns, page_size, False, descending, self.quote_identifier, self.placeholder)
+        seek = keyset_statement(source, key_columns, page_size, True, descending, self.quote_identifier, self.placeholder)
+        last_key = decode_token(resume, key_columns) if resume else None
+
+        def fetch(key: Optional[tuple]) -> Tuple[Any, Any]:
+            return self.__page(first if key is None else seek, params + (key or ()), result_format)
+
+        # A prefetch thread would not see the open transaction.
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fairyland-prefetch") if prefetch and not self.__transaction() else None
+        pending: Optional[Future] = None
+        key_of = None
+        number = 0
+        try:
+            while True:
+                if pending is not None:
+                    rows, description = pending.result()
+                    pending = None
+                else:
+                    rows, description = fetch(last_key)
+                if not rows:
+                    return
+                if key_of is None:
+                    names = column_names(description)
+                    positions = key_positions(names, key_columns)
+                    if result_format == "dicts":
+                        key_of = lambda row: tuple(row[names[index]] for index in positions)
+                    elif result_format == "records":
+                        key_of = lambda row: tuple(getattr(row, row._fields[index]) for index in positions)
+                    else:
+                        key_of = lambda row: tuple(row[index] for index in positions)
+                last_key = key_of(rows[-1])
+                number += 1
+                full = len(rows) >= page_size
+                if full and executor is not None:
+                    pending = executor.submit(fetch, last_key)
+                yield Page(rows, encode_token(key_columns, last_key), number)
+                if not full:
+                    return
+        finally:
+            if pending is not None:
+                pending.cancel()
+            if executor is not None:
+                executor.shutdown(wait=True)
+
+    def paginate(
+        self,
+        source: str,
+        key_columns: Union[str, Iterable[str]],
+        page_size: int = 1000,
+        params: Optional[Iterable] = None,
+        resume: Optional[str] = None,
+        descending: bool = False,
+        prefetch: bool = False,
+        result_format: str = "tuples",
+    ) -> Iterator[Page]:
+        """
+        Scan a table or query page by page, seeking past the last key instead of using OFFSET.
+
+        Every page costs an index range scan, whatever its position. Page.token resumes the scan after that page.
+
+        :param source: Table name, or a SELECT statement that becomes a derived table.
+        :type source: str
+        :param key_columns: Unique, non-NULL, indexed key column(s) present in the result.
+        :type key_columns: Union[str, Iterable[str]]
+        :param page_size: Rows per page.
+        :type page_size: int
+        :param params: Positional parameters of a SELECT source.
+        :type params: Optional[Iterable]
+        :param resume: Token of a previously returned page to continue after.
+        :type resume: Optional[str]
+        :param descending: Scan from the highest key down.
+        :type descending: bool
+        :param prefetch: Fetch the next page on a background thread while the current one is processed.
+        :type prefetch: bool
+        :param result_format: "tuples", "dicts", "namedtuple" or "records".
+        :type result_format: str
+        :return: Page generator.
+        :rtype: Iterator[Page]
+        """
+        key_columns = [key_columns] if isinstance(key_columns, str) else list(key_columns)
+        if not key_columns:
+            raise ValueError("At least one key column is required.")
+        if page_size < 1:
+            raise ValueError("page_size must be a positive integer.")
+        if result_format not in RESULT_FORMATS or result_format == "columns":
+            raise ValueError(f"Unsupported result format for pagination: {result_format}")
+        if isinstance(params, dict):
+            raise ValueError("Pagination needs positional parameters.")
+        return self.__paginate(source, key_columns, page_size, tuple(params or ()), resume, descending, prefetch, result_format)
+
+    def export(
+        self,
+        query: str,
+        target: Union[str, BinaryIO],
+        export_format: Optional[str] = None,
+        params: Optional[Iterable] = None,
+        fetch_size: int = 10000,
+        compress: Optional[bool] = None,
+        header: bool = True,
+        queue_size: int = 4,
+        progress: Optional[Callable[[int, int], None]] = None,
+    ) -> Dict[str, Any]:
+        """
+        Stream a query into a file, a writer thread encodes batches while the next ones are fetched.
+
+        Memory stays bounded by queue_size batches of fetch_size rows. A path is written to
+        "<path>.part" and only renamed once the export succeeded.
+
+        :param query: SQL statement.
+        :type query: str
+        :param target: Output path or binary file object.
+        :type target: Union[str, BinaryIO]
+        :param export_format: "csv", "jsonl" or "columnar" (typed column blocks, read back with read_columnar),
+                              None picks it from the extension (.csv, .jsonl, .ndjson, .fcol, optionally .gz).
+        :type export_format: Optional[str]
+        :param params: SQL parameters.
+        :type params: Optional[Iterable]
+        :param fetch_size: Rows per batch.
+        :type fetch_size: int
+        :param compress: gzip the output, None compresses paths ending with ".gz".
+        :type compress: Optional[bool]
+        :param header: Write a CSV header line.
+        :type header: bool
+        :param queue_size: Batches buffered between the fetching and the writing thread.
+        :type queue_size: int
+        :param progress: Called from the writer thread with the rows and uncompressed bytes written so far.
+        :type progress: Optional[Callable[[int, int], None]]
+        :return: Exported rows, uncompressed bytes, elapsed seconds and rows per second.
+        :rtype: dict
+        """
+        path = target if isinstance(target, str) else None
+        export_format = export_format or format_of(path)
+        if export_format not in EXPORT_FORMATS:
+            raise ValueError(f"Unsupported export format: {export_format}")
+        if compress is None:
+            compress = bool(path and path.endswith(".gz"))
+
+        start_time = time.perf_counter()
+        batches = self.__iterate(query, params, fetch_size, True, "tuples")
+        chunks: queue.Queue = queue.Queue(maxsize=max(queue_size, 1))
+        errors: List[BaseException] = []
+        totals = {"rows": 0, "bytes": 0}
+        raw = open(path + ".part", "wb") if path else target
+        sink = gzip.GzipFile(fileobj=raw, mode="wb") if compress else raw
+        writer = None
+        succeeded = False
+
+        def write(chunk_encoder: Any) -> None:
+            try:
+                data = chunk_encoder.start()
+                sink.write(data)
+                totals["bytes"] += len(data)
+                while True:
+                    rows = chunks.get()
+                    if rows is None:
+                        break
+                    data = chunk_encoder.encode(rows)
+                    sink.write(data)
+                    totals["rows"] += len(rows)
+                    totals["bytes"] += len(data)
+                    if progress is not None:
+                        progress(totals["rows"], totals["bytes"])
+                if errors:
+                    return
+                data = chunk_encoder.finish()
+                sink.write(data)
+                totals["bytes"] += len(data)
+            except BaseException as error:
+                errors.append(error)
+
+        def put(item: Optional[list]) -> bool:
+            while not errors:
+                try:
+                    chunks.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        try:
+            first = next(batches, None)
+            # Recorded by the first fetch, named cursors have no description before it.
+            description = self.__local.description
+            names = column_names(description)
+            typecodes = [self.column_typecode(column[1]) for column in description or ()]
+            writer = threading.Thread(target=write, args=(encoder(export_format, names, typecodes, header),), name="fairyland-export", daemon=True)
+            writer.start()
+            if first is not None and put(first):
+                for batch in batches:
+                    if not put(batch):
+                        break
+            put(None)
+            writer.join()
+            if errors:
+                raise errors[0]
+            succeeded = True
+        finally:
+            batches.close()
+            if writer is not None and writer.is_alive():
+                # Fetching failed, wake the writer without letting it finish the file.
+                errors.append(DataSourceError("Export aborted."))
+                while writer.is_alive():
+                    try:
+                        chunks.put(None, timeout=0.1)
+                    except queue.Full:
+                        continue
+                    writer.join()
+            if compress:
+                sink.close()
+            if path:
+                raw.close()
+                if succeeded:
+                    os.replace(path + ".part", path)
+                else:
+                    os.remove(path + ".part")
+            else:
+                raw.flush()
+
+        seconds = time.perf_counter() - start_time
+        results = {"rows": totals["rows"], "bytes": totals["bytes"], "seconds": seconds, "rows_per_second": totals["rows"] / seconds if seconds > 0 else 0.0}
+        journal.info(f"Exported {totals['rows']} rows as {export_format}, {results['rows_per_second']:.0f} rows/s.")
+        return results
+
+    def __parallel_executor(self) -> ThreadPoolExecutor:
+        with self.__cursors_lock:
+            if self.__executor is None:
+                self.__executor = ThreadPoolExecutor(max_workers=self.__pool.max_size, thread_name_prefix="fairyland-parallel")
+            return self.__executor
+
+    def __timed(
+        self, started: List[Optional[float]], index: int, query: str, params: Optional[Iterable], cache: Optional[bool], result_format: str, timeout: Optional[float]
+    ) -> Any:
+        started[index] = time.monotonic()
+        return self.__operate(query, params, cache, result_format, timeout=timeout)
+
+    def operate_parallel(
+        self,
+        queries: Iterable[str],
+        params: Optional[Iterable] = None,
+        max_concurrency: Optional[int] = None,
+        timeout: Optional[float] = None,
+        cache: Optional[bool] = None,
+        result_format: str = "tuples",
+        return_exceptions: bool = False,
+    ) -> List[Any]:
+        """
+        Run independent read statements concurrently, each on its own pooled connection and transaction.
+
+        Without pooling, or inside transaction(), the statements run one after another on the current connection.
+        A statement exceeding the timeout is reported as failed and cancelled like an operate timeout.
+
+        :param queries: Read statements.
+        :type queries: Iterable[str]
+        :param params: SQL parameters, one entry per statement.
+        :type params: Optional[Iterable]
+        :param max_concurrency: Statements running at once, defaults to the pool size.
+        :type max_concurrency: Optional[int]
+        :param timeout: Seconds each statement may run.
+        :type timeout: Optional[float]
+        :param cache: Serve the statements from the query cache, None follows cache_reads.
+        :type cache: Optional[bool]
+        :param result_format: Same as operate.
+        :type result_format: str
+        :param return_exceptions: Return the exception of a failed statement in its slot instead of raising it.
+        :type return_exceptions: bool
+        :return: Result of each statement, in input order.
+        :rtype: list
+        """
+        queries = list(queries)
+        params = list(params) if params is not None else [None] * len(queries)
+        if len(params) != len(queries):
+            raise ValueError("One parameter entry is required per statement.")
+        if result_format not in RESULT_FORMATS:
+            raise ValueError(f"Unsupported result format: {result_format}")
+        if max_concurrency is not None and max_concurrency < 1:
+            raise ValueError("max_concurrency must be a positive integer.")
+        for query in queries:
+            if not is_read_statement(query):
+                raise ValueError(f"Only read statements can run in parallel: {query}")
+
+        results: List[Any] = [None] * len(queries)
+        if not self.__pool or self.__transaction():
+            for index, (query, param) in enumerate(zip(queries, params)):
+                try:
+                    results[index] = self.__operate(query, param, cache, result_format, timeout=timeout)
+                except Exception as error:
+                    if not return_exceptions:
+                        raise
+                    results[index] = error
+            return results
+
+        executor = self.__parallel_executor()
+        limit = min(max_concurrency or self.__pool.max_size, self.__pool.max_size)
+        started: List[Optional[float]] = [None] * len(queries)
+        running: Dict[Future, int] = {}
+        pending = iter(range(len(queries)))
+        failure: Optional[BaseException] = None
+
+        def submit() -> None:
+            for index in pending:
+                running[executor.submit(self.__timed, started, index, queries[index], params[index], cache, result_format, timeout)] = index
+                if len(running) >= limit:
+                    return
+
+        submit()
+        while running:
+            wait_time = None
+            if timeout is not None:
+                deadlines = [started[index] + timeout for index in running.values() if started[index] is not None]
+                wait_time = max(min(deadlines) - time.monotonic(), 0.0) if deadlines else timeout
+            done, _ = wait(running, timeout=wait_time, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = running.pop(future)
+                error = future.exception()
+                results[index] = error if error is not None else future.result()
+                if error is not None and failure is None:
+                    failure = error
+            if timeout is not None:
+                now = time.monotonic()
+                for future, index in list(running.items()):
+                    if started[index] is not None and now - started[index] >= timeout and not future.done():
+                        del running[future]
+                        results[index] = DataSourceError(f"Statement timed out after {timeout}s: {queries[index]}")
+                        journal.warning(f"Parallel statement timed out after {timeout}s: {queries[index]}")
+                        if failure is None:
+                            failure = results[index]
+            if failure is not None and not return_exceptions:
+                for future in running:
+                    future.cancel()
+                raise failure
+            submit()
+        return results
+
+    def __iterate(self, query: str, params: Optional[Iterable], fetch_size: int, batches: bool, result_format: str) -> Iterator:
+        connection = self.__acquire()
+        managed = self.__managed(read_only=True)
+        cursor = None
+        exhausted = False
+        discard = False
+        failed = False
+        # Database time only, the consumer's time between batches is excluded.
+        seconds = 0.0
+        total_rows = 0
+        size = 0
+        try:
+            # Streams use their own cursor, put back the one handed out with the connection.
+            self.__close_cursor(connection)
+            cursor = self.stream_cursor(connection, fetch_size)
+            self.cursor = cursor
+            journal.trace(f"SQL >> {query} | Params: {params}")
+            start_time = time.perf_counter()
+            self.execute(query=query, params=params)
+            seconds += time.perf_counter() - start_time
+            self.cursor = None
+            names = None
+            while True:
+                start_time = time.perf_counter()
+                rows = cursor.fetchmany(fetch_size)
+                seconds += time.perf_counter() - start_time
+                if names is None:
+                    # Named cursors only run DECLARE on execute, their columns are described by the first fetch.
+                    self.__local.description = cursor.description
+                    names = column_names(cursor.description)
+                    factory = row_factory(names, result_format) if result_format != "columns" else None
+                    typecodes = [self.column_typecode(column[1]) for column in cursor.description or ()]
+                if not rows:
+                    break
+                if self.__metrics is not None:
+                    total_rows += len(rows)
+                    size += payload_size(rows)
+                if result_format == "columns":
+                    builder = ColumnsBuilder(names, typecodes)
+                    builder.append(rows)
+                    yield builder.build()
+                elif factory:
+                    if batches:
+                        yield [factory(row) for row in rows]
+                    else:
+                        yield from map(factory, rows)
+                elif batches:
+                    yield rows
+                else:
+                    yield from rows
+            exhausted = True
+            if managed:
+                connection.commit()
+        except Exception as error:
+            journal.error(f"Error occurred during SQL streaming: {error}")
+            failed = True
+            discard = self.__rollback(connection, error) if managed else self.__lost(connection, error)
+            raise
+        finally:
+            if self.__metrics is not None:
+                self.__metrics.record(query, params, seconds, rows=total_rows, size=size, error=failed)
+            self.cursor = None
+            if not exhausted and self.server_side_streams and not self.__transaction():
+                discard = True
+            else:
+                if cursor:
+                    try:
+                        cursor.close()
+                    except Exception:
+                        discard = True
+                if managed and not exhausted and not failed and not discard:
+                    # Closed early by the consumer, the transaction of the stream must not stay open on the connection.
+                    discard = self.__rollback(connection)
+            self.__release(connection, discard=discard)
+
+    @contextlib.contextmanager
+    def connection(self) -> Iterator[TypeSQLConnection]:
+        """
+        Check out a connection for driver-specific work, committed on success and rolled back on error.
+
+        :return: Context manager yielding the connection.
+        :rtype: Iterator[TypeSQLConnection]
+        """
+        connection = self.__acquire()
+        managed = self.__managed()
+        discard = False
+        failed = False
+        try:
+            if managed and self.__autocommit:
+                self.begin(connection)
+            yield connection
+            if managed:
+                connection.commit()
+        except BaseException as error:
+            failed = True
+            discard = self.__rollback(connection, error) if managed else self.__lost(connection, error)
+            journal.error(f"Error occurred during SQL operation: {error!r}")
             raise
         finally:
-            self.__close_cursor()
+            try:
+                self.__close_cursor(connection, broken=failed)
+            finally:
+                self.__release(connection, discard=discard)
+
+    @contextlib.contextmanager
+    def transaction(self) -> Iterator[TypeSQLConnection]:
+        """
+        Run every operate call of the block on one connection and commit once at the end.
+
+        Nested blocks become savepoints, an error rolls back to the savepoint of its own block.
+
+        :return: Context manager yielding the transaction connection.
+        :rtype: Iterator[TypeSQLConnection]
+        """
+        transaction = self.__transaction()
+        if transaction:
+            transaction.depth += 1
+            savepoint = f"fairyland_sp_{transaction.depth}"
+            self.__execute_control(transaction.connection, f"SAVEPOINT {savepoint}")
+            try:
+                yield transaction.connection
+            except BaseException:
+                self.__execute_control(transaction.connection, f"ROLLBACK TO SAVEPOINT {savepoint}")
+                raise
+            else:
+                self.__execute_control(transaction.connection, f"RELEASE SAVEPOINT {savepoint}")
+            finally:
+                transaction.depth -= 1
+            return
+
+        connection = self.__checkout()
+        discard = False
+        failed = False
+        transaction = self.__local.transaction = _Transaction(connection)
+        try:
+            if self.__autocommit:
+                self.begin(connection)
+            yield connection
+            connection.commit()
+        except BaseException as error:
+            failed = True
+            discard = self.__rollback(connection, error)
+            journal.error(f"Transaction rolled back: {error!r}")
+            raise
+        finally:
+            self.__local.transaction = None
+            try:
+                self.__close_cursor(connection, broken=failed)
+            finally:
+                self.__checkin(connection, discard=discard)
+            if self.__query_cache is not None and (transaction.tables is None or transaction.tables):
+                self.__query_cache.invalidate(transaction.tables)
+
+    def iterate(self, query: str, params: Optional[Iterable] = None, fetch_size: int = 1000, batches: bool = False, result_format: str = "tuples") -> Iterator:
+        """
+        Stream the rows of a query without materialising the result set.
+
+        The connection stays checked out until the generator is exhausted or closed.
+
+        :param query: SQL statement.
+        :type query: str
+        :param params: SQL parameters.
+        :type params: Optional[Iterable]
+        :param fetch_size: Rows fetched per round trip.
+        :type fetch_size: int
+        :param batches: Yield lists of up to fetch_size rows instead of single rows.
+        :type batches: bool
+        :param result_format: "tuples", "dicts", "namedtuple", "records", or "columns" to yield one Columns per batch.
+        :type result_format: str
+        :return: Generator of rows or row batches.
+        :rtype: Iterator
+        """
+        if not isinstance(query, str):
+            raise TypeError("Wrong SQL statements type.")
+        if fetch_size < 1:
+            raise ValueError("fetch_size must be a positive integer.")
+        if result_format not in RESULT_FORMATS:
+            raise ValueError(f"Unsupported result format: {result_format}")
+        if result_format == "columns" and not batches:
+            raise ValueError("The columns format requires batches=True.")
+        return self.__iterate(query, params, fetch_size, batches, result_format)
+
+    def __bulk_insert(self, table: str, columns: List[str], rows: Iterable, batch_size: int, tail: str = "", label: str = "Bulk insert") -> Dict[str, Any]:
+        head = f"INSERT INTO {self.quote_identifier(table)} ({', '.join(self.quote_identifier(column) for column in columns)}) VALUES "
+        group = "(" + ", ".join([self.placeholder] * len(columns)) + ")"
+        total_rows = 0
+        batches = 0
+        start_time = time.perf_counter()
+
+        connection = self.__acquire()
+        # Every batch is a single statement, autocommit already makes it atomic.
+        managed = self.__managed(read_only=self.__autocommit)
+        discard = False
+        failed = False
+        try:
+            # Keep a quarter of the packet for the statement text and protocol overhead.
+            max_bytes = max(self.max_statement_size(connection) * 3 // 4 - len(head) - len(tail), 1)
+            for params, count in batched_rows(rows, len(columns), batch_size, max_bytes):
+                query = head + ", ".join([group] * count) + tail
+                journal.trace(f"SQL >> {head}... | Rows: {count}")
+                batch_start = time.perf_counter()
+                try:
+                    self.execute(query=query, params=params)
+                except Exception:
+                    if self.__metrics is not None:
+                        self.__metrics.record(query, None, time.perf_counter() - batch_start, error=True)
+                    raise
+                if self.__metrics is not None:
+                    self.__metrics.record(query, None, time.perf_counter() - batch_start, rows=count)
+                if managed:
+                    connection.commit()
+                total_rows += count
+                batches += 1
+        except Exception as error:
+            failed = True
+            discard = self.__rollback(connection, error) if managed else self.__lost(connection, error)
+            journal.error(f"Error occurred during {label.lower()} after {total_rows} committed rows: {error}")
+            raise
+        finally:
+            try:
+                self.__close_cursor(connection, broken=failed)
+            finally:
+                self.__release(connection, discard=discard)
+                if total_rows:
+                    self.__invalidate_tables({table.split(".")[-1].lower()})
+
+        seconds = time.perf_counter() - start_time
+        results = {
+            "rows": total_rows,
+            "batches": batches,
+            "seconds": seconds,
+            "rows_per_second": total_rows / seconds if seconds > 0 else 0.0,
+        }
+        journal.info(f"{label} into {table}: {total_rows} rows in {batches} batches, {results['rows_per_second']:.0f} rows/s.")
         return results
 
-    def operate(self, query: Union[str, Iterable], params: Optional[Iterable] = None) -> Tuple:
+    def bulk_insert(self, table: str, columns: Iterable[str], rows: Iterable, batch_size: int = 1000) -> Dict[str, Any]:
+        """
+        Insert many rows with multi-row INSERT ... VALUES statements, committing once per batch.
+
+        Batches are cut by row count and by the server statement size limit.
+
+        :param table: Target table.
+        :type table: str
+        :param columns: Target columns.
+        :type columns: Iterable[str]
+        :param rows: Row values in column order, consumed lazily.
+        :type rows: Iterable
+        :param batch_size: Maximum rows per statement.
+        :type batch_size: int
+        :return: Inserted rows, batches, elapsed seconds and rows per second.
+        :rtype: dict
+        """
+        columns = list(columns)
+        if not columns:
+            raise ValueError("At least one column is required.")
+        if batch_size < 1:
+            raise ValueError("batch_size must be a positive integer.")
+        return self.__bulk_insert(table, columns, rows, batch_size)
+
+    def bulk_upsert(
+        self,
+        table: str,
+        key_columns: Union[str, Iterable[str]],
+        columns: Iterable[str],
+        rows: Iterable,
+        update_columns: Optional[Iterable[str]] = None,
+        batch_size: int = 1000,
+    ) -> Dict[str, Any]:
+        """
+        Insert many rows and update the existing ones with the same key, one multi-row statement per batch.
+
+        A key must not repeat within rows, PostgreSQL rejects a statement that updates a row twice.
+
+        :param table: Target table.
+        :type table: str
+        :param key_columns: Primary key or unique index columns, part of columns.
+        :type key_columns: Union[str, Iterable[str]]
+        :param columns: Target columns.
+        :type columns: Iterable[str]
+        :param rows: Row values in column order, consumed lazily.
+        :type rows: Iterable
+        :param update_columns: Columns updated on a key conflict, defaults to every non-key column.
+        :type update_columns: Optional[Iterable[str]]
+        :param batch_size: Maximum rows per statement.
+        :type batch_size: int
+        :return: Written rows, batches, elapsed seconds and rows per second.
+        :rtype: dict
+        """
+        key_columns = [key_columns] if isinstance(key_columns, str) else list(key_columns)
+        columns = list(columns)
+        if not key_columns:
+            raise ValueError("At least one key column is required.")
+        missing = [column for column in key_columns if column not in columns]
+        if missing:
+            raise ValueError(f"Key columns {missing} are not part of the inserted columns.")
+        update_columns = [column for column in columns if column not in key_columns] if update_columns is None else list(update_columns)
+        if batch_size < 1:
+            raise ValueError("batch_size must be a positive integer.")
+        return self.__bulk_insert(table, columns, rows, batch_size, self.upsert_clause(key_columns, update_columns), "Bulk upsert")
+
+    def write_buffer(
+        self,
+        max_rows: int = 1000,
+        max_latency: float = 0.5,
+        max_buffered: int = 100000,
+        timeout: Optional[float] = None,
+        batch_size: int = 1000,
+        on_error: Optional[Callable[[str, Tuple[str, ...], List[Any], Exception], None]] = None,
+    ) -> WriteBuffer:
+        """
+        Write-behind buffer that turns single-row inserts into batched bulk_insert calls.
+
+        Rows are written within max_latency seconds, close() of the buffer or of this data source
+        and interpreter exit write whatever is still queued.
+
+        :param max_rows: Rows of one table that trigger a flush.
+        :type max_rows: int
+        :param max_latency: Seconds a row waits at most before its table is flushed.
+        :type max_latency: float
+        :param max_buffered: Rows held at most, add blocks above it.
+        :type max_buffered: int
+        :param timeout: Seconds add waits for free space before raising, None waits indefinitely.
+        :type timeout: Optional[float]
+        :param batch_size: Rows per INSERT statement.
+        :type batch_size: int
+        :param on_error: Called with the table, columns, rows and error of a failed flush.
+        :type on_error: Optional[Callable]
+        :return: Buffer, see WriteBuffer.add.
+        :rtype: WriteBuffer
+        """
+        buffer = WriteBuffer(self, max_rows, max_latency, max_buffered, timeout, batch_size, on_error)
+        with self.__cursors_lock:
+            self.__buffers = [item for item in self.__buffers if not item.closed]
+            self.__buffers.append(buffer)
+        return buffer
+
+    def cache_stats(self) -> Optional[Dict[str, Any]]:
+        """
+        Counters of the query cache.
+
+        :return: Cache statistics, None when no cache is configured.
+        :rtype: Optional[dict]
+        """
+        return self.__query_cache.stats() if self.__query_cache is not None else None
+
+    def lifecycle_stats(self) -> Dict[str, int]:
+        """
+        Counters of opened, reused and closed connections and cursors.
+
+        :return: Lifecycle counters.
+        :rtype: dict
+        """
+        with self.__cursors_lock:
+            return dict(self.__lifecycle)
+
+    def query_stats(self, top: Optional[int] = None, sort_by: str = "seconds") -> Optional[List[Dict[str, Any]]]:
+        """
+        Per-statement statistics of the metrics collector.
+
+        :param top: Only return the statements with the highest sort_by values.
+        :type top: Optional[int]
+        :param sort_by: Same as QueryMetrics.stats.
+        :type sort_by: str
+        :return: Statement statistics, None when no collector is configured.
+        :rtype: Optional[list]
+        """
+        return self.__metrics.stats(top=top, sort_by=sort_by) if self.__metrics is not None else None
+
+    def pool_stats(self) -> Optional[Dict[str, Any]]:
+        """
+        Counters of the connection pool.
 
-        return self.__operate(query, params)
+        :return: Pool statistics, None when pooling is disabled.
+        :rtype: Optional[dict]
+        """
+        return self.__pool.stats() if self.__pool else None
 
     def close(self):
 
+        with self.__cursors_lock:
+            buffers, self.__buffers = self.__buffers, []
+        for buffer in buffers:
+            buffer.close()
+        with self.__cursors_lock:
+            executor, self.__executor = self.__executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
         self.__close_connection()
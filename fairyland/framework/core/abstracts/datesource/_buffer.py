@@ -0,0 +1,238 @@
+# coding: utf8
+"""
+@software: PyCharm
+@author: Lionel Johnson
+@contact: https://fairy.host
+@organization: https://github.com/FairylandFuture
+@since: 03 05, 2024
+"""
+
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+import atexit
+import threading
+import time
+
+from fairyland.framework.modules.journals import journal
+from fairyland.framework.modules.exceptions import DataSourceError
+
+TypeBufferKey = Tuple[str, Tuple[str, ...]]
+
+
+class _PendingRows:
+
+    __slots__ = ("rows", "since")
+
+    def __init__(self) -> None:
+        self.rows: List[Sequence[Any]] = []
+        self.since = time.monotonic()
+
+
+class WriteBuffer:
+    """Write-behind buffer, rows queued per table are written by a background thread with bulk_insert."""
+
+    def __init__(
+        self,
+        datasource: Any,
+        max_rows: int = 1000,
+        max_latency: float = 0.5,
+        max_buffered: int = 100000,
+        timeout: Optional[float] = None,
+        batch_size: int = 1000,
+        on_error: Optional[Callable[[str, Tuple[str, ...], List[Sequence[Any]], Exception], None]] = None,
+    ) -> None:
+        """
+        Initialize the buffer and start its flush thread.
+
+        Rows of a failed flush are not retried, they are handed to on_error. bulk_insert commits per
+        batch, so a flush that fails can have written part of its rows.
+
+        :param datasource: Data source with bulk_insert(table, columns, rows, batch_size=...).
+        :type datasource: Any
+        :param max_rows: Rows of one table that trigger a flush.
+        :type max_rows: int
+        :param max_latency: Seconds a row waits at most before its table is flushed.
+        :type max_latency: float
+        :param max_buffered: Rows held at most, including rows being written, add blocks above it.
+        :type max_buffered: int
+        :param timeout: Seconds add waits for free space before raising, None waits indefinitely.
+        :type timeout: Optional[float]
+        :param batch_size: Rows per INSERT statement.
+        :type batch_size: int
+        :param on_error: Called with the table, columns, rows and error of a failed flush.
+        :type on_error: Optional[Callable]
+        """
+        if max_rows < 1 or max_buffered < 1:
+            raise ValueError("max_rows and max_buffered must be positive integers.")
+        self.__datasource = datasource
+        self.__max_rows = max_rows
+        self.__max_latency = max_latency
+        self.__max_buffered = max(max_buffered, max_rows)
+        self.__timeout = timeout
+        self.__batch_size = batch_size
+        self.__on_error = on_error
+        self.__condition = threading.Condition()
+        # Held while rows are taken out and written, keeps the insert order of a table across threads.
+        self.__write_lock = threading.Lock()
+        self.__pending: Dict[TypeBufferKey, _PendingRows] = {}
+        self.__buffered = 0
+        self.__waiting = 0
+        self.__closed = False
+        self.__stats = {"rows_added": 0, "rows_written": 0, "rows_failed": 0, "flushes": 0, "blocked": 0}
+
+        self.__thread = threading.Thread(target=self.__run, name="fairyland-write-buffer", daemon=True)
+        self.__thread.start()
+        atexit.register(self.close)
+
+    @property
+    def closed(self) -> bool:
+        return self.__closed
+
+    def __due(self) -> Tuple[List[TypeBufferKey], Optional[float]]:
+        now = time.monotonic()
+        keys = []
+        wait = None
+        for key, pending in self.__pending.items():
+            remaining = pending.since + self.__max_latency - now
+            # Writers blocked on a full buffer make every table due.
+            if self.__waiting or len(pending.rows) >= self.__max_rows or remaining <= 0:
+                keys.append(key)
+            elif wait is None or remaining < wait:
+                wait = remaining
+        return keys, wait
+
+    def __run(self) -> None:
+        while True:
+            with self.__condition:
+                while True:
+                    keys, wait = self.__due()
+                    if keys or self.__closed:
+                        break
+                    self.__condition.wait(wait)
+                if self.__closed:
+                    return
+            self.__write(keys)
+
+    def __write(self, keys: Iterable[TypeBufferKey]) -> int:
+        written = 0
+        with self.__write_lock:
+            with self.__condition:
+                batches = [(key, self.__pending.pop(key)) for key in keys if key in self.__pending]
+            for (table, columns), pending in batches:
+                failed = True
+                try:
+                    self.__datasource.bulk_insert(table, columns, pending.rows, batch_size=self.__batch_size)
+                    written += len(pending.rows)
+                    failed = False
+                except Exception as error:
+                    journal.error(f"Write buffer flush of {len(pending.rows)} rows into {table} failed: {error}")
+                    if self.__on_error is not None:
+                        try:
+                            self.__on_error(table, columns, pending.rows, error)
+                        except Exception as callback_error:
+                            journal.error(f"Write buffer error handler failed: {callback_error}")
+                finally:
+                    with self.__condition:
+                        self.__stats["flushes"] += 1
+                        self.__stats["rows_failed" if failed else "rows_written"] += len(pending.rows)
+                        self.__buffered -= len(pending.rows)
+                        self.__condition.notify_all()
+        return written
+
+    def add(self, table: str, columns: Sequence[str], row: Sequence[Any]) -> None:
+        """
+        Queue one row, blocks while the buffer is full.
+
+        :param table: Target table.
+        :type table: str
+        :param columns: Target columns.
+        :type columns: Sequence[str]
+        :param row: Row values in column order.
+        :type row: Sequence[Any]
+        :return: None
+        :rtype: None
+        """
+        self.add_many(table, columns, (row,))
+
+    def add_many(self, table: str, columns: Sequence[str], rows: Iterable[Sequence[Any]]) -> None:
+        """
+        Queue rows of one table, blocks while the buffer is full.
+
+        :param table: Target table.
+        :type table: str
+        :param columns: Target columns.
+        :type columns: Sequence[str]
+        :param rows: Row values in column order.
+        :type rows: Iterable[Sequence[Any]]
+        :return: None
+        :rtype: None
+        """
+        key = (table, tuple(columns))
+        if not key[1]:
+            raise ValueError("At least one column is required.")
+        rows = list(rows)
+        start = 0
+        while start < len(rows):
+            with self.__condition:
+                if self.__closed:
+                    raise DataSourceError("Write buffer is closed.")
+                if self.__buffered >= self.__max_buffered:
+                    self.__stats["blocked"] += 1
+                    self.__waiting += 1
+                    self.__condition.notify_all()
+                    try:
+                        if not self.__condition.wait_for(lambda: self.__buffered < self.__max_buffered or self.__closed, self.__timeout):
+                            raise DataSourceError(f"Write buffer is full, no space within {self.__timeout}s.")
+                    finally:
+                        self.__waiting -= 1
+                    if self.__closed:
+                        raise DataSourceError("Write buffer is closed.")
+                count = min(len(rows) - start, self.__max_buffered - self.__buffered)
+                pending = self.__pending.get(key)
+                if pending is None:
+                    pending = self.__pending[key] = _PendingRows()
+                    # The flush thread has to start timing the new table.
+                    self.__condition.notify_all()
+                pending.rows.extend(rows[start : start + count])
+                self.__buffered += count
+                self.__stats["rows_added"] += count
+                if len(pending.rows) >= self.__max_rows:
+                    self.__condition.notify_all()
+            start += count
+
+    def flush(self) -> int:
+        """
+        Write every queued row now, returns after rows being written by the flush thread are done too.
+
+        :return: Rows written by this call.
+        :rtype: int
+        """
+        with self.__condition:
+            keys = list(self.__pending)
+        return self.__write(keys)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Counters of queued, written and failed rows.
+
+        :return: Buffer statistics.
+        :rtype: dict
+        """
+        with self.__condition:
+            return dict(self.__stats, buffered=self.__buffered)
+
+    def close(self) -> None:
+        """
+        Stop the flush thread and write the remaining rows, also runs at interpreter exit.
+
+        :return: None
+        :rtype: None
+        """
+        with self.__condition:
+            if self.__closed:
+                return
+            self.__closed = True
+            self.__condition.notify_all()
+        atexit.unregister(self.close)
+        if self.__thread is not threading.current_thread():
+            self.__thread.join()
+        self.flush()
@@ -0,0 +1,247 @@
+# coding: utf8
+"""
+@software: PyCharm
+@author: Lionel Johnson
+@contact: https://fairy.host
+@organization: https://github.com/FairylandFuture
+@since: 03 04, 2024
+"""
+
+from typing import Any, Dict, Hashable, Iterable, Optional, Set, Tuple
+from collections import OrderedDict
+import dataclasses
+import sys
+import threading
+import time
+
+from ._formats import Columns
+from ._formats import Record
+
+
+def _statement_key(sql: str) -> str:
+    # Only the ends are trimmed, whitespace inside string literals is part of the statement.
+    return sql.strip().rstrip(";").rstrip()
+
+
+def estimate_result_size(value: Any) -> int:
+    """
+    Approximate memory held by a fetched result.
+
+    :param value: Result of fetchall, Columns, rows of any result format or a tuple of them.
+    :type value: Any
+    :return: Size in bytes.
+    :rtype: int
+    """
+    size = sys.getsizeof(value)
+    if isinstance(value, (tuple, list)):
+        for item in value:
+            size += estimate_result_size(item)
+    elif isinstance(value, dict):
+        for item in value.values():
+            size += estimate_result_size(item)
+    elif isinstance(value, Columns):
+        # array.array reports its buffer, object columns are sized per value.
+        size += estimate_result_size(value.data) + estimate_result_size(value.nulls)
+    elif isinstance(value, Record):
+        for field in value._fields:
+            size += estimate_result_size(getattr(value, field))
+    elif dataclasses.is_dataclass(value):
+        for field in dataclasses.fields(value):
+            size += estimate_result_size(getattr(value, field.name, None))
+    elif hasattr(value, "__dict__"):
+        size += estimate_result_size(vars(value))
+    return size
+
+
+class _CacheEntry:
+
+    __slots__ = ("value", "tables", "size", "expires_at")
+
+    def __init__(self, value: Any, tables: Set[str], size: int, expires_at: Optional[float]) -> None:
+        self.value = value
+        self.tables = tables
+        self.size = size
+        self.expires_at = expires_at
+
+
+class QueryCache:
+    """Thread-safe result cache with TTL, memory-bounded LRU eviction and table tags."""
+
+    def __init__(self, ttl: Optional[float] = 60.0, max_entries: int = 1024, max_bytes: int = 64 * 1024 * 1024) -> None:
+        """
+        Initialize the cache.
+
+        :param ttl: Seconds an entry stays valid, None keeps entries until evicted or invalidated.
+        :type ttl: Optional[float]
+        :param max_entries: Maximum number of cached results.
+        :type max_entries: int
+        :param max_bytes: Approximate memory budget of cached results.
+        :type max_bytes: int
+        """
+        self.__ttl = ttl
+        self.__max_entries = max_entries
+        self.__max_bytes = max_bytes
+        self.__lock = threading.Lock()
+        self.__entries: "OrderedDict[Hashable, _CacheEntry]" = OrderedDict()
+        self.__tags: Dict[str, Set[Hashable]] = {}
+        # Invalidation counts per table and of the whole cache, compared by put to drop results of racing reads.
+        self.__generations: Dict[str, int] = {}
+        self.__flushes = 0
+        self.__bytes = 0
+        self.__stats = {"hits": 0, "misses": 0, "puts": 0, "stale": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+
+    @staticmethod
+    def key(sqls: Any, params: Any) -> Hashable:
+        """
+        Cache key of a statement or list of statements with their parameters.
+
+        :param sqls: SQL statement(s).
+        :type sqls: Union[str, Iterable]
+        :param params: SQL parameters.
+        :type params: Any
+        :return: Hashable key.
+        :rtype: Hashable
+        """
+        if isinstance(sqls, str):
+            return _statement_key(sqls), repr(params)
+        return tuple(_statement_key(sql) for sql in sqls), repr(params)
+
+    def __generation(self, tables: Iterable[str]) -> Tuple[int, ...]:
+        return (self.__flushes,) + tuple(self.__generations.get(table, 0) for table in sorted(tables))
+
+    def generation(self, tables: Iterable[str]) -> Tuple[int, ...]:
+        """
+        Invalidation state of tables, taken before a read and handed to put.
+
+        :param tables: Tables the read depends on.
+        :type tables: Iterable[str]
+        :return: Opaque generation.
+        :rtype: tuple
+        """
+        tables = {table.lower() for table in tables}
+        with self.__lock:
+            return self.__generation(tables)
+
+    def __unlink(self, key: Hashable, entry: _CacheEntry) -> None:
+        del self.__entries[key]
+        self.__bytes -= entry.size
+        for table in entry.tables:
+            keys = self.__tags.get(table)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.__tags[table]
+
+    def get(self, key: Hashable) -> Tuple[bool, Any]:
+        """
+        Look up a cached result.
+
+        :param key: Key built by QueryCache.key.
+        :type key: Hashable
+        :return: (hit, value)
+        :rtype: tuple
+        """
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None:
+                self.__stats["misses"] += 1
+                return False, None
+            if entry.expires_at is not None and entry.expires_at <= time.monotonic():
+                self.__unlink(key, entry)
+                self.__stats["expirations"] += 1
+                self.__stats["misses"] += 1
+                return False, None
+            self.__entries.move_to_end(key)
+            self.__stats["hits"] += 1
+            return True, entry.value
+
+    def put(self, key: Hashable, value: Any, tables: Iterable[str] = (), generation: Optional[Tuple[int, ...]] = None) -> bool:
+        """
+        Store a result tagged with the tables it was read from.
+
+        :param key: Key built by QueryCache.key.
+        :type key: Hashable
+        :param value: Result to cache.
+        :type value: Any
+        :param tables: Tables the result depends on.
+        :type tables: Iterable[str]
+        :param generation: Result of generation(tables) taken before the read, the result is dropped when a table was invalidated since.
+        :type generation: Optional[tuple]
+        :return: False when the result is larger than the whole budget or stale.
+        :rtype: bool
+        """
+        size = estimate_result_size(value)
+        if size > self.__max_bytes:
+            return False
+        tables = {table.lower() for table in tables}
+        expires_at = time.monotonic() + self.__ttl if self.__ttl is not None else None
+
+        with self.__lock:
+            if generation is not None and self.__generation(tables) != generation:
+                # A write committed while the read ran, its rows may predate it.
+                self.__stats["stale"] += 1
+                return False
+            previous = self.__entries.get(key)
+            if previous is not None:
+                self.__unlink(key, previous)
+            self.__entries[key] = _CacheEntry(value, tables, size, expires_at)
+            self.__bytes += size
+            for table in tables:
+                self.__tags.setdefault(table, set()).add(key)
+            self.__stats["puts"] += 1
+
+            while len(self.__entries) > self.__max_entries or self.__bytes > self.__max_bytes:
+                oldest_key, oldest = next(iter(self.__entries.items()))
+                self.__unlink(oldest_key, oldest)
+                self.__stats["evictions"] += 1
+        return True
+
+    def invalidate(self, tables: Optional[Iterable[str]] = None) -> int:
+        """
+        Drop entries that depend on the given tables, or every entry when tables is None.
+
+        :param tables: Modified tables.
+        :type tables: Optional[Iterable[str]]
+        :return: Number of dropped entries.
+        :rtype: int
+        """
+        with self.__lock:
+            if tables is None:
+                self.__flushes += 1
+                count = len(self.__entries)
+                self.__entries.clear()
+                self.__tags.clear()
+                self.__bytes = 0
+            else:
+                count = 0
+                for table in tables:
+                    table = table.lower()
+                    self.__generations[table] = self.__generations.get(table, 0) + 1
+                    for key in list(self.__tags.get(table, ())):
+                        self.__unlink(key, self.__entries[key])
+                        count += 1
+            self.__stats["invalidations"] += count
+        return count
+
+    def clear(self) -> None:
+        """
+        Drop every entry.
+
+        :return: None
+        :rtype: None
+        """
+        self.invalidate(None)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Snapshot of the cache counters.
+
+        :return: Cache statistics.
+        :rtype: dict
+        """
+        with self.__lock:
+            results = dict(self.__stats)
+            results.update(entries=len(self.__entries), bytes=self.__bytes, max_entries=self.__max_entries, max_bytes=self.__max_bytes)
+        lookups = results["hits"] + results["misses"]
+        results.update(hit_ratio=results["hits"] / lookups if lookups else 0.0)
+        return results
@@ -0,0 +1,210 @@
+# coding: utf8
+"""
+@software: PyCharm
+@author: Lionel Johnson
+@contact: https://fairy.host
+@organization: https://github.com/FairylandFuture
+@since: 03 04, 2024
+"""
+
+from typing import Any, BinaryIO, Iterator, List, Optional, Sequence, Tuple, Union
+from array import array
+import csv
+import gzip
+import io
+import json
+import struct
+import sys
+
+from ._formats import Columns
+from ._formats import ColumnsBuilder
+
+EXPORT_FORMATS = ("csv", "jsonl", "columnar")
+
+# Columnar layout: magic, header length + JSON header, then row groups of
+# row count + per column (kind, null flag, null mask, values), ended by a zero row count.
+_COLUMNAR_MAGIC = b"FCOL\x01"
+_UINT32 = struct.Struct("<I")
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value).hex()
+    return str(value)
+
+
+class _CsvEncoder:
+
+    def __init__(self, names: Tuple[str, ...], typecodes: Sequence[Optional[str]], header: bool) -> None:
+        self.__names = names
+        self.__header = header
+        # Columns are classified by their first non-NULL value, binary ones are written as hex.
+        self.__unknown = set(range(len(names)))
+        self.__binary: List[int] = []
+
+    def __classify(self, rows: Sequence[Sequence[Any]]) -> None:
+        for index in list(self.__unknown):
+            for row in rows:
+                value = row[index]
+                if value is not None:
+                    if isinstance(value, (bytes, bytearray, memoryview)):
+                        self.__binary.append(index)
+                    self.__unknown.discard(index)
+                    break
+
+    def start(self) -> bytes:
+        if not self.__header:
+            return b""
+        buffer = io.StringIO()
+        csv.writer(buffer).writerow(self.__names)
+        return buffer.getvalue().encode("utf-8")
+
+    def encode(self, rows: Sequence[Sequence[Any]]) -> bytes:
+        if self.__unknown:
+            self.__classify(rows)
+        if self.__binary:
+            binary = self.__binary
+            rows = [[bytes(value).hex() if index in binary and value is not None else value for index, value in enumerate(row)] for row in rows]
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        return buffer.getvalue().encode("utf-8")
+
+    def finish(self) -> bytes:
+        return b""
+
+
+class _JsonlEncoder:
+
+    def __init__(self, names: Tuple[str, ...], typecodes: Sequence[Optional[str]], header: bool) -> None:
+        self.__names = names
+
+    def start(self) -> bytes:
+        return b""
+
+    def encode(self, rows: Sequence[Sequence[Any]]) -> bytes:
+        names = self.__names
+        dumps = json.JSONEncoder(ensure_ascii=False, default=_json_default).encode
+        return "".join(dumps(dict(zip(names, row))) + "\n" for row in rows).encode("utf-8")
+
+    def finish(self) -> bytes:
+        return b""
+
+
+class _ColumnarEncoder:
+
+    def __init__(self, names: Tuple[str, ...], typecodes: Sequence[Optional[str]], header: bool) -> None:
+        self.__names = names
+        self.__typecodes = list(typecodes)
+
+    def start(self) -> bytes:
+        header = json.dumps({"columns": list(self.__names)}).encode("utf-8")
+        return _COLUMNAR_MAGIC + _UINT32.pack(len(header)) + header
+
+    def encode(self, rows: Sequence[Sequence[Any]]) -> bytes:
+        builder = ColumnsBuilder(self.__names, self.__typecodes)
+        builder.append(rows)
+        columns = builder.build()
+        chunks = [_UINT32.pack(columns.rows)]
+        for values, nulls in zip(columns.data, columns.nulls):
+            if isinstance(values, array):
+                if sys.byteorder != "little":
+                    values = array(values.typecode, values)
+                    values.byteswap()
+                payload = values.tobytes()
+                kind = values.typecode.encode("ascii")
+            else:
+                payload = json.dumps(values, ensure_ascii=False, default=_json_default).encode("utf-8")
+                payload = _UINT32.pack(len(payload)) + payload
+                kind = b"o"
+            chunks.append(kind + (b"\x01" + bytes(nulls) if nulls is not None else b"\x00") + payload)
+        return b"".join(chunks)
+
+    def finish(self) -> bytes:
+        return _UINT32.pack(0)
+
+
+_ENCODERS = {"csv": _CsvEncoder, "jsonl": _JsonlEncoder, "columnar": _ColumnarEncoder}
+_EXTENSIONS = {".csv": "csv", ".jsonl": "jsonl", ".ndjson": "jsonl", ".fcol": "columnar"}
+
+
+def format_of(path: Optional[str]) -> str:
+    """
+    Export format implied by a file extension, ".gz" is ignored and unknown extensions mean CSV.
+
+    :param path: Output path.
+    :type path: Optional[str]
+    :return: Export format.
+    :rtype: str
+    """
+    name = (path or "").lower()
+    if name.endswith(".gz"):
+        name = name[:-3]
+    return next((export_format for extension, export_format in _EXTENSIONS.items() if name.endswith(extension)), "csv")
+
+
+def encoder(export_format: str, names: Tuple[str, ...], typecodes: Sequence[Optional[str]], header: bool = True) -> Any:
+    """
+    Chunk encoder of an export format, start() and finish() frame the encoded batches.
+
+    :param export_format: "csv", "jsonl" or "columnar".
+    :type export_format: str
+    :param names: Column names.
+    :type names: tuple
+    :param typecodes: array typecode per column for the columnar format.
+    :type typecodes: Sequence[Optional[str]]
+    :param header: Write a CSV header line.
+    :type header: bool
+    :return: Encoder.
+    :rtype: Any
+    """
+    try:
+        return _ENCODERS[export_format](names, typecodes, header)
+    except KeyError:
+        raise ValueError(f"Unsupported export format: {export_format}") from None
+
+
+def _read_exact(file: BinaryIO, size: int) -> bytes:
+    data = file.read(size)
+    if len(data) != size:
+        raise ValueError("Truncated columnar file.")
+    return data
+
+
+def read_columnar(source: Union[str, BinaryIO]) -> Iterator[Columns]:
+    """
+    Read a file written by DataSource.export(format="columnar"), one Columns per row group.
+
+    :param source: Path, ".gz" paths are decompressed, or a binary file object.
+    :type source: Union[str, BinaryIO]
+    :return: Row group generator.
+    :rtype: Iterator[Columns]
+    """
+    if isinstance(source, str):
+        with (gzip.open(source, "rb") if source.endswith(".gz") else open(source, "rb")) as file:
+            yield from read_columnar(file)
+        return
+
+    if _read_exact(source, len(_COLUMNAR_MAGIC)) != _COLUMNAR_MAGIC:
+        raise ValueError("Not a columnar export file.")
+    (length,) = _UINT32.unpack(_read_exact(source, 4))
+    names = tuple(json.loads(_read_exact(source, length))["columns"])
+    while True:
+        (rows,) = _UINT32.unpack(_read_exact(source, 4))
+        if not rows:
+            return
+        data: List[Union[array, list]] = []
+        nulls: List[Optional[bytearray]] = []
+        for _ in names:
+            kind = _read_exact(source, 2)
+            nulls.append(bytearray(_read_exact(source, rows)) if kind[1] else None)
+            if kind[:1] == b"o":
+                (length,) = _UINT32.unpack(_read_exact(source, 4))
+                data.append(json.loads(_read_exact(source, length)))
+            else:
+                values = array(kind[:1].decode("ascii"))
+                values.frombytes(_read_exact(source, rows * values.itemsize))
+                if sys.byteorder != "little":
+                    values.byteswap()
+                data.append(values)
+        yield Columns(names, data, nulls, rows)
+
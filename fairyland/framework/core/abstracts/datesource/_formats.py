@@ -0,0 +1,309 @@
+# coding: utf8
+"""
+@software: PyCharm
+@author: Lionel Johnson
+@contact: https://fairy.host
+@organization: https://github.com/FairylandFuture
+@since: 03 04, 2024
+"""
+
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+from array import array
+from collections import namedtuple
+import dataclasses
+import functools
+import inspect
+import keyword
+
+RESULT_FORMATS = ("tuples", "dicts", "namedtuple", "records", "columns")
+
+
+def column_names(description: Optional[Sequence[Sequence[Any]]]) -> Tuple[str, ...]:
+    """
+    Column names of a DB-API cursor description.
+
+    :param description: cursor.description
+    :type description: Optional[Sequence]
+    :return: Column names.
+    :rtype: tuple
+    """
+    return tuple(column[0] for column in description or ())
+
+
+@functools.lru_cache(maxsize=256)
+def _namedtuple_class(names: Tuple[str, ...]) -> type:
+    return namedtuple("Row", names, rename=True)
+
+
+class Record:
+    """Base of the generated __slots__ record classes, rows take no per-instance dict."""
+
+    __slots__ = ()
+    _fields: Tuple[str, ...] = ()
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({', '.join(f'{field}={getattr(self, field)!r}' for field in self._fields)})"
+
+    def __eq__(self, other: Any) -> bool:
+        return type(other) is type(self) and self._astuple() == other._astuple()
+
+    __hash__ = None
+
+    def _astuple(self) -> tuple:
+        return tuple(getattr(self, field) for field in self._fields)
+
+    def _asdict(self) -> Dict[str, Any]:
+        return dict(zip(self._fields, self._astuple()))
+
+
+def _field_names(names: Tuple[str, ...]) -> Tuple[str, ...]:
+    """Column names usable as attributes, others are renamed to _<position> like namedtuple(rename=True)."""
+    fields = []
+    for index, name in enumerate(names):
+        if not name.isidentifier() or keyword.iskeyword(name) or name.startswith("_") or name in fields:
+            name = f"_{index}"
+        fields.append(name)
+    return tuple(fields)
+
+
+def _compile(name: str, source: str, namespace: Dict[str, Any]) -> Callable:
+    exec(source, namespace)
+    return namespace[name]
+
+
+@functools.lru_cache(maxsize=256)
+def record_class(names: Tuple[str, ...]) -> type:
+    """
+    Generated __slots__ record class for a column set, cached per column names.
+
+    :param names: Column names.
+    :type names: tuple
+    :return: Record subclass taking the row values positionally.
+    :rtype: type
+    """
+    fields = _field_names(names)
+    # Column names cannot start with an underscore, so __record never clashes with a field.
+    body = "".join(f"\n    __record.{field} = {field}" for field in fields) or "\n    pass"
+    initializer = _compile("__init__", f"def __init__(__record, {', '.join(fields)}):{body}", {})
+    return type("Record", (Record,), {"__slots__": fields, "_fields": fields, "__init__": initializer})
+
+
+def _record_fields(record_type: type) -> Tuple[List[str], bool]:
+    """Attributes a row can fill and whether they are assigned directly instead of passed to the constructor."""
+    if dataclasses.is_dataclass(record_type):
+        return [field.name for field in dataclasses.fields(record_type) if field.init], False
+    if hasattr(record_type, "_fields"):
+        return list(record_type._fields), False
+    if record_type.__init__ is object.__init__:
+        slots = [slot for cls in reversed(record_type.__mro__) for slot in getattr(cls, "__slots__", ()) if slot not in ("__dict__", "__weakref__")]
+        return [slot for slot in dict.fromkeys(slots) if not slot.startswith("__")], True
+    parameters = inspect.signature(record_type).parameters.values()
+    return [parameter.name for parameter in parameters if parameter.kind in (parameter.POSITIONAL_OR_KEYWORD, parameter.KEYWORD_ONLY)], False
+
+
+@functools.lru_cache(maxsize=256)
+def record_factory(record_type: type, names: Tuple[str, ...]) -> Callable[[Sequence[Any]], Any]:
+    """
+    Compiled converter from a driver row to a user class, cached per class and column set.
+
+    Columns are matched to dataclass fields, namedtuple fields, __slots__ of classes without
+    __init__, or constructor parameters, by name and then case-insensitively.
+
+    :param record_type: Target class.
+    :type record_type: type
+    :param names: Column names.
+    :type names: tuple
+    :return: Row converter.
+    :rtype: Callable
+    """
+    if getattr(record_type, "_fields", None) == names and hasattr(record_type, "_make"):
+        return record_type._make
+
+    fields, assign = _record_fields(record_type)
+    positions = {name: index for index, name in reversed(list(enumerate(names)))}
+    folded = {name.lower(): index for index, name in reversed(list(enumerate(names)))}
+    mapping = []
+    for field in fields:
+        index = positions.get(field, folded.get(field.lower()))
+        if index is not None:
+            mapping.append((field, index))
+    if not mapping:
+        raise ValueError(f"No column of {names} matches a field of {record_type.__name__}.")
+
+    namespace = {"cls": record_type, "new": object.__new__}
+    if assign:
+        body = "".join(f"\n    record.{field} = row[{index}]" for field, index in mapping)
+        return _compile("build", f"def build(row):\n    record = new(cls){body}\n    return record", namespace)
+    arguments = ", ".join(f"{field}=row[{index}]" for field, index in mapping)
+    return _compile("build", f"def build(row):\n    return cls({arguments})", namespace)
+
+
+@functools.lru_cache(maxsize=256)
+def row_factory(names: Tuple[str, ...], result_format: Union[str, type]) -> Optional[Callable[[Sequence[Any]], Any]]:
+    """
+    Precomputed converter from a driver row to the requested row type, cached per column set.
+
+    :param names: Column names.
+    :type names: tuple
+    :param result_format: "tuples", "dicts", "namedtuple", "records" or a class for record_factory.
+    :type result_format: Union[str, type]
+    :return: Row converter, None when rows are returned unchanged.
+    :rtype: Optional[Callable]
+    """
+    if isinstance(result_format, type):
+        return record_factory(result_format, names)
+    if result_format == "tuples":
+        return None
+    if result_format == "dicts":
+        return lambda row: dict(zip(names, row))
+    if result_format == "namedtuple":
+        return _namedtuple_class(names)._make
+    if result_format == "records":
+        cls = record_class(names)
+        return lambda row: cls(*row)
+    raise ValueError(f"Unsupported row format: {result_format}")
+
+
+class Columns:
+    """Column-oriented result, numeric columns are stored in array.array with a null mask."""
+
+    __slots__ = ("names", "data", "nulls", "rows")
+
+    def __init__(self, names: Tuple[str, ...], data: List[Union[array, list]], nulls: List[Optional[bytearray]], rows: int) -> None:
+        self.names = names
+        self.data = data
+        self.nulls = nulls
+        self.rows = rows
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def __getitem__(self, name: str) -> Union[array, list]:
+        return self.data[self.names.index(name)]
+
+    def __repr__(self) -> str:
+        return f"Columns(names={self.names}, rows={self.rows})"
+
+    def null_mask(self, name: str) -> Optional[bytearray]:
+        """
+        Null mask of a column, 1 marks a NULL, None when the column has no NULL.
+
+        :param name: Column name.
+        :type name: str
+        :return: Mask with one byte per row.
+        :rtype: Optional[bytearray]
+        """
+        return self.nulls[self.names.index(name)]
+
+    def to_dict(self) -> Dict[str, Union[array, list]]:
+        return dict(zip(self.names, self.data))
+
+    def to_numpy(self) -> Dict[str, Any]:
+        """
+        Convert to NumPy, typed columns are wrapped without copying and NULLs become masked values.
+
+        :return: Column name to ndarray or masked array.
+        :rtype: dict
+        """
+        import numpy
+
+        results = {}
+        for name, values, nulls in zip(self.names, self.data, self.nulls):
+            if isinstance(values, array):
+                column = numpy.frombuffer(values, dtype=numpy.int64 if values.typecode == "q" else numpy.float64)
+            else:
+                column = numpy.array(values, dtype=object)
+            if nulls is not None:
+                column = numpy.ma.masked_array(column, mask=numpy.frombuffer(bytes(nulls), dtype=numpy.bool_))
+            results[name] = column
+        return results
+
+
+class ColumnsBuilder:
+    """Accumulates fetched batches column by column without keeping the rows."""
+
+    def __init__(self, names: Tuple[str, ...], typecodes: Optional[Sequence[Optional[str]]] = None) -> None:
+        """
+        :param names: Column names.
+        :type names: tuple
+        :param typecodes: array typecode per column ("q" or "d") from the driver type, None infers it from the data.
+        :type typecodes: Optional[Sequence[Optional[str]]]
+        """
+        self.__names = names
+        self.__typecodes: List[Optional[str]] = list(typecodes) if typecodes else [None] * len(names)
+        self.__data: List[Union[array, list, None]] = [None] * len(names)
+        self.__nulls: List[Optional[bytearray]] = [None] * len(names)
+        self.__rows = 0
+
+    def __infer(self, index: int, values: List[Any]) -> None:
+        typecode = self.__typecodes[index]
+        if typecode is None:
+            sample = next((value for value in values if value is not None), None)
+            if sample is None:
+                return
+            if isinstance(sample, int) and not isinstance(sample, bool):
+                typecode = "q"
+            elif isinstance(sample, float):
+                typecode = "d"
+        self.__data[index] = array(typecode) if typecode else []
+        if self.__rows:
+            # Earlier batches were all NULL.
+            self.__data[index].extend([0] * self.__rows if typecode else [None] * self.__rows)
+
+    def append(self, batch: Sequence[Sequence[Any]]) -> None:
+        """
+        Add fetched rows.
+
+        :param batch: Rows from fetchmany / fetchall.
+        :type batch: Sequence[Sequence[Any]]
+        :return: None
+        :rtype: None
+        """
+        if not batch:
+            return
+        for index in range(len(self.__names)):
+            values = [row[index] for row in batch]
+            if self.__data[index] is None:
+                self.__infer(index, values)
+            column = self.__data[index]
+            if column is None:
+                nulls = self.__nulls[index]
+                if nulls is None:
+                    nulls = self.__nulls[index] = bytearray(self.__rows)
+                nulls.extend(b"\x01" * len(values))
+                continue
+            typed = values
+            if None in values:
+                nulls = self.__nulls[index]
+                if nulls is None:
+                    nulls = self.__nulls[index] = bytearray(self.__rows)
+                nulls.extend(1 if value is None else 0 for value in values)
+                if isinstance(column, array):
+                    typed = [0 if value is None else value for value in values]
+            elif self.__nulls[index] is not None:
+                self.__nulls[index].extend(bytes(len(values)))
+            if isinstance(column, array):
+                try:
+                    # Build the chunk first so a failing value leaves the column untouched.
+                    column.extend(array(column.typecode, typed))
+                    continue
+                except (TypeError, OverflowError):
+                    # Mixed or oversized values, fall back to a plain list.
+                    column = self.__data[index] = self.__unpack(index, column)
+            column.extend(values)
+        self.__rows += len(batch)
+
+    def __unpack(self, index: int, column: array) -> list:
+        values = column.tolist()
+        nulls = self.__nulls[index]
+        if nulls is not None:
+            values = [None if nulls[position] else value for position, value in enumerate(values)]
+        return values
+
+    def build(self) -> Columns:
+        """
+        :return: Column-oriented result.
+        :rtype: Columns
+        """
+        data = [column if column is not None else [None] * self.__rows for column in self.__data]
+        return Columns(self.__names, data, self.__nulls, self.__rows)
@@ -0,0 +1,237 @@
+# coding: utf8
+"""
+@software: PyCharm
+@author: Lionel Johnson
+@contact: https://fairy.host
+@organization: https://github.com/FairylandFuture
+@since: 03 04, 2024
+"""
+
+from typing import Any, Dict, List, Optional
+from array import array
+from collections import deque
+from datetime import datetime
+import json
+import math
+import threading
+
+from fairyland.framework.modules.journals import journal
+
+from ._formats import Columns
+from ._sql import fingerprint
+
+# Latency buckets start at 10µs and grow by 2 ** (1 / 4), about 19% relative error.
+_BUCKET_BASE = 1e-5
+_BUCKETS_PER_DOUBLING = 4
+_OTHER = "<other>"
+
+
+def _bucket(seconds: float) -> int:
+    if seconds <= _BUCKET_BASE:
+        return 0
+    return math.ceil(math.log2(seconds / _BUCKET_BASE) * _BUCKETS_PER_DOUBLING)
+
+
+def _bucket_bound(index: int) -> float:
+    return _BUCKET_BASE * 2 ** (index / _BUCKETS_PER_DOUBLING)
+
+
+def _value_size(value: Any) -> int:
+    if value is None:
+        return 0
+    if isinstance(value, (str, bytes, bytearray, memoryview)):
+        return len(value)
+    if isinstance(value, (int, float)):
+        return 8
+    return len(str(value))
+
+
+def payload_size(results: Any) -> int:
+    """
+    Approximate bytes of the values in a fetched result.
+
+    :param results: Rows (tuples, dicts or namedtuples) or a Columns object.
+    :type results: Any
+    :return: Size in bytes.
+    :rtype: int
+    """
+    if isinstance(results, Columns):
+        return sum(values.itemsize * len(values) if isinstance(values, array) else sum(map(_value_size, values)) for values in results.data)
+    size = 0
+    for row in results or ():
+        size += sum(map(_value_size, row.values() if isinstance(row, dict) else row))
+    return size
+
+
+class _StatementStats:
+
+    __slots__ = ("calls", "errors", "seconds", "max_seconds", "rows", "bytes", "buckets")
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.rows = 0
+        self.bytes = 0
+        self.buckets: Dict[int, int] = {}
+
+    def percentile(self, fraction: float) -> float:
+        rank = fraction * self.calls
+        count = 0
+        for index in sorted(self.buckets):
+            count += self.buckets[index]
+            if count >= rank:
+                return min(_bucket_bound(index), self.max_seconds)
+        return self.max_seconds
+
+
+class QueryMetrics:
+    """Thread-safe per-statement latency histograms, row and byte counters and slow-query log."""
+
+    def __init__(self, slow_threshold: Optional[float] = 1.0, slow_log_size: int = 100, max_statements: int = 1000) -> None:
+        """
+        Initialize the collector.
+
+        :param slow_threshold: Seconds above which a statement is logged as slow, None disables the log.
+        :type slow_threshold: Optional[float]
+        :param slow_log_size: Slow statements kept, the oldest are dropped first.
+        :type slow_log_size: int
+        :param max_statements: Distinct statement fingerprints tracked, later ones are counted under "<other>".
+        :type max_statements: int
+        """
+        self.__slow_threshold = slow_threshold
+        self.__max_statements = max_statements
+        self.__lock = threading.Lock()
+        self.__statements: Dict[str, _StatementStats] = {}
+        self.__slow_queries: deque = deque(maxlen=slow_log_size)
+
+    @property
+    def slow_threshold(self) -> Optional[float]:
+        return self.__slow_threshold
+
+    def record(self, statement: str, params: Any, seconds: float, rows: int = 0, size: int = 0, error: bool = False) -> None:
+        """
+        Account one execution.
+
+        :param statement: Executed SQL statement.
+        :type statement: str
+        :param params: SQL parameters, only kept in the slow-query log.
+        :type params: Any
+        :param seconds: Time spent executing and fetching.
+        :type seconds: float
+        :param rows: Rows returned, or affected for writes.
+        :type rows: int
+        :param size: Approximate bytes fetched.
+        :type size: int
+        :param error: The execution failed.
+        :type error: bool
+        :return: None
+        :rtype: None
+        """
+        key = fingerprint(statement)
+        slow = self.__slow_threshold is not None and seconds >= self.__slow_threshold
+        with self.__lock:
+            stats = self.__statements.get(key)
+            if stats is None:
+                if len(self.__statements) >= self.__max_statements:
+                    key = _OTHER
+                    stats = self.__statements.get(key)
+                if stats is None:
+                    stats = self.__statements[key] = _StatementStats()
+            stats.calls += 1
+            stats.errors += error
+            stats.seconds += seconds
+            stats.max_seconds = max(stats.max_seconds, seconds)
+            stats.rows += rows
+            stats.bytes += size
+            bucket = _bucket(seconds)
+            stats.buckets[bucket] = stats.buckets.get(bucket, 0) + 1
+            if slow:
+                self.__slow_queries.append(
+                    {
+                        "statement": statement if len(statement) <= 1000 else statement[:1000] + "...",
+                        "params": repr(params)[:200],
+                        "seconds": seconds,
+                        "rows": rows,
+                        "error": error,
+                        "at": datetime.now().isoformat(timespec="milliseconds"),
+                    }
+                )
+        if slow:
+            journal.warning(f"Slow SQL ({seconds:.3f}s) >> {key}")
+
+    def stats(self, top: Optional[int] = None, sort_by: str = "seconds") -> List[Dict[str, Any]]:
+        """
+        Aggregated statistics per statement fingerprint.
+
+        :param top: Only return the first entries.
+        :type top: Optional[int]
+        :param sort_by: Descending sort field, e.g. "seconds" (total time), "calls", "p99", "rows" or "errors".
+        :type sort_by: str
+        :return: One dict per statement.
+        :rtype: list
+        """
+        with self.__lock:
+            results = [
+                {
+                    "statement": key,
+                    "calls": stats.calls,
+                    "errors": stats.errors,
+                    "seconds": stats.seconds,
+                    "mean": stats.seconds / stats.calls,
+                    "max": stats.max_seconds,
+                    "p50": stats.percentile(0.50),
+                    "p95": stats.percentile(0.95),
+                    "p99": stats.percentile(0.99),
+                    "rows": stats.rows,
+                    "bytes": stats.bytes,
+                }
+                for key, stats in self.__statements.items()
+            ]
+        results.sort(key=lambda item: item[sort_by], reverse=True)
+        return results[:top] if top is not None else results
+
+    def slow_queries(self) -> List[Dict[str, Any]]:
+        """
+        Recent statements slower than the threshold, oldest first.
+
+        :return: Slow-query log entries.
+        :rtype: list
+        """
+        with self.__lock:
+            return list(self.__slow_queries)
+
+    def to_json(self, indent: Optional[int] = 2) -> str:
+        """
+        Statement statistics and slow-query log as JSON.
+
+        :param indent: JSON indentation.
+        :type indent: Optional[int]
+        :return: JSON document.
+        :rtype: str
+        """
+        return json.dumps({"statements": self.stats(), "slow_queries": self.slow_queries()}, ensure_ascii=False, indent=indent)
+
+    def dump(self, path: str) -> None:
+        """
+        Write to_json to a file.
+
+        :param path: Output file.
+        :type path: str
+        :return: None
+        :rtype: None
+        """
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(self.to_json())
+
+    def reset(self) -> None:
+        """
+        Drop every statistic and the slow-query log.
+
+        :return: None
+        :rtype: None
+        """
+        with self.__lock:
+            self.__statements.clear()
+            self.__slow_queries.clear()
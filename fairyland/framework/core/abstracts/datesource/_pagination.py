@@ -0,0 +1,167 @@
+# coding: utf8
+"""
+@software: PyCharm
+@author: Lionel Johnson
+@contact: https://fairy.host
+@organization: https://github.com/FairylandFuture
+@since: 03 04, 2024
+"""
+
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+from datetime import date, datetime, time
+from decimal import Decimal
+import base64
+import json
+import uuid
+
+from ._sql import is_read_statement
+
+
+class Page:
+    """One page of a keyset scan with the token that resumes after it."""
+
+    __slots__ = ("rows", "token", "number")
+
+    def __init__(self, rows: Sequence[Any], token: Optional[str], number: int) -> None:
+        self.rows = rows
+        self.token = token
+        self.number = number
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __repr__(self) -> str:
+        return f"Page(number={self.number}, rows={len(self.rows)})"
+
+
+def _encode_value(value: Any) -> Any:
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, datetime):
+        return {"datetime": value.isoformat()}
+    if isinstance(value, date):
+        return {"date": value.isoformat()}
+    if isinstance(value, time):
+        return {"time": value.isoformat()}
+    if isinstance(value, Decimal):
+        return {"decimal": str(value)}
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return {"bytes": base64.b64encode(bytes(value)).decode("ascii")}
+    if isinstance(value, uuid.UUID):
+        return {"uuid": str(value)}
+    raise TypeError(f"Key value of type {type(value).__name__} cannot be stored in a page token.")
+
+
+_DECODERS = {
+    "datetime": datetime.fromisoformat,
+    "date": date.fromisoformat,
+    "time": time.fromisoformat,
+    "decimal": Decimal,
+    "bytes": base64.b64decode,
+    "uuid": uuid.UUID,
+}
+
+
+def _decode_value(value: Any) -> Any:
+    if isinstance(value, dict):
+        (kind, text), = value.items()
+        return _DECODERS[kind](text)
+    return value
+
+
+def encode_token(key_columns: Sequence[str], values: Sequence[Any]) -> str:
+    """
+    Serialize the last key of a page into a URL-safe token.
+
+    :param key_columns: Key column names.
+    :type key_columns: Sequence[str]
+    :param values: Key values of the last row.
+    :type values: Sequence[Any]
+    :return: Resume token.
+    :rtype: str
+    """
+    document = {"columns": list(key_columns), "key": [_encode_value(value) for value in values]}
+    return base64.urlsafe_b64encode(json.dumps(document, separators=(",", ":")).encode("utf-8")).decode("ascii")
+
+
+def decode_token(token: str, key_columns: Sequence[str]) -> Tuple[Any, ...]:
+    """
+    Key values stored in a resume token.
+
+    :param token: Token of Page.token.
+    :type token: str
+    :param key_columns: Key column names the scan uses, must match the token.
+    :type key_columns: Sequence[str]
+    :return: Key values.
+    :rtype: tuple
+    """
+    try:
+        document = json.loads(base64.urlsafe_b64decode(token.encode("ascii")))
+    except ValueError as error:
+        raise ValueError(f"Invalid page token: {error}") from None
+    if document.get("columns") != list(key_columns):
+        raise ValueError(f"Page token was created for key columns {document.get('columns')}, not {list(key_columns)}.")
+    return tuple(_decode_value(value) for value in document["key"])
+
+
+def keyset_statement(source: str, key_columns: Sequence[str], page_size: int, after_key: bool, descending: bool, quote: Callable[[str], str], placeholder: str) -> str:
+    """
+    SELECT of one page, seeking past the previous key with a row-value comparison.
+
+    :param source: Table name or SELECT statement, a statement becomes a derived table.
+    :type source: str
+    :param key_columns: Unique, indexed key columns.
+    :type key_columns: Sequence[str]
+    :param page_size: Rows per page.
+    :type page_size: int
+    :param after_key: Add the seek condition, False for the first page.
+    :type after_key: bool
+    :param descending: Scan from the highest key down.
+    :type descending: bool
+    :param quote: Identifier quoting of the dialect.
+    :type quote: Callable[[str], str]
+    :param placeholder: Parameter marker of the driver.
+    :type placeholder: str
+    :return: SQL statement.
+    :rtype: str
+    """
+    if is_read_statement(source):
+        relation = f"({source.strip().rstrip(';')}) AS fairyland_page"
+    else:
+        relation = quote(source)
+    columns = [quote(column) for column in key_columns]
+    statement = f"SELECT * FROM {relation}"
+    if after_key:
+        if len(columns) == 1:
+            statement += f" WHERE {columns[0]} {'<' if descending else '>'} {placeholder}"
+        else:
+            statement += f" WHERE ({', '.join(columns)}) {'<' if descending else '>'} ({', '.join([placeholder] * len(columns))})"
+    order = " DESC" if descending else ""
+    return f"{statement} ORDER BY {', '.join(column + order for column in columns)} LIMIT {int(page_size)}"
+
+
+def key_positions(names: Sequence[str], key_columns: Sequence[str]) -> List[int]:
+    """
+    Result positions of the key columns, matched by name and then case-insensitively.
+
+    :param names: Result column names.
+    :type names: Sequence[str]
+    :param key_columns: Key column names, a table prefix is ignored.
+    :type key_columns: Sequence[str]
+    :return: Column positions.
+    :rtype: list
+    """
+    folded = [name.lower() for name in names]
+    positions = []
+    for column in key_columns:
+        name = column.split(".")[-1].strip("`\"[]")
+        if name in names:
+            positions.append(list(names).index(name))
+        elif name.lower() in folded:
+            positions.append(folded.index(name.lower()))
+        else:
+            raise ValueError(f"Key column {column} is not part of the result columns {tuple(names)}.")
+    return positions
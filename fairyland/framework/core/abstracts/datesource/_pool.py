@@ -0,0 +1,337 @@
+# coding: utf8
+"""
+@software: PyCharm
+@author: Lionel Johnson
+@contact: https://fairy.host
+@organization: https://github.com/FairylandFuture
+@since: 03 04, 2024
+"""
+
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+from collections import deque
+import threading
+import time
+
+from fairyland.framework.modules.journals import journal
+from fairyland.framework.modules.exceptions import DataSourceError
+
+
+class _PooledConnection:
+    """Bookkeeping record of a connection owned by the pool."""
+
+    __slots__ = ("connection", "created_at", "last_used")
+
+    def __init__(self, connection: Any) -> None:
+        self.connection = connection
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+
+class _PoolState:
+    """Sizes, records and counters shared by the thread and the asyncio pool, callers hold their pool lock."""
+
+    def __init__(self, min_size: int, max_size: int, max_idle: Optional[float], max_lifetime: Optional[float]) -> None:
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError("Invalid pool size.")
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+        self.idle: Deque[_PooledConnection] = deque()
+        self.in_use: Dict[int, _PooledConnection] = {}
+        self.size = 0
+        self.closed = False
+        self.counters = {
+            "created": 0,
+            "discarded": 0,
+            "checkouts": 0,
+            "waits": 0,
+            "timeouts": 0,
+            "pings": 0,
+            "ping_failures": 0,
+            "evicted_idle": 0,
+            "evicted_lifetime": 0,
+        }
+
+    def count(self, name: str, value: int = 1) -> None:
+        self.counters[name] += value
+
+    def reserve(self, limit: int) -> bool:
+        """Reserve a slot for a new connection while fewer than limit are open."""
+        if self.closed or self.size >= min(limit, self.max_size):
+            return False
+        self.size += 1
+        return True
+
+    def unreserve(self) -> None:
+        self.size -= 1
+
+    def discarded(self) -> None:
+        self.size -= 1
+        self.counters["discarded"] += 1
+
+    def expired(self, record: _PooledConnection, now: float) -> bool:
+        return self.max_lifetime is not None and now - record.created_at >= self.max_lifetime
+
+    def evict_idle(self, now: float) -> List[_PooledConnection]:
+        """Detach expired idle records, the caller closes them after releasing the lock."""
+        evicted: List[_PooledConnection] = []
+        if self.max_idle is None and self.max_lifetime is None:
+            return evicted
+        surplus = self.size - self.min_size
+        for record in list(self.idle):
+            if self.expired(record, now):
+                self.counters["evicted_lifetime"] += 1
+            elif self.max_idle is not None and surplus > 0 and now - record.last_used >= self.max_idle:
+                self.counters["evicted_idle"] += 1
+                surplus -= 1
+            else:
+                continue
+            self.idle.remove(record)
+            self.discarded()
+            evicted.append(record)
+        return evicted
+
+    def take(self, evicted: List[_PooledConnection]) -> Tuple[Optional[_PooledConnection], bool]:
+        """
+        Pop an idle record or reserve a slot, (None, False) means the caller has to wait.
+
+        Expired idle records are appended to evicted for the caller to close.
+        """
+        if self.closed:
+            raise DataSourceError("Connection pool is closed.")
+        evicted.extend(self.evict_idle(time.monotonic()))
+        if self.idle:
+            return self.idle.pop(), False
+        return None, self.reserve(self.max_size)
+
+    def checked_out(self, record: _PooledConnection) -> None:
+        self.in_use[id(record.connection)] = record
+        self.counters["checkouts"] += 1
+
+    def checked_in(self, connection: Any) -> Optional[_PooledConnection]:
+        return self.in_use.pop(id(connection), None)
+
+    def returned(self, record: _PooledConnection, now: float) -> None:
+        record.last_used = now
+        self.idle.append(record)
+
+    def close(self) -> List[_PooledConnection]:
+        """Mark the pool closed and detach the idle records for the caller to discard."""
+        self.closed = True
+        idle = list(self.idle)
+        self.idle.clear()
+        return idle
+
+    def stats(self) -> Dict[str, Any]:
+        results = dict(self.counters)
+        results.update(
+            size=self.size,
+            idle=len(self.idle),
+            in_use=len(self.in_use),
+            min_size=self.min_size,
+            max_size=self.max_size,
+            closed=self.closed,
+        )
+        return results
+
+
+class ConnectionPool:
+    """Thread-safe pool of DB-API connections."""
+
+    def __init__(
+        self,
+        factory: Callable[[], Any],
+        min_size: int = 1,
+        max_size: int = 10,
+        timeout: float = 30.0,
+        max_idle: Optional[float] = 600.0,
+        max_lifetime: Optional[float] = 3600.0,
+        ping: Optional[Callable[[Any], bool]] = None,
+        closer: Optional[Callable[[Any], None]] = None,
+        ping_idle: float = 0.0,
+        lazy: bool = False,
+    ) -> None:
+        """
+        Initialize the pool and open the minimum number of connections.
+
+        :param factory: Callable that opens a new connection.
+        :type factory: Callable[[], Any]
+        :param min_size: Connections kept open even when idle.
+        :type min_size: int
+        :param max_size: Upper bound of connections opened at the same time.
+        :type max_size: int
+        :param timeout: Seconds to wait for a free connection on checkout.
+        :type timeout: float
+        :param max_idle: Seconds after which surplus idle connections are closed, None disables it.
+        :type max_idle: Optional[float]
+        :param max_lifetime: Seconds after which a connection is recycled, None disables it.
+        :type max_lifetime: Optional[float]
+        :param ping: Health check run on checkout, returns False for a dead connection.
+        :type ping: Optional[Callable[[Any], bool]]
+        :param closer: Closes a connection leaving the pool, defaults to connection.close().
+        :type closer: Optional[Callable[[Any], None]]
+        :param ping_idle: Only run the health check on connections idle for at least this many seconds.
+        :type ping_idle: float
+        :param lazy: Open connections on first checkout or fill instead of in the constructor.
+        :type lazy: bool
+        """
+        self.__state = _PoolState(min_size, max_size, max_idle, max_lifetime)
+        self.__factory = factory
+        self.__timeout = timeout
+        self.__ping = ping
+        self.__closer = closer
+        self.__ping_idle = ping_idle
+        self.__condition = threading.Condition()
+
+        if not lazy:
+            self.fill(min_size)
+
+    @property
+    def min_size(self) -> int:
+        return self.__state.min_size
+
+    @property
+    def max_size(self) -> int:
+        return self.__state.max_size
+
+    def fill(self, count: int) -> int:
+        """
+        Open idle connections until the pool holds at least count connections.
+
+        :param count: Target number of open connections.
+        :type count: int
+        :return: Number of connections opened.
+        :rtype: int
+        """
+        opened = 0
+        while True:
+            with self.__condition:
+                if not self.__state.reserve(count):
+                    return opened
+            record = self.__create()
+            with self.__condition:
+                self.__state.idle.append(record)
+                self.__condition.notify()
+            opened += 1
+
+    def __create(self) -> _PooledConnection:
+        try:
+            connection = self.__factory()
+        except Exception:
+            with self.__condition:
+                self.__state.unreserve()
+                self.__condition.notify()
+            raise
+        with self.__condition:
+            self.__state.count("created")
+        return _PooledConnection(connection)
+
+    def __close_quietly(self, record: _PooledConnection) -> None:
+        try:
+            if self.__closer:
+                self.__closer(record.connection)
+            else:
+                record.connection.close()
+        except Exception as error:
+            journal.warning(f"Failed to close pooled connection: {error}")
+
+    def __discard(self, record: _PooledConnection) -> None:
+        with self.__condition:
+            self.__state.discarded()
+            self.__condition.notify()
+        self.__close_quietly(record)
+
+    def acquire(self, timeout: Optional[float] = None) -> Any:
+        """
+        Borrow a connection, opening a new one while below max size.
+
+        :param timeout: Seconds to wait, defaults to the pool timeout.
+        :type timeout: Optional[float]
+        :return: DB-API connection.
+        :rtype: Any
+        """
+        timeout = self.__timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+
+        while True:
+            evicted: List[_PooledConnection] = []
+            try:
+                with self.__condition:
+                    while True:
+                        record, reserved = self.__state.take(evicted)
+                        if record is not None or reserved:
+                            break
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self.__state.count("timeouts")
+                            raise DataSourceError(f"Timed out after {timeout}s waiting for a pooled connection.")
+                        self.__state.count("waits")
+                        self.__condition.wait(remaining)
+            finally:
+                for stale in evicted:
+                    self.__close_quietly(stale)
+
+            if record is None:
+                record = self.__create()
+            elif self.__ping and time.monotonic() - record.last_used >= self.__ping_idle:
+                alive = self.__ping(record.connection)
+                with self.__condition:
+                    self.__state.count("pings")
+                    self.__state.count("ping_failures", not alive)
+                if not alive:
+                    journal.warning("Pooled connection failed the health check, discarding it.")
+                    self.__discard(record)
+                    continue
+
+            with self.__condition:
+                self.__state.checked_out(record)
+            return record.connection
+
+    def release(self, connection: Any, discard: bool = False) -> None:
+        """
+        Return a borrowed connection to the pool.
+
+        :param connection: Connection obtained from acquire.
+        :type connection: Any
+        :param discard: Close the connection instead of reusing it.
+        :type discard: bool
+        :return: None
+        :rtype: None
+        """
+        with self.__condition:
+            record = self.__state.checked_in(connection)
+        if record is None:
+            return
+
+        now = time.monotonic()
+        if discard or self.__state.closed or self.__state.expired(record, now):
+            self.__discard(record)
+            return
+
+        with self.__condition:
+            self.__state.returned(record, now)
+            self.__condition.notify()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Snapshot of the pool counters.
+
+        :return: Pool statistics.
+        :rtype: dict
+        """
+        with self.__condition:
+            return self.__state.stats()
+
+    def close(self) -> None:
+        """
+        Close idle connections, borrowed ones are closed when they come back.
+
+        :return: None
+        :rtype: None
+        """
+        with self.__condition:
+            idle = self.__state.close()
+            self.__condition.notify_all()
+        for record in idle:
+            self.__discard(record)
@@ -0,0 +1,157 @@
+# coding: utf8
+"""
+@software: PyCharm
+@author: Lionel Johnson
+@contact: https://fairy.host
+@organization: https://github.com/FairylandFuture
+@since: 03 04, 2024
+"""
+
+from typing import Any, Iterable, Iterator, List, Sequence, Set, Tuple
+import re
+
+
+def estimate_size(value: Any) -> int:
+    """
+    Upper estimate of the bytes a parameter takes once rendered into a statement.
+
+    :param value: SQL parameter.
+    :type value: Any
+    :return: Estimated size in bytes.
+    :rtype: int
+    """
+    if value is None:
+        return 4
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return 2 * len(value) + 3
+    if isinstance(value, str):
+        # Escaping may double every character, utf-8 takes up to 4 bytes.
+        return 2 * len(value.encode("utf-8")) + 2
+    return len(str(value)) + 2
+
+
+def batched_rows(rows: Iterable[Sequence[Any]], width: int, batch_size: int, max_bytes: int) -> Iterator[Tuple[List[Any], int]]:
+    """
+    Group rows into batches bounded by row count and estimated statement size.
+
+    :param rows: Rows to group, consumed lazily.
+    :type rows: Iterable[Sequence[Any]]
+    :param width: Expected number of values per row.
+    :type width: int
+    :param batch_size: Maximum rows per batch.
+    :type batch_size: int
+    :param max_bytes: Maximum estimated bytes of parameters per batch.
+    :type max_bytes: int
+    :return: Tuples of (flattened parameters, row count).
+    :rtype: Iterator[Tuple[list, int]]
+    """
+    params: List[Any] = []
+    count = 0
+    size = 0
+    for row in rows:
+        if len(row) != width:
+            raise ValueError(f"Row has {len(row)} values, expected {width}.")
+        row_size = sum(estimate_size(value) for value in row) + 2 * width + 3
+        if count and (count >= batch_size or size + row_size > max_bytes):
+            yield params, count
+            params, count, size = [], 0, 0
+        params.extend(row)
+        count += 1
+        size += row_size
+    if count:
+        yield params, count
+
+
+_IDENTIFIER = r"[`\"\[]?[\w$]+[`\"\]]?(?:\.[`\"\[]?[\w$]+[`\"\]]?)?"
+_READ_TABLES = re.compile(rf"\b(?:from|join)\s+({_IDENTIFIER}(?:\s+(?:as\s+)?\w+)?(?:\s*,\s*{_IDENTIFIER}(?:\s+(?:as\s+)?\w+)?)*)", re.IGNORECASE)
+_WRITE_TABLES = re.compile(
+    rf"^\s*(?:insert(?:\s+ignore)?\s+into|replace\s+into|update(?:\s+ignore)?|delete\s+from|truncate(?:\s+table)?|(?:alter|drop)\s+table(?:\s+if\s+exists)?)\s+({_IDENTIFIER})",
+    re.IGNORECASE,
+)
+_READ_KEYWORDS = ("select", "show", "describe", "desc", "explain", "with", "values")
+_WRITE_IN_CTE = re.compile(r"\b(?:insert|update|delete|merge)\b", re.IGNORECASE)
+
+
+def normalize_statement(sql: str) -> str:
+    """
+    Collapse whitespace and drop the trailing semicolon of a statement.
+
+    :param sql: SQL statement.
+    :type sql: str
+    :return: Normalized statement.
+    :rtype: str
+    """
+    return " ".join(sql.split()).rstrip(";").rstrip()
+
+
+_STRING_LITERAL = re.compile(r"'(?:[^'\\]|\\.|'')*'")
+_NUMBER_LITERAL = re.compile(r"(?<![\w$.])-?\d+(?:\.\d+)?(?:e[+-]?\d+)?\b", re.IGNORECASE)
+_PARAMETER_MARKER = re.compile(r"%\(\w+\)s|%s|\$\d+|(?<![:\w]):\w+|\?")
+_VALUE_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_REPEATED_LISTS = re.compile(r"\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+")
+
+
+def fingerprint(sql: str) -> str:
+    """
+    Statement shape with literals and parameter markers replaced, used to aggregate statistics.
+
+    Value lists such as IN (...) and multi-row VALUES collapse to a single "(...)".
+
+    :param sql: SQL statement.
+    :type sql: str
+    :return: Statement fingerprint.
+    :rtype: str
+    """
+    shape = _STRING_LITERAL.sub("?", normalize_statement(sql))
+    shape = _PARAMETER_MARKER.sub("?", _NUMBER_LITERAL.sub("?", shape))
+    return _REPEATED_LISTS.sub("(...)", _VALUE_LIST.sub("(...)", shape))
+
+
+def _table_name(identifier: str) -> str:
+    return identifier.split(".")[-1].strip("`\"[]").lower()
+
+
+def is_read_statement(sql: str) -> bool:
+    """
+    Whether a statement only reads data.
+
+    :param sql: SQL statement.
+    :type sql: str
+    :return: True for SELECT-like statements.
+    :rtype: bool
+    """
+    words = sql.lstrip(" \t\r\n(").split(None, 1)
+    if not words or words[0].lower() not in _READ_KEYWORDS:
+        return False
+    if words[0].lower() == "with" and _WRITE_IN_CTE.search(sql):
+        return False
+    return not re.search(r"\bfor\s+update\b|\binto\s+(?:out|dump)file\b", sql, re.IGNORECASE)
+
+
+def read_tables(sql: str) -> Set[str]:
+    """
+    Tables referenced by FROM and JOIN clauses.
+
+    :param sql: SQL statement.
+    :type sql: str
+    :return: Lower-case table names without schema.
+    :rtype: set
+    """
+    tables = set()
+    for match in _READ_TABLES.finditer(sql):
+        for item in match.group(1).split(","):
+            tables.add(_table_name(item.split()[0]))
+    return tables
+
+
+def write_tables(sql: str) -> Set[str]:
+    """
+    Table modified by a write statement.
+
+    :param sql: SQL statement.
+    :type sql: str
+    :return: Lower-case table names without schema, empty when unknown.
+    :rtype: set
+    """
+    match = _WRITE_TABLES.match(sql)
+    return {_table_name(match.group(1))} if match else set()
@@ -0,0 +1,106 @@
+# coding: utf8
+"""
+@software: PyCharm
+@author: Lionel Johnson
+@contact: https://fairy.host
+@organization: https://github.com/FairylandFuture
+@since: 03 05, 2024
+"""
+
+from typing import Callable, List, Optional
+import heapq
+import itertools
+import threading
+import time
+
+from fairyland.framework.modules.journals import journal
+
+_ARMED, _FIRING, _FIRED, _FAILED, _DISARMED = range(5)
+
+
+class Alarm:
+    """Handle of a callback scheduled by the watchdog."""
+
+    __slots__ = ("deadline", "callback", "state", "done")
+
+    def __init__(self, deadline: float, callback: Callable[[], None]) -> None:
+        self.deadline = deadline
+        self.callback = callback
+        self.state = _ARMED
+        self.done: Optional[threading.Event] = None
+
+
+class Watchdog:
+    """One daemon thread running callbacks at their deadlines, shared by every statement timeout."""
+
+    def __init__(self) -> None:
+        self.__condition = threading.Condition()
+        self.__alarms: List[tuple] = []
+        self.__sequence = itertools.count()
+        self.__thread: Optional[threading.Thread] = None
+
+    def arm(self, seconds: float, callback: Callable[[], None]) -> Alarm:
+        """
+        Run callback on the watchdog thread after a delay unless disarmed first.
+
+        :param seconds: Delay.
+        :type seconds: float
+        :param callback: Called once, exceptions are logged and leave the alarm unfired.
+        :type callback: Callable[[], None]
+        :return: Alarm handle for disarm.
+        :rtype: Alarm
+        """
+        alarm = Alarm(time.monotonic() + seconds, callback)
+        with self.__condition:
+            heapq.heappush(self.__alarms, (alarm.deadline, next(self.__sequence), alarm))
+            if self.__thread is None:
+                self.__thread = threading.Thread(target=self.__run, name="fairyland-watchdog", daemon=True)
+                self.__thread.start()
+            elif self.__alarms[0][2] is alarm:
+                self.__condition.notify()
+        return alarm
+
+    def disarm(self, alarm: Alarm) -> bool:
+        """
+        Cancel an alarm, waits for its callback when it is running.
+
+        :param alarm: Handle returned by arm.
+        :type alarm: Alarm
+        :return: True when the callback ran without raising.
+        :rtype: bool
+        """
+        with self.__condition:
+            if alarm.state == _ARMED:
+                # Left in the heap, skipped when it comes due.
+                alarm.state = _DISARMED
+                return False
+            done = alarm.done
+        if done is not None:
+            done.wait()
+        return alarm.state == _FIRED
+
+    def __run(self) -> None:
+        while True:
+            with self.__condition:
+                while True:
+                    while self.__alarms and self.__alarms[0][2].state != _ARMED:
+                        heapq.heappop(self.__alarms)
+                    wait = self.__alarms[0][0] - time.monotonic() if self.__alarms else None
+                    if wait is not None and wait <= 0:
+                        break
+                    self.__condition.wait(wait)
+                alarm = heapq.heappop(self.__alarms)[2]
+                alarm.state = _FIRING
+                alarm.done = threading.Event()
+            state = _FAILED
+            try:
+                alarm.callback()
+                state = _FIRED
+            except Exception as error:
+                journal.error(f"Watchdog callback failed: {error}")
+            finally:
+                alarm.state = state
+                alarm.done.set()
+
+
+watchdog = Watchdog()
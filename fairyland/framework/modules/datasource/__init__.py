@@ -8,3 +8,9 @@
 """
 
 from ._mysql import MySQLModule
+from ._postgresql import PostgreSQLModule
+from ._async_mysql import AsyncMySQLModule
+from ._routing import RoutingModule
+from ._sharding import ShardedModule
+from ._sqlite import SQLiteModule
+from ._sync import TableSync
@@ -0,0 +1,52 @@
+# coding: utf8
+"""
+@software: PyCharm
+@author: Lionel Johnson
+@contact: https://fairy.host
+@organization: https://github.com/FairylandFuture
+@since: 03 04, 2024
+"""
+
+from typing import Optional
+import aiomysql
+
+from fairyland.framework.modules.journals import journal
+from fairyland.framework.core.abstracts.datesource import AsyncDataSource
+
+
+class AsyncMySQLModule(AsyncDataSource):
+
+    server_side_streams = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 3306, user: str = "root", password: Optional[str] = None, database: Optional[str] = None, **kwargs):
+        self.__host = host
+        self.__port = port
+        self.__user = user
+        self.__password = password
+        self.__database = database
+
+        super().__init__(**kwargs)
+
+    async def connect(self):
+        try:
+            results = await aiomysql.connect(host=self.__host, port=self.__port, user=self.__user, password=self.__password or "", db=self.__database)
+        except Exception as error:
+            journal.error(error)
+            raise
+        return results
+
+    async def close_connection(self, connection) -> None:
+        await connection.ensure_closed()
+
+    async def ping(self, connection) -> bool:
+        try:
+            await connection.ping(reconnect=False)
+        except Exception:
+            return False
+        return True
+
+    async def stream_cursor(self, connection, fetch_size: int):
+        return await connection.cursor(aiomysql.SSCursor)
+
+    async def execute(self, query, params) -> None:
+        await self.cursor.execute(query, params)
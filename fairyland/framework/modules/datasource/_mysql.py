@@ -7,23 +7,46 @@
 @since: 03 04, 2024
 """
 
-from typing import Optional
+from typing import List, Optional
+import re
 import pymysql
+from pymysql.constants import FIELD_TYPE
 
 from fairyland.framework.modules.journals import journal
 from fairyland.framework.core.abstracts.datesource import DataSource
 
 
+_TYPECODES = {
+    FIELD_TYPE.TINY: "q",
+    FIELD_TYPE.SHORT: "q",
+    FIELD_TYPE.LONG: "q",
+    FIELD_TYPE.INT24: "q",
+    FIELD_TYPE.LONGLONG: "q",
+    FIELD_TYPE.YEAR: "q",
+    FIELD_TYPE.FLOAT: "d",
+    FIELD_TYPE.DOUBLE: "d",
+}
+# CR_CONN_HOST_ERROR, CR_SERVER_GONE_ERROR, CR_SERVER_LOST, CR_SERVER_LOST_EXTENDED
+_DISCONNECT_CODES = {2003, 2006, 2013, 2055}
+# ER_QUERY_INTERRUPTED, ER_QUERY_TIMEOUT
+_TIMEOUT_CODES = {1317, 3024}
+_SELECT = re.compile(r"^(\s*select)\b", re.IGNORECASE)
+
+
 class MySQLModule(DataSource):
 
-    def __init__(self, host: str = "127.0.0.1", port: int = 3306, user: str = "root", password: Optional[str] = None, database: Optional[str] = None):
+    server_side_streams = True
+    cancel_grace = 1.0
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 3306, user: str = "root", password: Optional[str] = None, database: Optional[str] = None, **kwargs):
         self.__host = host
         self.__port = port
         self.__user = user
         self.__password = password
         self.__database = database
+        self.__max_allowed_packet: Optional[int] = None
 
-        super().__init__()
+        super().__init__(**kwargs)
 
     def connect(self):
         try:
@@ -33,5 +56,80 @@ class MySQLModule(DataSource):
             raise
         return results
 
+    def ping(self, connection) -> bool:
+        try:
+            connection.ping(reconnect=False)
+        except Exception:
+            return False
+        return True
+
+    def is_disconnect(self, error, connection) -> bool:
+        if isinstance(error, pymysql.err.InterfaceError):
+            # Raised for calls on a connection pymysql already closed.
+            return True
+        if isinstance(error, pymysql.err.OperationalError) and error.args:
+            return error.args[0] in _DISCONNECT_CODES
+        return super().is_disconnect(error, connection)
+
+    def is_timeout(self, error) -> bool:
+        return isinstance(error, pymysql.err.MySQLError) and bool(error.args) and error.args[0] in _TIMEOUT_CODES
+
+    def limit_statement(self, connection, query: str, seconds: float) -> str:
+        # The optimizer hint only limits SELECT statements, other statements rely on cancel().
+        return _SELECT.sub(rf"\1 /*+ MAX_EXECUTION_TIME({max(int(seconds * 1000), 1)}) */", query, count=1)
+
+    def cancel(self, connection) -> None:
+        side = self.connect()
+        try:
+            with side.cursor() as cursor:
+                cursor.execute(f"KILL QUERY {int(connection.thread_id())}")
+        finally:
+            side.close()
+
+    def quote_identifier(self, name: str) -> str:
+        return ".".join("`" + part.replace("`", "``") + "`" for part in name.split("."))
+
+    def upsert_clause(self, key_columns: List[str], update_columns: List[str]) -> str:
+        # The conflict target is implied by the unique keys; VALUES() still works on 8.0 next to the row alias syntax.
+        assignments = ", ".join(f"{self.quote_identifier(column)} = VALUES({self.quote_identifier(column)})" for column in update_columns or key_columns[:1])
+        return f" ON DUPLICATE KEY UPDATE {assignments}"
+
+    def max_statement_size(self, connection) -> int:
+        if self.__max_allowed_packet is None:
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT @@max_allowed_packet")
+                    self.__max_allowed_packet = int(cursor.fetchone()[0])
+            except Exception as error:
+                journal.warning(f"Failed to read max_allowed_packet: {error}")
+                return self.default_statement_size
+        return self.__max_allowed_packet
+
+    def column_typecode(self, type_code):
+        return _TYPECODES.get(type_code)
+
+    def stream_cursor(self, connection, fetch_size: int):
+        return connection.cursor(pymysql.cursors.SSCursor)
+
+    def replica_lag(self) -> Optional[float]:
+        """
+        Seconds the replica is behind its source, for RoutingModule lag checks.
+
+        :return: Replication lag, None when replication is not running.
+        :rtype: Optional[float]
+        """
+        with self.connection() as connection:
+            with connection.cursor(pymysql.cursors.DictCursor) as cursor:
+                try:
+                    cursor.execute("SHOW REPLICA STATUS")
+                except pymysql.err.ProgrammingError:
+                    # Servers before 8.0.22.
+                    cursor.execute("SHOW SLAVE STATUS")
+                status = cursor.fetchone()
+        if not status:
+            return None
+        lag = status.get("Seconds_Behind_Source", status.get("Seconds_Behind_Master"))
+        return float(lag) if lag is not None else None
+
     def execute(self, query, params) -> None:
         self.cursor.execute(query, params)
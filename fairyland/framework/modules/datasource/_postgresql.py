@@ -0,0 +1,187 @@
+# coding: utf8
+"""
+@software: PyCharm
+@author: Lionel Johnson
+@contact: https://fairy.host
+@organization: https://github.com/FairylandFuture
+@since: 03 04, 2024
+"""
+
+from typing import Any, Dict, Iterable, Optional, Sequence, IO
+import io
+import json
+import time
+import uuid
+import psycopg2
+import psycopg2.extensions
+
+from fairyland.framework.modules.journals import journal
+from fairyland.framework.core.abstracts.datesource import DataSource
+
+
+# int2, int4, int8, float4, float8
+_TYPECODES = {21: "q", 23: "q", 20: "q", 700: "d", 701: "d"}
+
+
+def _copy_text(value: Any) -> str:
+    """Render a value in the COPY text format."""
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return "\\\\x" + bytes(value).hex()
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value, ensure_ascii=False)
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+class _CopyInStream(io.TextIOBase):
+    """Read-only text stream that encodes rows on demand for COPY FROM STDIN."""
+
+    def __init__(self, rows: Iterable[Sequence[Any]]) -> None:
+        super().__init__()
+        self.__rows = iter(rows)
+        self.__pending = ""
+        self.rows = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: Optional[int] = -1) -> str:
+        size = size if size is not None and size >= 0 else None
+        chunks = [self.__pending]
+        length = len(self.__pending)
+        while size is None or length < size:
+            row = next(self.__rows, None)
+            if row is None:
+                break
+            line = "\t".join(_copy_text(value) for value in row) + "\n"
+            chunks.append(line)
+            length += len(line)
+            self.rows += 1
+        data = "".join(chunks)
+        if size is None:
+            self.__pending = ""
+            return data
+        self.__pending = data[size:]
+        return data[:size]
+
+
+class PostgreSQLModule(DataSource):
+
+    cancel_grace = 1.0
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 5432, user: str = "postgres", password: Optional[str] = None, database: Optional[str] = None, **kwargs):
+        self.__host = host
+        self.__port = port
+        self.__user = user
+        self.__password = password
+        self.__database = database
+
+        super().__init__(**kwargs)
+
+    def connect(self):
+        try:
+            results = psycopg2.connect(host=self.__host, port=self.__port, user=self.__user, password=self.__password, dbname=self.__database)
+        except Exception as error:
+            journal.error(error)
+            raise
+        return results
+
+    def is_disconnect(self, error, connection) -> bool:
+        # Without the connection only client-side errors count, errors reported by the server carry a pgcode.
+        closed = connection.closed if connection is not None else getattr(error, "pgcode", None) is None
+        if isinstance(error, (psycopg2.OperationalError, psycopg2.InterfaceError)) and closed:
+            return True
+        return super().is_disconnect(error, connection)
+
+    def is_timeout(self, error) -> bool:
+        return isinstance(error, psycopg2.extensions.QueryCanceledError)
+
+    def limit_statement(self, connection, query: str, seconds: float) -> str:
+        # SET LOCAL ends with the transaction, outside of one only cancel() applies.
+        if not connection.autocommit or connection.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            with connection.cursor() as cursor:
+                cursor.execute(f"SET LOCAL statement_timeout = {max(int(seconds * 1000), 1)}")
+        return query
+
+    def cancel(self, connection) -> None:
+        connection.cancel()
+
+    def column_typecode(self, type_code):
+        return _TYPECODES.get(type_code)
+
+    def stream_cursor(self, connection, fetch_size: int):
+        # Named cursors need a transaction, in autocommit mode the cursor is declared WITH HOLD and the server keeps its rows until it is closed.
+        cursor = connection.cursor(name=f"fairyland_stream_{uuid.uuid4().hex}", withhold=connection.autocommit)
+        cursor.itersize = fetch_size
+        return cursor
+
+    def execute(self, query, params) -> None:
+        self.cursor.execute(query, params)
+
+    def copy_in(self, table: str, rows: Iterable[Sequence[Any]], columns: Optional[Iterable[str]] = None, buffer_size: int = 64 * 1024) -> Dict[str, Any]:
+        """
+        Load rows with COPY FROM STDIN, rows are encoded while the server reads them.
+
+        :param table: Target table.
+        :type table: str
+        :param rows: Row values in column order, consumed lazily.
+        :type rows: Iterable[Sequence[Any]]
+        :param columns: Target columns, defaults to every column of the table.
+        :type columns: Optional[Iterable[str]]
+        :param buffer_size: Characters sent to the server per read.
+        :type buffer_size: int
+        :return: Loaded rows, elapsed seconds and rows per second.
+        :rtype: dict
+        """
+        column_sql = f" ({', '.join(self.quote_identifier(column) for column in columns)})" if columns else ""
+        query = f"COPY {self.quote_identifier(table)}{column_sql} FROM STDIN"
+        stream = _CopyInStream(rows)
+        start_time = time.perf_counter()
+
+        journal.trace(f"SQL >> {query}")
+        with self.connection() as connection:
+            with connection.cursor() as cursor:
+                cursor.copy_expert(query, stream, size=buffer_size)
+
+        if self.query_cache is not None:
+            self.query_cache.invalidate({table.split(".")[-1].lower()})
+        seconds = time.perf_counter() - start_time
+        results = {"rows": stream.rows, "seconds": seconds, "rows_per_second": stream.rows / seconds if seconds > 0 else 0.0}
+        journal.info(f"COPY into {table}: {stream.rows} rows, {results['rows_per_second']:.0f} rows/s.")
+        return results
+
+    def copy_out(self, query: str, sink: IO, params: Optional[Iterable] = None, csv: bool = True, header: bool = True, buffer_size: int = 64 * 1024) -> None:
+        """
+        Export a query or table with COPY TO STDOUT, the driver writes to the sink in chunks.
+
+        :param query: SELECT statement or table name.
+        :type query: str
+        :param sink: File-like object with a write method.
+        :type sink: IO
+        :param params: SQL parameters of the query.
+        :type params: Optional[Iterable]
+        :param csv: Use the CSV format instead of the text format.
+        :type csv: bool
+        :param header: Write a header line, CSV only.
+        :type header: bool
+        :param buffer_size: Size of the chunks written to the sink.
+        :type buffer_size: int
+        :return: None
+        :rtype: None
+        """
+        source = query.strip().rstrip(";")
+        options = " WITH (FORMAT csv, HEADER true)" if csv and header else " WITH (FORMAT csv)" if csv else ""
+
+        with self.connection() as connection:
+            with connection.cursor() as cursor:
+                if source.split(None, 1)[0].lower() in ("select", "with", "values", "table"):
+                    encoding = psycopg2.extensions.encodings.get(connection.encoding, "utf-8")
+                    source = f"({cursor.mogrify(source, params).decode(encoding)})"
+                else:
+                    source = self.quote_identifier(source)
+                statement = f"COPY {source} TO STDOUT{options}"
+                journal.trace(f"SQL >> {statement}")
+                cursor.copy_expert(statement, sink, size=buffer_size)
@@ -0,0 +1,271 @@
+# coding: utf8
+"""
+@software: PyCharm
+@author: Lionel Johnson
+@contact: https://fairy.host
+@organization: https://github.com/FairylandFuture
+@since: 03 04, 2024
+"""
+
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Union
+import contextlib
+import itertools
+import threading
+import time
+
+from fairyland.framework.modules.journals import journal
+from fairyland.framework.modules.exceptions import DataSourceError
+from fairyland.framework.core.abstracts.datesource import DataSource
+from fairyland.framework.core.abstracts.datesource._sql import is_read_statement
+
+
+class _ReplicaState:
+
+    __slots__ = ("datasource", "latency", "lag", "lag_checked_at", "down_until")
+
+    def __init__(self, datasource: DataSource) -> None:
+        self.datasource = datasource
+        self.latency: Optional[float] = None
+        self.lag: Optional[float] = None
+        self.lag_checked_at = 0.0
+        self.down_until = 0.0
+
+
+class RoutingModule:
+    """Sends reads to replicas and writes, transactions and sticky reads to the primary."""
+
+    STRATEGIES = ("round_robin", "least_latency")
+
+    def __init__(
+        self,
+        primary: DataSource,
+        replicas: Iterable[DataSource],
+        strategy: str = "round_robin",
+        lag_check: Optional[Callable[[DataSource], Optional[float]]] = None,
+        max_lag: float = 5.0,
+        lag_check_interval: float = 5.0,
+        retry_after: float = 30.0,
+        sticky_seconds: float = 0.0,
+    ) -> None:
+        """
+        Initialize the router.
+
+        :param primary: Data source receiving writes.
+        :type primary: DataSource
+        :param replicas: Data sources receiving reads.
+        :type replicas: Iterable[DataSource]
+        :param strategy: "round_robin" or "least_latency" (smoothed latency of previous reads).
+        :type strategy: str
+        :param lag_check: Returns the replication lag of a replica in seconds, None when unknown.
+        :type lag_check: Optional[Callable[[DataSource], Optional[float]]]
+        :param max_lag: Replicas lagging more than this are skipped.
+        :type max_lag: float
+        :param lag_check_interval: Seconds a lag measurement is reused.
+        :type lag_check_interval: float
+        :param retry_after: Seconds a failed replica is skipped.
+        :type retry_after: float
+        :param sticky_seconds: Reads of a thread go to the primary for this long after its last write.
+        :type sticky_seconds: float
+        """
+        if strategy not in self.STRATEGIES:
+            raise ValueError(f"Unsupported routing strategy: {strategy}")
+
+        self.__primary = primary
+        self.__replicas: List[_ReplicaState] = [_ReplicaState(replica) for replica in replicas]
+        self.__strategy = strategy
+        self.__lag_check = lag_check
+        self.__max_lag = max_lag
+        self.__lag_check_interval = lag_check_interval
+        self.__retry_after = retry_after
+        self.__sticky_seconds = sticky_seconds
+        self.__counter = itertools.count()
+        self.__lock = threading.Lock()
+        self.__local = threading.local()
+        self.__stats = {"primary_reads": 0, "replica_reads": 0, "writes": 0, "replica_failures": 0}
+
+    @property
+    def primary(self) -> DataSource:
+        return self.__primary
+
+    @property
+    def replicas(self) -> List[DataSource]:
+        return [state.datasource for state in self.__replicas]
+
+    def __count(self, name: str) -> None:
+        with self.__lock:
+            self.__stats[name] += 1
+
+    def __pinned(self) -> bool:
+        """Whether reads of the current thread must see its own writes."""
+        if getattr(self.__local, "transaction", 0):
+            return True
+        sessions = getattr(self.__local, "sessions", None)
+        if sessions and sessions[-1]:
+            return True
+        return time.monotonic() < getattr(self.__local, "sticky_until", 0.0)
+
+    def __written(self) -> None:
+        self.__count("writes")
+        sessions = getattr(self.__local, "sessions", None)
+        if sessions:
+            sessions[-1] = True
+        if self.__sticky_seconds:
+            self.__local.sticky_until = time.monotonic() + self.__sticky_seconds
+
+    def __healthy(self, state: _ReplicaState, now: float) -> bool:
+        if state.down_until > now:
+            return False
+        if self.__lag_check is None:
+            return True
+        if now - state.lag_checked_at >= self.__lag_check_interval:
+            state.lag_checked_at = now
+            try:
+                state.lag = self.__lag_check(state.datasource)
+            except Exception as error:
+                journal.warning(f"Replica lag check failed: {error}")
+                state.lag = None
+        # Unknown lag means replication is broken or stopped.
+        return state.lag is not None and state.lag <= self.__max_lag
+
+    def __choose(self) -> Optional[_ReplicaState]:
+        now = time.monotonic()
+        candidates = [state for state in self.__replicas if self.__healthy(state, now)]
+        if not candidates:
+            return None
+        if self.__strategy == "least_latency":
+            unmeasured = [state for state in candidates if state.latency is None]
+            if unmeasured:
+                return unmeasured[next(self.__counter) % len(unmeasured)]
+            return min(candidates, key=lambda state: state.latency)
+        return candidates[next(self.__counter) % len(candidates)]
+
+    def __read(self, method: str, *args: Any, **kwargs: Any) -> Any:
+        state = None if self.__pinned() else self.__choose()
+        if state is None:
+            self.__count("primary_reads")
+            return getattr(self.__primary, method)(*args, **kwargs)
+
+        start_time = time.perf_counter()
+        try:
+            results = getattr(state.datasource, method)(*args, **kwargs)
+        except Exception as error:
+            # Only an unreachable replica fails over, statement errors and timeouts would fail on the primary too.
+            if not (isinstance(error, DataSourceError) or state.datasource.is_disconnect(error, None)):
+                raise
+            self.__count("replica_failures")
+            state.down_until = time.monotonic() + self.__retry_after
+            journal.warning(f"Replica read failed, retrying on the primary: {error}")
+            self.__count("primary_reads")
+            return getattr(self.__primary, method)(*args, **kwargs)
+        elapsed = time.perf_counter() - start_time
+        with self.__lock:
+            state.latency = elapsed if state.latency is None else 0.8 * state.latency + 0.2 * elapsed
+            self.__stats["replica_reads"] += 1
+        return results
+
+    def operate(self, query: Union[str, Iterable], params: Optional[Iterable] = None, **kwargs: Any) -> Any:
+        """
+        Route a DataSource.operate call, statements that are all reads go to a replica.
+
+        :param query: SQL statement or list of statements.
+        :type query: Union[str, Iterable]
+        :param params: SQL parameters.
+        :type params: Optional[Iterable]
+        :param kwargs: Other DataSource.operate options.
+        :type kwargs: Any
+        :return: DataSource.operate result.
+        :rtype: Any
+        """
+        statements = [query] if isinstance(query, str) else list(query)
+        if statements and all(is_read_statement(statement) for statement in statements):
+            return self.__read("operate", query, params, **kwargs)
+        try:
+            return self.__primary.operate(query, params, **kwargs)
+        finally:
+            self.__written()
+
+    def iterate(self, query: str, params: Optional[Iterable] = None, **kwargs: Any) -> Iterator:
+        """
+        Stream a read from a replica, or from the primary when pinned.
+
+        Replica failures surface while iterating and are not retried.
+
+        :return: DataSource.iterate generator.
+        :rtype: Iterator
+        """
+        state = None if self.__pinned() else self.__choose()
+        self.__count("primary_reads" if state is None else "replica_reads")
+        return (self.__primary if state is None else state.datasource).iterate(query, params, **kwargs)
+
+    def bulk_insert(self, *args: Any, **kwargs: Any) -> Dict[str, Any]:
+        try:
+            return self.__primary.bulk_insert(*args, **kwargs)
+        finally:
+            self.__written()
+
+    def bulk_upsert(self, *args: Any, **kwargs: Any) -> Dict[str, Any]:
+        try:
+            return self.__primary.bulk_upsert(*args, **kwargs)
+        finally:
+            self.__written()
+
+    @contextlib.contextmanager
+    def connection(self) -> Iterator[Any]:
+        try:
+            with self.__primary.connection() as connection:
+                yield connection
+        finally:
+            self.__written()
+
+    @contextlib.contextmanager
+    def transaction(self) -> Iterator[Any]:
+        """
+        Open a transaction on the primary, every call of the block goes to the primary.
+
+        :return: Context manager yielding the transaction connection.
+        :rtype: Iterator[Any]
+        """
+        self.__local.transaction = getattr(self.__local, "transaction", 0) + 1
+        try:
+            with self.__primary.transaction() as connection:
+                yield connection
+        finally:
+            self.__local.transaction -= 1
+            self.__written()
+
+    @contextlib.contextmanager
+    def session(self) -> Iterator["RoutingModule"]:
+        """
+        Read-your-writes scope, once the current thread writes in it later reads go to the primary.
+
+        :return: Context manager yielding the router.
+        :rtype: Iterator[RoutingModule]
+        """
+        sessions = getattr(self.__local, "sessions", None)
+        if sessions is None:
+            sessions = self.__local.sessions = []
+        # A nested scope inherits the pinning of its parent.
+        sessions.append(bool(sessions and sessions[-1]))
+        try:
+            yield self
+        finally:
+            sessions.pop()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Routing counters and replica state.
+
+        :return: Router statistics.
+        :rtype: dict
+        """
+        with self.__lock:
+            results: Dict[str, Any] = dict(self.__stats)
+        now = time.monotonic()
+        results.update(replicas=[{"latency": state.latency, "lag": state.lag, "down": state.down_until > now} for state in self.__replicas])
+        return results
+
+    def close(self) -> None:
+
+        self.__primary.close()
+        for state in self.__replicas:
+            state.datasource.close()
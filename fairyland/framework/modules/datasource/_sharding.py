@@ -0,0 +1,305 @@
+# coding: utf8
+"""
+@software: PyCharm
+@author: Lionel Johnson
+@contact: https://fairy.host
+@organization: https://github.com/FairylandFuture
+@since: 03 04, 2024
+"""
+
+from typing import Any, Callable, Dict, Hashable, Iterable, Iterator, List, Mapping, Optional, Sequence, Union
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
+import heapq
+import operator
+import queue
+import re
+import threading
+
+from fairyland.framework.modules.journals import journal
+from fairyland.framework.core.abstracts.datesource import DataSource
+
+# A number or a placeholder: ?, %s, %(name)s, :name or $1.
+_LIMIT_VALUE = r"(\d+|\?|%s|%\(\w+\)s|:\w+|\$\d+)"
+_LIMIT_PATTERN = re.compile(rf"\blimit\s+{_LIMIT_VALUE}(\s*(,|offset)\s*{_LIMIT_VALUE})?\s*;?\s*$", re.IGNORECASE)
+_DONE = object()
+
+
+def _sort_key(order_by: Union[None, int, str, Sequence, Callable]) -> Optional[Callable]:
+    if order_by is None or callable(order_by):
+        return order_by
+    if isinstance(order_by, (int, str)):
+        return operator.itemgetter(order_by)
+    return operator.itemgetter(*order_by)
+
+
+class _ShardStream(threading.Thread):
+    """Producer thread reading batches of one shard into a bounded queue."""
+
+    def __init__(self, name: Hashable, rows: Iterator, sink: queue.Queue, stop: threading.Event) -> None:
+        super().__init__(name=f"fairyland-shard-{name}", daemon=True)
+        self.shard = name
+        self.__rows = rows
+        self.__sink = sink
+        self.__stop = stop
+
+    def __put(self, item: Any) -> bool:
+        while not self.__stop.is_set():
+            try:
+                self.__sink.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def run(self) -> None:
+        try:
+            for batch in self.__rows:
+                if not self.__put((self.shard, batch)):
+                    break
+            else:
+                self.__put((self.shard, _DONE))
+        except BaseException as error:
+            self.__put((self.shard, error))
+        finally:
+            # Releases the cursor and connection of an abandoned stream.
+            self.__rows.close()
+
+
+class ShardedModule:
+    """Routes single-shard calls by a shard key and fans cross-shard reads out concurrently."""
+
+    def __init__(
+        self,
+        shards: Union[Mapping[Hashable, DataSource], Sequence[DataSource]],
+        shard_key: Callable[[Any], Hashable],
+        max_workers: Optional[int] = None,
+    ) -> None:
+        """
+        Initialize the sharded data source.
+
+        :param shards: Data source per shard name, a sequence is named by position.
+        :type shards: Union[Mapping[Hashable, DataSource], Sequence[DataSource]]
+        :param shard_key: Maps a shard key value (e.g. tenant id) to a shard name.
+        :type shard_key: Callable[[Any], Hashable]
+        :param max_workers: Threads running cross-shard queries, defaults to the number of shards.
+        :type max_workers: Optional[int]
+        """
+        self.__shards: Dict[Hashable, DataSource] = dict(shards) if isinstance(shards, Mapping) else dict(enumerate(shards))
+        if not self.__shards:
+            raise ValueError("At least one shard is required.")
+        self.__shard_key = shard_key
+        self.__max_workers = max_workers or len(self.__shards)
+        self.__executor: Optional[ThreadPoolExecutor] = None
+        self.__lock = threading.Lock()
+
+    @property
+    def shards(self) -> Dict[Hashable, DataSource]:
+        return dict(self.__shards)
+
+    def shard(self, key: Any) -> DataSource:
+        """
+        Data source holding a shard key value.
+
+        :param key: Shard key value.
+        :type key: Any
+        :return: Data source of the shard.
+        :rtype: DataSource
+        """
+        name = self.__shard_key(key)
+        try:
+            return self.__shards[name]
+        except KeyError:
+            raise KeyError(f"Shard key {key!r} maps to unknown shard {name!r}") from None
+
+    def __pool(self) -> ThreadPoolExecutor:
+        with self.__lock:
+            if self.__executor is None:
+                self.__executor = ThreadPoolExecutor(max_workers=self.__max_workers, thread_name_prefix="fairyland-shard")
+            return self.__executor
+
+    def __targets(self, shards: Optional[Iterable[Hashable]]) -> Dict[Hashable, DataSource]:
+        if shards is None:
+            return self.__shards
+        return {name: self.__shards[name] for name in shards}
+
+    @staticmethod
+    def __push_limit(query: str, limit: Optional[int]) -> str:
+        if limit is None or _LIMIT_PATTERN.search(query):
+            return query
+        return f"{query.strip().rstrip(';')} LIMIT {int(limit)}"
+
+    def operate(self, key: Any, query: Union[str, Iterable], params: Optional[Iterable] = None, **kwargs: Any) -> Any:
+        """
+        Run DataSource.operate on the shard of a key.
+
+        :param key: Shard key value.
+        :type key: Any
+        :return: DataSource.operate result.
+        :rtype: Any
+        """
+        return self.shard(key).operate(query, params, **kwargs)
+
+    def iterate(self, key: Any, query: str, params: Optional[Iterable] = None, **kwargs: Any) -> Iterator:
+        return self.shard(key).iterate(query, params, **kwargs)
+
+    @contextlib.contextmanager
+    def transaction(self, key: Any) -> Iterator[Any]:
+        with self.shard(key).transaction() as connection:
+            yield connection
+
+    def bulk_insert(self, table: str, columns: Sequence[str], rows: Iterable[Sequence[Any]], key_column: str, batch_size: int = 1000) -> Dict[str, Any]:
+        """
+        Split rows by shard and insert them on every shard concurrently.
+
+        :param table: Target table.
+        :type table: str
+        :param columns: Column names.
+        :type columns: Sequence[str]
+        :param rows: Row values in column order.
+        :type rows: Iterable[Sequence[Any]]
+        :param key_column: Column holding the shard key.
+        :type key_column: str
+        :param batch_size: Rows per INSERT statement.
+        :type batch_size: int
+        :return: Inserted rows and DataSource.bulk_insert statistics per shard.
+        :rtype: dict
+        """
+        position = list(columns).index(key_column)
+        groups: Dict[Hashable, List[Sequence[Any]]] = {}
+        for row in rows:
+            groups.setdefault(self.__shard_key(row[position]), []).append(row)
+
+        futures = {name: self.__pool().submit(self.__shards[name].bulk_insert, table, columns, group, batch_size) for name, group in groups.items()}
+        shards = {name: future.result() for name, future in futures.items()}
+        return {"rows": sum(stats["rows"] for stats in shards.values()), "shards": shards}
+
+    def operate_all(
+        self,
+        query: str,
+        params: Optional[Iterable] = None,
+        order_by: Union[None, int, str, Sequence, Callable] = None,
+        reverse: bool = False,
+        limit: Optional[int] = None,
+        shards: Optional[Iterable[Hashable]] = None,
+        result_format: str = "tuples",
+    ) -> List[Any]:
+        """
+        Run a read on every shard concurrently and merge the rows.
+
+        :param query: SELECT statement, must be sorted by order_by when an ordered merge is requested.
+        :type query: str
+        :param params: SQL parameters.
+        :type params: Optional[Iterable]
+        :param order_by: Column index, column name (dicts), several of them or a key function for an ordered merge.
+        :type order_by: Union[None, int, str, Sequence, Callable]
+        :param reverse: The shard results are sorted descending.
+        :type reverse: bool
+        :param limit: Row limit, pushed down to every shard unless the query already has one.
+        :type limit: Optional[int]
+        :param shards: Shard names to query, defaults to every shard.
+        :type shards: Optional[Iterable[Hashable]]
+        :param result_format: "tuples", "dicts" or "namedtuple".
+        :type result_format: str
+        :return: Merged rows.
+        :rtype: list
+        """
+        if result_format == "columns":
+            raise ValueError("Cross-shard results cannot be merged in the columns format.")
+        statement = self.__push_limit(query, limit)
+        futures = {name: self.__pool().submit(datasource.operate, statement, params, result_format=result_format) for name, datasource in self.__targets(shards).items()}
+
+        parts = []
+        for name, future in futures.items():
+            try:
+                parts.append(future.result())
+            except Exception as error:
+                journal.error(f"Shard {name!r} failed: {error}")
+                raise
+
+        key = _sort_key(order_by)
+        if key is not None:
+            rows = heapq.merge(*parts, key=key, reverse=reverse)
+        else:
+            rows = (row for part in parts for row in part)
+        return list(rows if limit is None else (row for _, row in zip(range(limit), rows)))
+
+    def iterate_all(
+        self,
+        query: str,
+        params: Optional[Iterable] = None,
+        order_by: Union[None, int, str, Sequence, Callable] = None,
+        reverse: bool = False,
+        limit: Optional[int] = None,
+        shards: Optional[Iterable[Hashable]] = None,
+        fetch_size: int = 1000,
+        prefetch: int = 4,
+        result_format: str = "tuples",
+    ) -> Iterator[Any]:
+        """
+        Stream a read from every shard concurrently, rows are yielded as shards deliver them.
+
+        Each shard is read by its own thread into a queue of at most prefetch batches.
+
+        :param query: SELECT statement, must be sorted by order_by when an ordered merge is requested.
+        :type query: str
+        :param order_by: Same as operate_all, rows are then merged in order.
+        :type order_by: Union[None, int, str, Sequence, Callable]
+        :param limit: Row limit, pushed down to every shard unless the query already has one.
+        :type limit: Optional[int]
+        :param fetch_size: Rows fetched per round trip on each shard.
+        :type fetch_size: int
+        :param prefetch: Batches buffered per shard.
+        :type prefetch: int
+        :return: Row generator.
+        :rtype: Iterator[Any]
+        """
+        if result_format == "columns":
+            raise ValueError("Cross-shard results cannot be merged in the columns format.")
+        statement = self.__push_limit(query, limit)
+        targets = self.__targets(shards)
+        stop = threading.Event()
+        key = _sort_key(order_by)
+        queues = {name: queue.Queue(maxsize=prefetch) for name in targets} if key is not None else None
+        shared = queue.Queue(maxsize=prefetch * len(targets)) if key is None else None
+
+        streams = [
+            _ShardStream(name, datasource.iterate(statement, params, fetch_size=fetch_size, batches=True, result_format=result_format), shared or queues[name], stop)
+            for name, datasource in targets.items()
+        ]
+
+        def drain(source: queue.Queue, pending: int) -> Iterator[Any]:
+            while pending:
+                name, item = source.get()
+                if item is _DONE:
+                    pending -= 1
+                elif isinstance(item, BaseException):
+                    journal.error(f"Shard {name!r} failed: {item}")
+                    raise item
+                else:
+                    yield from item
+
+        def generate() -> Iterator[Any]:
+            for stream in streams:
+                stream.start()
+            try:
+                if key is not None:
+                    rows = heapq.merge(*(drain(source, 1) for source in queues.values()), key=key, reverse=reverse)
+                else:
+                    rows = drain(shared, len(streams))
+                yield from (rows if limit is None else (row for _, row in zip(range(limit), rows)))
+            finally:
+                stop.set()
+                for stream in streams:
+                    stream.join()
+
+        return generate()
+
+    def close(self) -> None:
+
+        with self.__lock:
+            executor, self.__executor = self.__executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+        for datasource in self.__shards.values():
+            datasource.close()
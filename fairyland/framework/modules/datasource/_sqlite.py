@@ -0,0 +1,129 @@
+# coding: utf8
+"""
+@software: PyCharm
+@author: Lionel Johnson
+@contact: https://fairy.host
+@organization: https://github.com/FairylandFuture
+@since: 03 04, 2024
+"""
+
+from typing import Any, Dict, Iterable, List, Optional, Union
+import sqlite3
+
+from fairyland.framework.modules.journals import journal
+from fairyland.framework.core.abstracts.datesource import DataSource
+
+
+def _default_max_variables() -> int:
+    # SQLITE_MAX_VARIABLE_NUMBER was raised from 999 in 3.32.0.
+    return 32766 if sqlite3.sqlite_version_info >= (3, 32, 0) else 999
+
+
+class SQLiteModule(DataSource):
+    """Embedded SQLite data source, file databases get one connection per concurrently active thread."""
+
+    placeholder = "?"
+    # interrupt() only stops statements that are running when it is called.
+    discard_after_cancel = False
+
+    def __init__(
+        self,
+        database: str = ":memory:",
+        journal_mode: str = "WAL",
+        synchronous: str = "NORMAL",
+        cache_size: int = -64000,
+        mmap_size: int = 256 * 1024 * 1024,
+        busy_timeout: float = 5.0,
+        max_threads: int = 32,
+        **kwargs,
+    ):
+        """
+        Initialize the SQLite data source.
+
+        :param database: Database file, ":memory:" keeps a private in-memory database on a single connection.
+        :type database: str
+        :param journal_mode: PRAGMA journal_mode, WAL lets readers run next to a writer.
+        :type journal_mode: str
+        :param synchronous: PRAGMA synchronous, NORMAL is durable with WAL except on power loss.
+        :type synchronous: str
+        :param cache_size: PRAGMA cache_size, negative values are KiB.
+        :type cache_size: int
+        :param mmap_size: PRAGMA mmap_size in bytes, 0 disables memory-mapped I/O.
+        :type mmap_size: int
+        :param busy_timeout: Seconds to wait for a lock held by another connection.
+        :type busy_timeout: float
+        :param max_threads: Connections opened at most for concurrent threads of a file database.
+        :type max_threads: int
+        :param kwargs: Other DataSource options.
+        """
+        self.__database = database
+        self.__pragmas = {"journal_mode": journal_mode, "synchronous": synchronous, "cache_size": int(cache_size), "mmap_size": int(mmap_size)}
+        self.__busy_timeout = busy_timeout
+        self.__max_variables: Optional[int] = None
+
+        if database != ":memory:" and not database.startswith("file::memory:"):
+            # Connections are cheap, a pool without expiry keeps one warm connection per active thread.
+            kwargs.setdefault("pooling", True)
+            kwargs.setdefault("pool_max_size", max_threads)
+            kwargs.setdefault("pool_max_idle", None)
+            kwargs.setdefault("pool_max_lifetime", None)
+            kwargs.setdefault("pool_ping", False)
+
+        super().__init__(**kwargs)
+
+    def connect(self):
+        try:
+            results = sqlite3.connect(self.__database, timeout=self.__busy_timeout, check_same_thread=False, uri=self.__database.startswith("file:"))
+            for name, value in self.__pragmas.items():
+                if name == "journal_mode" and self.__database == ":memory:":
+                    continue
+                results.execute(f"PRAGMA {name} = {value}")
+            if self.__max_variables is None:
+                getlimit = getattr(results, "getlimit", None)
+                self.__max_variables = getlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER) if getlimit else _default_max_variables()
+        except Exception as error:
+            journal.error(error)
+            raise
+        return results
+
+    def set_autocommit(self, connection, autocommit: bool) -> None:
+        connection.isolation_level = None if autocommit else ""
+
+    def begin(self, connection) -> None:
+        # Take the write lock up front, a deferred transaction can fail with SQLITE_BUSY when it upgrades.
+        connection.execute("BEGIN IMMEDIATE")
+
+    def is_disconnect(self, error, connection) -> bool:
+        if isinstance(error, sqlite3.ProgrammingError) and "closed database" in str(error):
+            return True
+        return super().is_disconnect(error, connection)
+
+    def is_timeout(self, error) -> bool:
+        return isinstance(error, sqlite3.OperationalError) and str(error) == "interrupted"
+
+    def cancel(self, connection) -> None:
+        connection.interrupt()
+
+    def execute(self, query, params) -> None:
+        self.cursor.execute(query, params if params is not None else ())
+
+    def __batch_size(self, columns: List[str], batch_size: int) -> int:
+        # A statement takes at most SQLITE_LIMIT_VARIABLE_NUMBER parameters.
+        max_rows = (self.__max_variables or _default_max_variables()) // max(len(columns), 1)
+        return max(min(batch_size, max_rows), 1)
+
+    def bulk_insert(self, table: str, columns: Iterable[str], rows: Iterable, batch_size: int = 1000) -> Dict[str, Any]:
+        columns = list(columns)
+        return super().bulk_insert(table, columns, rows, batch_size=self.__batch_size(columns, batch_size))
+
+    def bulk_upsert(
+        self,
+        table: str,
+        key_columns: Union[str, Iterable[str]],
+        columns: Iterable[str],
+        rows: Iterable,
+        update_columns: Optional[Iterable[str]] = None,
+        batch_size: int = 1000,
+    ) -> Dict[str, Any]:
+        columns = list(columns)
+        return super().bulk_upsert(table, key_columns, columns, rows, update_columns, batch_size=self.__batch_size(columns, batch_size))
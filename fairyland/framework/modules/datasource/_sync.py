@@ -0,0 +1,187 @@
+# coding: utf8
+"""
+@software: PyCharm
+@author: Lionel Johnson
+@contact: https://fairy.host
+@organization: https://github.com/FairylandFuture
+@since: 03 05, 2024
+"""
+
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+from datetime import datetime
+import json
+import os
+import time
+
+from fairyland.framework.modules.journals import journal
+from fairyland.framework.core.abstracts.datesource import DataSource
+from fairyland.framework.core.abstracts.datesource._pagination import decode_token
+
+_STATE_VERSION = 1
+
+
+class _SyncTable:
+
+    __slots__ = ("table", "watermark", "key_columns", "columns", "target_table")
+
+    def __init__(self, table: str, watermark: str, key_columns: List[str], columns: Optional[List[str]], target_table: str) -> None:
+        self.table = table
+        self.watermark = watermark
+        self.key_columns = key_columns
+        self.columns = columns
+        self.target_table = target_table
+
+    @property
+    def scan_columns(self) -> List[str]:
+        # The key columns break ties between rows with the same watermark value.
+        return [self.watermark] + [column for column in self.key_columns if column != self.watermark]
+
+
+class TableSync:
+    """Copies rows changed since the last run from a source to a target data source, one watermark per table."""
+
+    def __init__(self, source: DataSource, target: DataSource, state_path: str, page_size: int = 5000, prefetch: bool = True) -> None:
+        """
+        Initialize the job, watermarks of earlier runs are read from the state file.
+
+        :param source: Data source the rows are read from.
+        :type source: DataSource
+        :param target: Data source the rows are written to.
+        :type target: DataSource
+        :param state_path: JSON file keeping the watermark of every table, written after each page.
+        :type state_path: str
+        :param page_size: Rows read and written per page, every page is one target transaction.
+        :type page_size: int
+        :param prefetch: Read the next page while the current one is written.
+        :type prefetch: bool
+        """
+        if page_size < 1:
+            raise ValueError("page_size must be a positive integer.")
+        self.__source = source
+        self.__target = target
+        self.__state_path = state_path
+        self.__page_size = page_size
+        self.__prefetch = prefetch
+        self.__tables: Dict[str, _SyncTable] = {}
+        self.__state: Dict[str, Dict[str, Any]] = self.__load()
+
+    def __load(self) -> Dict[str, Dict[str, Any]]:
+        if not os.path.exists(self.__state_path):
+            return {}
+        with open(self.__state_path, "r", encoding="utf-8") as file:
+            document = json.load(file)
+        if document.get("version") != _STATE_VERSION:
+            raise ValueError(f"Unsupported sync state version in {self.__state_path}: {document.get('version')}")
+        return document["tables"]
+
+    def __save(self) -> None:
+        # Written next to the state file and renamed, a crash never leaves a truncated file behind.
+        temporary = self.__state_path + ".tmp"
+        with open(temporary, "w", encoding="utf-8") as file:
+            json.dump({"version": _STATE_VERSION, "tables": self.__state}, file, ensure_ascii=False, indent=2)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, self.__state_path)
+
+    def add(self, table: str, watermark: str, key_columns: Iterable[str], columns: Optional[Iterable[str]] = None, target_table: Optional[str] = None) -> "TableSync":
+        """
+        Register a table, the job tracks it under the target table name.
+
+        :param table: Source table.
+        :type table: str
+        :param watermark: Column that grows with every change, e.g. updated_at or an auto-increment id; indexed together with the key.
+        :type watermark: str
+        :param key_columns: Primary key columns, unique in the target table too, rows with the same key are updated.
+        :type key_columns: Iterable[str]
+        :param columns: Columns to copy, defaults to every column of the source table.
+        :type columns: Optional[Iterable[str]]
+        :param target_table: Target table, defaults to the source table name.
+        :type target_table: Optional[str]
+        :return: The job, for chaining.
+        :rtype: TableSync
+        """
+        key_columns = [key_columns] if isinstance(key_columns, str) else list(key_columns)
+        if not key_columns:
+            raise ValueError("At least one key column is required.")
+        columns = list(columns) if columns is not None else None
+        if columns is not None:
+            missing = [column for column in [watermark] + key_columns if column not in columns]
+            if missing:
+                raise ValueError(f"Columns {missing} of the watermark and key have to be copied.")
+        target_table = target_table or table
+        self.__tables[target_table] = _SyncTable(table, watermark, key_columns, columns, target_table)
+        return self
+
+    def watermarks(self) -> Dict[str, Optional[tuple]]:
+        """
+        Last synchronized watermark and key of every registered table.
+
+        :return: Target table name to (watermark, key...) values, None for tables not synchronized yet.
+        :rtype: dict
+        """
+        results = {}
+        for name, spec in self.__tables.items():
+            token = self.__state.get(name, {}).get("token")
+            results[name] = decode_token(token, spec.scan_columns) if token else None
+        return results
+
+    def reset(self, tables: Optional[Iterable[str]] = None) -> None:
+        """
+        Forget watermarks, the next run copies these tables completely.
+
+        :param tables: Target table names, defaults to every table in the state file.
+        :type tables: Optional[Iterable[str]]
+        :return: None
+        :rtype: None
+        """
+        for name in list(self.__state) if tables is None else tables:
+            self.__state.pop(name, None)
+        self.__save()
+
+    def __select(self, spec: _SyncTable) -> str:
+        quote = self.__source.quote_identifier
+        columns = ", ".join(quote(column) for column in spec.columns) if spec.columns else "*"
+        return f"SELECT {columns} FROM {quote(spec.table)}"
+
+    def __apply(self, spec: _SyncTable, names: Sequence[str], rows: Sequence[Sequence[Any]]) -> None:
+        with self.__target.transaction():
+            self.__target.bulk_upsert(spec.target_table, spec.key_columns, names, rows, batch_size=self.__page_size)
+
+    def __sync(self, spec: _SyncTable) -> Dict[str, Any]:
+        source = self.__select(spec)
+        names = list(self.__source.operate(f"{source} WHERE 1 = 0", result_format="columns").names)
+        state = self.__state.setdefault(spec.target_table, {})
+        rows = 0
+        pages = 0
+        start_time = time.perf_counter()
+
+        for page in self.__source.paginate(source, spec.scan_columns, self.__page_size, resume=state.get("token"), prefetch=self.__prefetch):
+            self.__apply(spec, names, page.rows)
+            rows += len(page)
+            pages += 1
+            state["token"] = page.token
+            state["rows"] = state.get("rows", 0) + len(page)
+            state["synced_at"] = datetime.now().isoformat(timespec="seconds")
+            self.__save()
+
+        seconds = time.perf_counter() - start_time
+        results = {"rows": rows, "pages": pages, "seconds": seconds, "rows_per_second": rows / seconds if seconds > 0 else 0.0}
+        journal.info(f"Synchronized {spec.table}: {rows} changed rows in {pages} pages, {results['rows_per_second']:.0f} rows/s.")
+        return results
+
+    def run(self, tables: Optional[Iterable[str]] = None) -> Dict[str, Dict[str, Any]]:
+        """
+        Copy the rows changed since the last run, an interrupted run continues after its last written page.
+
+        Each page is upserted into the target in one transaction, so a page written twice leaves the same result.
+
+        :param tables: Target table names, defaults to every registered table.
+        :type tables: Optional[Iterable[str]]
+        :return: Copied rows, pages, elapsed seconds and rows per second per table.
+        :rtype: dict
+        """
+        names = list(self.__tables) if tables is None else list(tables)
+        unknown = [name for name in names if name not in self.__tables]
+        if unknown:
+            raise ValueError(f"Tables not registered for synchronization: {unknown}")
+        return {name: self.__sync(self.__tables[name]) for name in names}
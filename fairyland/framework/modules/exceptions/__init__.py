@@ -35,3 +35,9 @@ class SQLExecutionError(ProjectError):
 
     def __init__(self, message: str = "SQL exection error."):
         super().__init__(message=message)
+
+
+class SQLTimeoutError(SQLExecutionError):
+
+    def __init__(self, message: str = "SQL statement timeout."):
+        super().__init__(message=message)
@@ -0,0 +1,398 @@
+# coding: utf8
+"""
+@software: PyCharm
+@author: Lionel Johnson
+@contact: https://fairy.host
+@organization: https://github.com/FairylandFuture
+@since: 03 05, 2024
+
+DataSource benchmarks against local stand-ins, run with:
+
+    python -m fairyland.framework.test.benchmark --save baseline.json
+    python -m fairyland.framework.test.benchmark --compare baseline.json
+"""
+
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+import argparse
+import asyncio
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+from fairyland.framework.core.abstracts.datesource import AsyncDataSource
+from fairyland.framework.core.abstracts.datesource import DataSource
+from fairyland.framework.modules.datasource import SQLiteModule
+
+_SELECT_DESCRIPTION = (("id", 8, None, None, None, None, None), ("name", 253, None, None, None, None, None))
+
+
+class FakeCursor:
+    """DB-API cursor returning canned rows after a configurable delay per execute."""
+
+    def __init__(self, connection: "FakeConnection") -> None:
+        self.__connection = connection
+        self.__rows: Sequence[Any] = ()
+        self.__position = 0
+        self.description = None
+        self.rowcount = -1
+        self.arraysize = 1
+
+    def execute(self, query: str, params: Optional[Sequence[Any]] = None) -> None:
+        if self.__connection.latency:
+            time.sleep(self.__connection.latency)
+        if query.lstrip()[:6].lower() == "select":
+            self.__rows = self.__connection.rows
+            self.description = _SELECT_DESCRIPTION
+        else:
+            self.__rows = ()
+            self.description = None
+        self.__position = 0
+        self.rowcount = len(self.__rows)
+
+    def fetchall(self) -> List[Any]:
+        rows = list(self.__rows[self.__position :])
+        self.__position = len(self.__rows)
+        return rows
+
+    def fetchmany(self, size: Optional[int] = None) -> List[Any]:
+        end = self.__position + (size or self.arraysize)
+        rows = list(self.__rows[self.__position : end])
+        self.__position = min(end, len(self.__rows))
+        return rows
+
+    def fetchone(self) -> Optional[Any]:
+        rows = self.fetchmany(1)
+        return rows[0] if rows else None
+
+    def close(self) -> None:
+        self.__rows = ()
+
+
+class FakeConnection:
+    """DB-API connection of the fake driver, every SELECT returns the same rows, commits and rollbacks are counted."""
+
+    def __init__(self, latency: float = 0.0, rows: int = 10) -> None:
+        self.latency = latency
+        self.rows = tuple((index, f"name-{index}") for index in range(rows))
+        self.commits = 0
+        self.rollbacks = 0
+
+    def cursor(self) -> FakeCursor:
+        return FakeCursor(self)
+
+    def commit(self) -> None:
+        self.commits += 1
+
+    def rollback(self) -> None:
+        self.rollbacks += 1
+
+    def close(self) -> None:
+        return
+
+
+class FakeDataSource(DataSource):
+
+    def __init__(self, latency: float = 0.0, rows: int = 10, **kwargs):
+        self.__latency = latency
+        self.__rows = rows
+        # Every connection opened, in order, for checks on commits and rollbacks.
+        self.connections: List[FakeConnection] = []
+
+        super().__init__(**kwargs)
+
+    def connect(self):
+        connection = FakeConnection(self.__latency, self.__rows)
+        self.connections.append(connection)
+        return connection
+
+    def execute(self, query, params) -> None:
+        self.cursor.execute(query, params)
+
+
+class AsyncFakeCursor:
+    """asyncio cursor of the fake driver, waits on the event loop per execute so tasks can be cancelled mid-statement."""
+
+    def __init__(self, connection: "AsyncFakeConnection") -> None:
+        self.__connection = connection
+        self.__cursor = FakeCursor(connection.driver)
+        self.closed = False
+
+    @property
+    def description(self) -> Optional[Sequence[Any]]:
+        return self.__cursor.description
+
+    @property
+    def rowcount(self) -> int:
+        return self.__cursor.rowcount
+
+    async def execute(self, query: str, params: Optional[Sequence[Any]] = None) -> None:
+        await asyncio.sleep(self.__connection.latency)
+        self.__cursor.execute(query, params)
+
+    async def fetchall(self) -> List[Any]:
+        return self.__cursor.fetchall()
+
+    async def fetchmany(self, size: Optional[int] = None) -> List[Any]:
+        return self.__cursor.fetchmany(size)
+
+    async def close(self) -> None:
+        self.closed = True
+        self.__cursor.close()
+
+
+class AsyncFakeConnection:
+    """asyncio connection of the fake driver, counts commits and rollbacks."""
+
+    def __init__(self, latency: float = 0.0, rows: int = 10) -> None:
+        self.latency = latency
+        self.driver = FakeConnection(rows=rows)
+        self.commits = 0
+        self.rollbacks = 0
+        self.closed = False
+
+    def cursor(self) -> AsyncFakeCursor:
+        return AsyncFakeCursor(self)
+
+    async def commit(self) -> None:
+        self.commits += 1
+
+    async def rollback(self) -> None:
+        self.rollbacks += 1
+
+    async def close(self) -> None:
+        self.closed = True
+
+
+class AsyncFakeDataSource(AsyncDataSource):
+
+    def __init__(self, latency: float = 0.0, rows: int = 10, **kwargs):
+        self.__latency = latency
+        self.__rows = rows
+        # Every connection opened, in order, for checks on commits, rollbacks and closing.
+        self.connections: List[AsyncFakeConnection] = []
+
+        super().__init__(**kwargs)
+
+    async def connect(self):
+        connection = AsyncFakeConnection(self.__latency, self.__rows)
+        self.connections.append(connection)
+        return connection
+
+    async def execute(self, query, params) -> None:
+        await self.cursor.execute(query, params)
+
+
+def _percentile(samples: List[float], fraction: float) -> float:
+    return samples[min(int(fraction * len(samples)), len(samples) - 1)]
+
+
+class DataSourceBenchmark:
+    """Times DataSource code paths and records ops/sec, latency percentiles and allocations per call."""
+
+    def __init__(self, iterations: int = 2000, warmup: int = 100, latency: float = 0.0, rows: int = 100) -> None:
+        """
+        :param iterations: Timed calls per case.
+        :type iterations: int
+        :param warmup: Untimed calls before measuring.
+        :type warmup: int
+        :param latency: Seconds the fake driver sleeps per execute.
+        :type latency: float
+        :param rows: Rows returned by each read.
+        :type rows: int
+        """
+        self.iterations = iterations
+        self.warmup = warmup
+        self.latency = latency
+        self.rows = rows
+        self.__datasources: List[DataSource] = []
+
+    @property
+    def datasources(self) -> Tuple[DataSource, ...]:
+        return tuple(self.__datasources)
+
+    def close(self) -> None:
+        """
+        Close the data sources opened by cases.
+
+        :return: None
+        :rtype: None
+        """
+        datasources, self.__datasources = self.__datasources, []
+        for datasource in datasources:
+            datasource.close()
+
+    def measure(self, function: Callable[[], Any]) -> Dict[str, float]:
+        """
+        Benchmark one callable.
+
+        Allocations are measured in a separate, shorter run since tracing slows every call down.
+
+        :param function: Code path to measure.
+        :type function: Callable
+        :return: Throughput, latency percentiles in microseconds and allocations per call.
+        :rtype: dict
+        """
+        for _ in range(self.warmup):
+            function()
+
+        samples = []
+        clock = time.perf_counter
+        start_time = clock()
+        for _ in range(self.iterations):
+            begin = clock()
+            function()
+            samples.append(clock() - begin)
+        total = clock() - start_time
+        samples.sort()
+
+        calls = max(self.iterations // 10, 1)
+        tracemalloc.start()
+        try:
+            before = tracemalloc.take_snapshot()
+            for _ in range(calls):
+                function()
+            after = tracemalloc.take_snapshot()
+        finally:
+            tracemalloc.stop()
+        allocated = [stat for stat in after.compare_to(before, "filename") if stat.size_diff > 0]
+
+        return {
+            "ops_per_second": self.iterations / total,
+            "p50_us": _percentile(samples, 0.50) * 1e6,
+            "p95_us": _percentile(samples, 0.95) * 1e6,
+            "p99_us": _percentile(samples, 0.99) * 1e6,
+            "max_us": samples[-1] * 1e6,
+            "allocated_blocks": sum(stat.count_diff for stat in allocated) / calls,
+            "allocated_bytes": sum(stat.size_diff for stat in allocated) / calls,
+        }
+
+    def cases(self) -> Dict[str, Callable[[], Any]]:
+        """
+        Code paths to measure, the raw_driver case is the floor the framework overhead is measured against.
+
+        The data sources behind the cases stay open until close().
+
+        :return: Case name to callable.
+        :rtype: dict
+        """
+        fake = FakeDataSource(latency=self.latency, rows=self.rows)
+        pooled = FakeDataSource(latency=self.latency, rows=self.rows, pooling=True, pool_ping=False)
+        raw = FakeConnection(self.latency, self.rows)
+
+        lite = SQLiteModule()
+        self.__datasources.extend((fake, pooled, lite))
+        lite.operate("CREATE TABLE bench (id INTEGER PRIMARY KEY, name TEXT)")
+        lite.bulk_insert("bench", ["id", "name"], ((index, f"name-{index}") for index in range(self.rows * 10)))
+        bulk_rows = [(index, f"name-{index}") for index in range(1000)]
+        lite.operate("CREATE TABLE bulk (id INTEGER, name TEXT)")
+
+        def raw_driver() -> Any:
+            cursor = raw.cursor()
+            cursor.execute("SELECT id, name FROM bench", None)
+            rows = cursor.fetchall()
+            raw.commit()
+            cursor.close()
+            return rows
+
+        def sqlite_bulk_insert() -> Any:
+            lite.bulk_insert("bulk", ["id", "name"], bulk_rows)
+            lite.operate("DELETE FROM bulk")
+
+        statements = ["SELECT id, name FROM bench"] * 5
+
+        return {
+            "raw_driver": raw_driver,
+            "fake_operate": lambda: fake.operate("SELECT id, name FROM bench"),
+            "fake_operate_pooled": lambda: pooled.operate("SELECT id, name FROM bench"),
+            "fake_operate_list": lambda: fake.operate(statements, [None] * len(statements)),
+            "fake_operate_dicts": lambda: fake.operate("SELECT id, name FROM bench", result_format="dicts"),
+            "fake_iterate": lambda: sum(1 for _ in fake.iterate("SELECT id, name FROM bench", fetch_size=20)),
+            "fake_bulk_insert": lambda: fake.bulk_insert("bench", ["id", "name"], bulk_rows),
+            "sqlite_operate": lambda: lite.operate("SELECT id, name FROM bench LIMIT ?", (self.rows,)),
+            "sqlite_iterate": lambda: sum(1 for _ in lite.iterate("SELECT id, name FROM bench", fetch_size=100)),
+            "sqlite_bulk_insert": sqlite_bulk_insert,
+        }
+
+    def run(self, selected: Optional[Sequence[str]] = None) -> Dict[str, Any]:
+        """
+        Run the benchmark cases.
+
+        :param selected: Case names to run, defaults to all.
+        :type selected: Optional[Sequence[str]]
+        :return: Environment and results per case.
+        :rtype: dict
+        """
+        results = {}
+        try:
+            for name, function in self.cases().items():
+                if selected and name not in selected:
+                    continue
+                results[name] = self.measure(function)
+                print(f"{name:<24} {results[name]['ops_per_second']:>12.0f} ops/s  p50 {results[name]['p50_us']:>9.1f}us  p99 {results[name]['p99_us']:>9.1f}us")
+        finally:
+            self.close()
+        return {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "iterations": self.iterations,
+            "latency": self.latency,
+            "rows": self.rows,
+            "results": results,
+        }
+
+    @staticmethod
+    def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float = 0.10) -> List[str]:
+        """
+        Cases whose throughput dropped or allocations grew by more than the tolerance.
+
+        :param current: Result of run.
+        :type current: dict
+        :param baseline: Saved result of an earlier run.
+        :type baseline: dict
+        :param tolerance: Accepted relative change.
+        :type tolerance: float
+        :return: Regression descriptions.
+        :rtype: list
+        """
+        regressions = []
+        for name, result in current["results"].items():
+            reference = baseline.get("results", {}).get(name)
+            if reference is None:
+                continue
+            if result["ops_per_second"] < reference["ops_per_second"] * (1 - tolerance):
+                regressions.append(f"{name}: {result['ops_per_second']:.0f} ops/s, baseline {reference['ops_per_second']:.0f} ops/s")
+            if result["allocated_bytes"] > reference["allocated_bytes"] * (1 + tolerance) + 64:
+                regressions.append(f"{name}: {result['allocated_bytes']:.0f} bytes/call, baseline {reference['allocated_bytes']:.0f} bytes/call")
+        return regressions
+
+
+def main(arguments: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark DataSource code paths.")
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds the fake driver sleeps per execute.")
+    parser.add_argument("--rows", type=int, default=100)
+    parser.add_argument("--case", action="append", help="Only run this case, repeatable.")
+    parser.add_argument("--save", help="Write the results as a JSON baseline.")
+    parser.add_argument("--compare", help="Baseline JSON to compare against, exits with 1 on regression.")
+    parser.add_argument("--tolerance", type=float, default=0.10)
+    options = parser.parse_args(arguments)
+
+    benchmark = DataSourceBenchmark(iterations=options.iterations, latency=options.latency, rows=options.rows)
+    results = benchmark.run(options.case)
+
+    if options.save:
+        with open(options.save, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+    if options.compare:
+        with open(options.compare, "r", encoding="utf-8") as file:
+            regressions = DataSourceBenchmark.compare(results, json.load(file), options.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,502 @@
+# coding: utf8
+"""
+@software: PyCharm
+@author: Lionel Johnson
+@contact: https://fairy.host
+@organization: https://github.com/FairylandFuture
+@since: 03 05, 2024
+
+Behavioural checks of the DataSource stack against local stand-ins, no database server needed:
+
+    python -m fairyland.framework.test.checks
+    python -m fairyland.framework.test.checks --check check_fake_operate
+"""
+
+from typing import Callable, Dict, List, Optional, Sequence
+from dataclasses import dataclass
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+import types
+import traceback
+
+from fairyland.framework.core.abstracts.datesource import AsyncConnectionPool
+from fairyland.framework.core.abstracts.datesource import ConnectionPool
+from fairyland.framework.core.abstracts.datesource import QueryCache
+from fairyland.framework.core.abstracts.datesource import QueryMetrics
+from fairyland.framework.core.abstracts.datesource import read_columnar
+from fairyland.framework.core.abstracts.datesource._cache import estimate_result_size
+from fairyland.framework.core.abstracts.datesource._formats import record_class
+from fairyland.framework.modules.datasource import PostgreSQLModule
+from fairyland.framework.modules.datasource import RoutingModule
+from fairyland.framework.modules.datasource import ShardedModule
+from fairyland.framework.modules.datasource import SQLiteModule
+from fairyland.framework.modules.exceptions import DataSourceError
+from fairyland.framework.modules.exceptions import SQLTimeoutError
+from fairyland.framework.test.benchmark import AsyncFakeDataSource
+from fairyland.framework.test.benchmark import AsyncFakeConnection
+from fairyland.framework.test.benchmark import DataSourceBenchmark
+from fairyland.framework.test.benchmark import FakeConnection
+from fairyland.framework.test.benchmark import FakeCursor
+from fairyland.framework.test.benchmark import FakeDataSource
+
+CHECKS: Dict[str, Callable[[], None]] = {}
+
+
+def check(function: Callable[[], None]) -> Callable[[], None]:
+    """Register a check, it passes when it returns and fails on any exception."""
+    CHECKS[function.__name__] = function
+    return function
+
+
+@check
+def check_fake_operate() -> None:
+    datasource = FakeDataSource(rows=3)
+    try:
+        assert list(datasource.operate("SELECT id, name FROM fake")) == [(0, "name-0"), (1, "name-1"), (2, "name-2")]
+        assert datasource.operate("SELECT id, name FROM fake", result_format="dicts")[0] == {"id": 0, "name": "name-0"}
+    finally:
+        datasource.close()
+
+
+@check
+def check_benchmark_closes_datasources() -> None:
+    benchmark = DataSourceBenchmark(iterations=2, warmup=0, rows=2)
+    benchmark.run(["fake_operate"])
+    assert not benchmark.datasources
+    benchmark.cases()
+    datasources = benchmark.datasources
+    benchmark.close()
+    for datasource in datasources:
+        stats = datasource.lifecycle_stats()
+        assert stats["connections_opened"] == stats["connections_closed"], stats
+
+
+@check
+def check_cache_key_keeps_literal_whitespace() -> None:
+    datasource = SQLiteModule(query_cache=QueryCache())
+    try:
+        assert datasource.operate("SELECT 'a  b'") == [("a  b",)]
+        assert datasource.operate("SELECT 'a b'") == [("a b",)]
+        assert datasource.operate("  SELECT 'a b';") == [("a b",)]
+        assert datasource.cache_stats()["hits"] == 1
+    finally:
+        datasource.close()
+
+
+@dataclass
+class _Named:
+    id: int
+    name: str
+
+
+@check
+def check_metrics_with_records() -> None:
+    datasource = FakeDataSource(rows=3, metrics=QueryMetrics())
+    try:
+        records = datasource.operate("SELECT id, name FROM fake", result_format="records")
+        assert [(record.id, record.name) for record in records] == [(0, "name-0"), (1, "name-1"), (2, "name-2")]
+        assert datasource.operate_as(_Named, "SELECT id, name FROM fake")[2] == _Named(2, "name-2")
+        stats = datasource.query_stats()[0]
+        assert stats["calls"] == 2 and stats["rows"] == 6 and stats["bytes"] > 0 and not stats["errors"], stats
+    finally:
+        datasource.close()
+
+
+class _DownDataSource(FakeDataSource):
+
+    def connect(self):
+        raise ConnectionRefusedError("server is down")
+
+
+@check
+def check_reconnect_backoff_survives_long_outage() -> None:
+    datasource = _DownDataSource(lazy=True, reconnect_attempts=1, reconnect_backoff=1e-9, reconnect_max_backoff=1e-9)
+    for _ in range(600):
+        try:
+            datasource.operate("SELECT 1")
+        except ConnectionRefusedError:
+            continue
+        raise AssertionError("operate succeeded against a down server")
+    assert datasource.lifecycle_stats()["connect_failures"] == 1200
+
+
+class _FailingDataSource(FakeDataSource):
+
+    def __init__(self, error: Exception, **kwargs):
+        self.error = error
+        self.calls = 0
+        super().__init__(**kwargs)
+
+    def execute(self, query, params) -> None:
+        self.calls += 1
+        raise self.error
+
+
+@check
+def check_routing_fails_over_on_connection_errors_only() -> None:
+    primary = FakeDataSource(rows=1)
+    replica = _FailingDataSource(SQLTimeoutError("canceled"), lazy=True)
+    router = RoutingModule(primary, [replica])
+    try:
+        try:
+            router.operate("SELECT id FROM fake")
+        except SQLTimeoutError:
+            pass
+        else:
+            raise AssertionError("a replica timeout was retried on the primary")
+        stats = router.stats()
+        assert stats["primary_reads"] == 0 and stats["replica_failures"] == 0, stats
+        # Still in rotation, the next read goes to the replica again.
+        calls = replica.calls
+        try:
+            router.operate("SELECT id FROM fake")
+        except SQLTimeoutError:
+            pass
+        assert replica.calls > calls
+
+        replica.error = ConnectionResetError("connection reset by peer")
+        assert list(router.operate("SELECT id FROM fake")) == [(0, "name-0")]
+        stats = router.stats()
+        assert stats["primary_reads"] == 1 and stats["replica_failures"] == 1, stats
+    finally:
+        router.close()
+
+
+class _RacingDataSource(FakeDataSource):
+
+    def execute(self, query, params) -> None:
+        # Stands in for a write committed on another thread while the read runs.
+        self.query_cache.invalidate({"fake"})
+        super().execute(query, params)
+
+
+@check
+def check_cache_skips_reads_racing_a_write() -> None:
+    datasource = _RacingDataSource(rows=2, query_cache=QueryCache())
+    try:
+        datasource.operate("SELECT id, name FROM fake")
+        stats = datasource.cache_stats()
+        assert stats["puts"] == 0 and stats["stale"] == 1 and stats["entries"] == 0, stats
+    finally:
+        datasource.close()
+
+
+@check
+def check_cached_rows_are_not_shared() -> None:
+    datasource = FakeDataSource(rows=2, query_cache=QueryCache())
+    try:
+        for result_format in ("dicts", "records", "columns"):
+            first = datasource.operate("SELECT id, name FROM fake", result_format=result_format)
+            if result_format == "dicts":
+                first[0]["name"] = "changed"
+            elif result_format == "records":
+                first[0].name = "changed"
+            else:
+                first.data[1][0] = "changed"
+            second = datasource.operate("SELECT id, name FROM fake", result_format=result_format)
+            third = datasource.operate("SELECT id, name FROM fake", result_format=result_format)
+            assert second is not third
+            for result in (second, third):
+                name = result[0]["name"] if result_format == "dicts" else result[0].name if result_format == "records" else result.data[1][0]
+                assert name == "name-0", (result_format, result)
+        # The fake driver returns lists from fetchall like sqlite3 and psycopg2.
+        for query in ("SELECT id, name FROM fake", ["SELECT id, name FROM fake", "SELECT id FROM fake"]):
+            params = None if isinstance(query, str) else [None, None]
+            first = datasource.operate(query, params)
+            (first if isinstance(query, str) else first[0]).append(("changed",))
+            second = datasource.operate(query, params)
+            assert (second if isinstance(query, str) else second[0]) == [(0, "name-0"), (1, "name-1")], second
+        assert datasource.cache_stats()["hits"] == 8
+    finally:
+        datasource.close()
+
+
+class _PostgreSQLConnection:
+
+    def __init__(self, autocommit: bool) -> None:
+        self.autocommit = autocommit
+
+    def cursor(self, name=None, withhold=False):
+        return types.SimpleNamespace(name=name, withhold=withhold, itersize=None)
+
+
+@check
+def check_postgresql_stream_cursor_in_autocommit() -> None:
+    # stream_cursor only uses the connection, no server is needed to check the cursor options.
+    cursor = PostgreSQLModule.stream_cursor(None, _PostgreSQLConnection(autocommit=True), 500)
+    assert cursor.name and cursor.withhold and cursor.itersize == 500, cursor
+    cursor = PostgreSQLModule.stream_cursor(None, _PostgreSQLConnection(autocommit=False), 500)
+    assert cursor.name and not cursor.withhold, cursor
+
+
+_RUNAWAY = "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) SELECT count(*) FROM n"
+
+
+@check
+def check_parallel_timeout_cancels_statements() -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        datasource = SQLiteModule(os.path.join(directory, "parallel.db"), pool_max_size=2)
+        try:
+            results = datasource.operate_parallel([_RUNAWAY, "SELECT 1"], timeout=0.2, return_exceptions=True)
+            assert isinstance(results[0], Exception) and results[1] == [(1,)], results
+            # The runaway statement is interrupted, so its connection goes back to the pool.
+            deadline = time.monotonic() + 5.0
+            while datasource.pool_stats()["in_use"] and time.monotonic() < deadline:
+                time.sleep(0.01)
+            assert not datasource.pool_stats()["in_use"], datasource.pool_stats()
+        finally:
+            datasource.close()
+
+
+async def _async_operate() -> None:
+    async with AsyncFakeDataSource(rows=3, pool_ping=False) as datasource:
+        assert list(await datasource.operate("SELECT id, name FROM fake")) == [(0, "name-0"), (1, "name-1"), (2, "name-2")]
+        results = await datasource.operate(["SELECT id, name FROM fake", "UPDATE fake SET name = 'x'"], [None, None])
+        assert len(results[0]) == 3 and list(results[1]) == [], results
+        connection = datasource.connections[0]
+        assert connection.commits == 2 and not connection.rollbacks
+        assert datasource.pool_stats()["in_use"] == 0
+
+
+@check
+def check_async_operate() -> None:
+    asyncio.run(_async_operate())
+
+
+async def _async_iterate_closed_early() -> None:
+    async with AsyncFakeDataSource(rows=10, pool_ping=False) as datasource:
+        stream = datasource.iterate("SELECT id, name FROM fake", fetch_size=3)
+        assert await stream.__anext__() == (0, "name-0")
+        await stream.aclose()
+        stats = datasource.pool_stats()
+        assert stats["in_use"] == 0 and stats["idle"] == 1, stats
+        # The early close rolled the stream back, the connection is reused.
+        connection = datasource.connections[0]
+        assert connection.rollbacks == 1 and not connection.commits and not connection.closed
+        rows = [row async for row in datasource.iterate("SELECT id, name FROM fake", fetch_size=3)]
+        assert len(rows) == 10 and len(datasource.connections) == 1 and connection.commits == 1 and connection.rollbacks == 1
+
+
+@check
+def check_async_iterate_closed_early() -> None:
+    asyncio.run(_async_iterate_closed_early())
+
+
+async def _async_cancel_rolls_back() -> None:
+    async with AsyncFakeDataSource(latency=5.0, pool_ping=False) as datasource:
+        task = asyncio.ensure_future(datasource.operate("UPDATE fake SET name = 'x'"))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        else:
+            raise AssertionError("operate finished despite the cancellation")
+        connection = datasource.connections[0]
+        assert connection.rollbacks == 1 and not connection.commits
+        assert datasource.pool_stats()["in_use"] == 0, datasource.pool_stats()
+
+
+@check
+def check_async_cancel_rolls_back() -> None:
+    asyncio.run(_async_cancel_rolls_back())
+
+
+class _NamedCursor(FakeCursor):
+    """Behaves like a psycopg2 named cursor, execute only declares it and the first fetch describes the columns."""
+
+    def execute(self, query, params=None) -> None:
+        super().execute(query, params)
+        self.__description, self.description = self.description, None
+
+    def fetchmany(self, size=None):
+        self.description = self.__description
+        return super().fetchmany(size)
+
+
+class _NamedCursorDataSource(FakeDataSource):
+
+    def stream_cursor(self, connection, fetch_size: int):
+        return _NamedCursor(connection)
+
+
+@check
+def check_iterate_described_after_first_fetch() -> None:
+    datasource = _NamedCursorDataSource(rows=3)
+    try:
+        assert list(datasource.iterate("SELECT id, name FROM fake", fetch_size=2, result_format="dicts"))[2] == {"id": 2, "name": "name-2"}
+        assert [row.name for row in datasource.iterate("SELECT id, name FROM fake", fetch_size=2, result_format="namedtuple")] == ["name-0", "name-1", "name-2"]
+        blocks = list(datasource.iterate("SELECT id, name FROM fake", fetch_size=2, batches=True, result_format="columns"))
+        assert [block.names for block in blocks] == [("id", "name"), ("id", "name")] and sum(len(block) for block in blocks) == 3
+    finally:
+        datasource.close()
+
+
+@check
+def check_export_described_after_first_fetch() -> None:
+    datasource = _NamedCursorDataSource(rows=3)
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "rows.jsonl")
+            assert datasource.export("SELECT id, name FROM fake", path, fetch_size=2)["rows"] == 3
+            with open(path, encoding="utf-8") as file:
+                assert [json.loads(line) for line in file][2] == {"id": 2, "name": "name-2"}
+            path = os.path.join(directory, "rows.csv")
+            datasource.export("SELECT id, name FROM fake", path, fetch_size=2)
+            with open(path, encoding="utf-8") as file:
+                assert file.readline().strip() == "id,name"
+            path = os.path.join(directory, "rows.fcol")
+            datasource.export("SELECT id, name FROM fake", path, fetch_size=2)
+            groups = list(read_columnar(path))
+            assert all(group.names == ("id", "name") for group in groups) and sum(len(group) for group in groups) == 3
+    finally:
+        datasource.close()
+
+
+@check
+def check_cache_budget_counts_every_result_format() -> None:
+    datasource = FakeDataSource(rows=20000, query_cache=QueryCache(max_bytes=100000))
+    try:
+        for result_format in ("tuples", "dicts", "records", "columns"):
+            datasource.operate("SELECT id, name FROM fake", result_format=result_format)
+            datasource.operate_as(_Named, "SELECT id, name FROM fake")
+        stats = datasource.cache_stats()
+        assert stats["entries"] == 0 and stats["hits"] == 0 and stats["bytes"] == 0, stats
+    finally:
+        datasource.close()
+    # Field values count for records and user classes, not only the slots holding them.
+    for row in (record_class(("id", "name"))(1, "x" * 100000), _Named(1, "x" * 100000)):
+        assert estimate_result_size(row) > 100000, row
+
+
+@check
+def check_sharded_limit_keeps_placeholder_limits() -> None:
+    shards = [SQLiteModule(), SQLiteModule()]
+    sharded = ShardedModule(shards, shard_key=lambda key: key % 2)
+    try:
+        for number, shard in enumerate(shards):
+            shard.operate("CREATE TABLE items (id INTEGER PRIMARY KEY)")
+            shard.bulk_insert("items", ["id"], [(index,) for index in range(number, 20, 2)])
+        rows = sharded.operate_all("SELECT id FROM items ORDER BY id LIMIT ?", [5], order_by=0, limit=5)
+        assert [row[0] for row in rows] == [0, 1, 2, 3, 4], rows
+        rows = sharded.operate_all("SELECT id FROM items ORDER BY id", order_by=0, limit=3)
+        assert [row[0] for row in rows] == [0, 1, 2], rows
+    finally:
+        for shard in shards:
+            shard.close()
+
+
+@check
+def check_iterate_closed_early_rolls_back() -> None:
+    datasource = FakeDataSource(rows=10)
+    try:
+        stream = datasource.iterate("SELECT id, name FROM fake", fetch_size=3)
+        assert next(stream) == (0, "name-0")
+        stream.close()
+        connection = datasource.connections[0]
+        assert connection.rollbacks == 1 and not connection.commits
+        assert len(list(datasource.iterate("SELECT id, name FROM fake", fetch_size=3))) == 10
+        assert connection.commits == 1 and connection.rollbacks == 1 and len(datasource.connections) == 1
+    finally:
+        datasource.close()
+
+
+def _assert_pool_stats(stats: Dict, **expected) -> None:
+    assert {name: stats[name] for name in expected} == expected, stats
+
+
+@check
+def check_connection_pool_bookkeeping() -> None:
+    pool = ConnectionPool(FakeConnection, min_size=0, max_size=1, timeout=0.01, max_lifetime=0.05, lazy=True)
+    connection = pool.acquire()
+    try:
+        pool.acquire()
+    except DataSourceError:
+        pass
+    else:
+        raise AssertionError("acquire beyond max_size succeeded")
+    pool.release(connection)
+    assert pool.acquire() is connection
+    pool.release(connection)
+    time.sleep(0.06)
+    assert pool.acquire() is not connection
+    _assert_pool_stats(pool.stats(), created=2, checkouts=3, timeouts=1, evicted_lifetime=1, discarded=1, size=1, in_use=1)
+    pool.close()
+
+
+async def _async_connection_pool_bookkeeping() -> None:
+    async def close(connection) -> None:
+        await connection.close()
+
+    async def factory() -> AsyncFakeConnection:
+        return AsyncFakeConnection()
+
+    pool = AsyncConnectionPool(factory, close, min_size=0, max_size=1, timeout=0.01, max_lifetime=0.05)
+    connection = await pool.acquire()
+    try:
+        await pool.acquire()
+    except DataSourceError:
+        pass
+    else:
+        raise AssertionError("acquire beyond max_size succeeded")
+    await pool.release(connection)
+    assert await pool.acquire() is connection
+    await pool.release(connection)
+    await asyncio.sleep(0.06)
+    assert await pool.acquire() is not connection and connection.closed
+    _assert_pool_stats(pool.stats(), created=2, checkouts=3, timeouts=1, evicted_lifetime=1, discarded=1, size=1, in_use=1)
+    await pool.close()
+
+
+@check
+def check_async_connection_pool_bookkeeping() -> None:
+    asyncio.run(_async_connection_pool_bookkeeping())
+
+
+@check
+def check_timeout_without_cancel_support() -> None:
+    datasource = FakeDataSource(latency=0.3, statement_timeout=0.1)
+    try:
+        try:
+            datasource.operate("SELECT id, name FROM fake")
+        except SQLTimeoutError:
+            pass
+        else:
+            raise AssertionError("a statement past its timeout returned rows")
+        connection = datasource.connections[0]
+        assert connection.rollbacks == 1 and not connection.commits
+        # Nothing was cancelled, the connection is healthy and reused.
+        assert datasource.lifecycle_stats()["statements_cancelled"] == 0, datasource.lifecycle_stats()
+        assert len(datasource.operate("SELECT id, name FROM fake", timeout=0)) == 10 and len(datasource.connections) == 1
+    finally:
+        datasource.close()
+
+
+def main(arguments: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Run the DataSource behavioural checks.")
+    parser.add_argument("--check", action="append", help="Only run this check, repeatable.")
+    options = parser.parse_args(arguments)
+
+    failures: List[str] = []
+    for name, function in CHECKS.items():
+        if options.check and name not in options.check:
+            continue
+        try:
+            function()
+        except Exception:
+            failures.append(name)
+            print(f"FAIL {name}\n{traceback.format_exc()}")
+        else:
+            print(f"ok   {name}")
+    print(f"{len(failures)} failed" if failures else "all checks passed")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -99,6 +99,7 @@ setuptools.setup(
         "loguru",
         "enums",
         "pymysql",
+        "aiomysql",
         "psycopg2-binary",
         "pyyaml",
         "requests",